@@ -0,0 +1,293 @@
+import argparse
+import asyncio
+import json
+import os
+import sys
+import tarfile
+import time
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from typing import Iterator, Optional, Tuple
+
+from extraction_pool import ExtractionTimeoutError, PoolSaturatedError, init_worker, run_extraction
+from parser_pool import get_parser_pool
+
+LANGUAGE_BY_EXTENSION = {
+    ".py": "python",
+    ".r": "r",
+    ".R": "r",
+    ".smk": "snakemake",
+}
+LANGUAGE_BY_FILENAME = {
+    "Snakefile": "snakemake",
+}
+
+
+def detect_language(name: str) -> Optional[str]:
+    """
+    :param name: path of a script
+    :return: tree-sitter language name of the script, None if it is not supported
+    """
+    filename = os.path.basename(name)
+    if filename in LANGUAGE_BY_FILENAME:
+        return LANGUAGE_BY_FILENAME[filename]
+    return LANGUAGE_BY_EXTENSION.get(os.path.splitext(filename)[1])
+
+
+def iter_directory(path: str) -> Iterator[Tuple[str, bytes, str]]:
+    """
+    Walks a directory in sorted order.
+
+    :param path: directory to walk
+    :return: (relative path, source, language) of every supported script, the
+        error in place of the source of a script that cannot be read
+    """
+    for directory, dirnames, filenames in os.walk(path):
+        dirnames.sort()
+        for filename in sorted(filenames):
+            language = detect_language(filename)
+            if language is None:
+                continue
+            file_path = os.path.join(directory, filename)
+            try:
+                with open(file_path, "rb") as f:
+                    source = f.read()
+            except OSError as e:
+                source = e
+            yield os.path.relpath(file_path, path), source, language
+
+
+def iter_tarball(fileobj, name: str = "tarball") -> Iterator[Tuple[str, bytes, str]]:
+    """
+    Reads a (possibly compressed) tarball member by member. A truncated or
+    corrupt tarball ends with the error in place of a source, named after the
+    member that could not be read or after the tarball.
+
+    :param fileobj: open binary file of the tarball
+    :param name: name of the tarball
+    :return: (member name, source, language) of every supported script
+    """
+    try:
+        with tarfile.open(fileobj=fileobj, mode="r:*") as tar:
+            for member in tar:
+                if not member.isfile():
+                    continue
+                language = detect_language(member.name)
+                if language is None:
+                    continue
+                try:
+                    source = tar.extractfile(member).read()
+                except Exception as e:
+                    # nothing after a broken member can be read either
+                    yield member.name, e, language
+                    return
+                yield member.name, source, language
+    except Exception as e:
+        yield name, e, None
+
+
+def iter_sources(path: str) -> Iterator[Tuple[str, bytes, str]]:
+    """
+    :param path: directory or tarball
+    :return: (name, source, language) of every supported script in it
+    """
+    if os.path.isdir(path):
+        yield from iter_directory(path)
+    else:
+        with open(path, "rb") as f:
+            yield from iter_tarball(f, path)
+
+
+def run_batch_item(name: str, code: bytes, language: str, timeout: Optional[float] = None) -> dict:
+    """
+    Extracts one script of a batch inside a worker process, a failing script
+    is reported in its record instead of raising.
+
+    :param name: name of the script in the batch
+    :param code: source of the script
+    :param language: tree-sitter language name
+    :param timeout: seconds the extraction may take
+    :return: record with the file, status, seconds and either the graph or the error
+    """
+    start = time.time()
+    record = {"file": name, "language": language}
+    try:
+        deadline = start + timeout if timeout else None
+        graph = run_extraction(code, language, deadline)
+    except Exception as e:
+        return finish_record(record, start, error=e)
+    return finish_record(record, start, graph)
+
+
+async def extract_batch_item(pool, name: str, code: bytes, language: str, retry_delay: float = 0.5) -> dict:
+    """
+    Extracts one script of a batch in the extraction pool of the server, a
+    script the pool has no room for waits until it has.
+
+    :param pool: ExtractionPool of the server
+    :param name: name of the script in the batch
+    :param code: source of the script
+    :param language: tree-sitter language name
+    :param retry_delay: seconds to wait when the pool is saturated
+    :return: record with the file, status, seconds and either the graph or the error
+    """
+    start = time.time()
+    record = {"file": name, "language": language}
+    while True:
+        try:
+            graph = await pool.extract(code, language)
+        except PoolSaturatedError:
+            await asyncio.sleep(retry_delay)
+            continue
+        except Exception as e:
+            return finish_record(record, start, error=e)
+        return finish_record(record, start, graph)
+
+
+def finish_record(record: dict, start: float, graph: dict = None, error: Exception = None) -> dict:
+    if error is None:
+        record["graph"] = graph
+        record["status"] = "ok"
+    elif isinstance(error, ExtractionTimeoutError):
+        record["status"] = "timeout"
+        record["error"] = str(error)
+    else:
+        record["status"] = "error"
+        record["error"] = "{}: {}".format(type(error).__name__, error)
+    record["seconds"] = round(time.time() - start, 3)
+    return record
+
+
+def failed_record(name: str, language: str, error: BaseException) -> dict:
+    # a worker died before it could report on its script, or the script could not be read
+    return {"file": name, "language": language, "status": "error",
+            "error": "{}: {}".format(type(error).__name__, error), "seconds": None}
+
+
+def read_source(sources):
+    """
+    :param sources: iterator of (name, source, language) of the scripts
+    :return: the next of the sources, None after the last one
+    """
+    try:
+        return next(sources, None)
+    except Exception as e:
+        # the reader gave up, the sources end here
+        return None, e, None
+
+
+def _finished(pending: dict, futures) -> Iterator[dict]:
+    for future in futures:
+        name, language = pending.pop(future)
+        try:
+            yield future.result()
+        except Exception as e:
+            yield failed_record(name, language, e)
+
+
+def extract_batch(sources, executor, max_pending: int, timeout: Optional[float] = None) -> Iterator[dict]:
+    """
+    Fans the scripts out over the executor and yields their records as they
+    finish. At most max_pending scripts are read ahead of the workers.
+
+    :param sources: (name, source, language) of the scripts
+    :param executor: process pool whose workers were set up with init_worker
+    :param max_pending: number of scripts submitted at a time
+    :param timeout: seconds a single extraction may take
+    :return: records in the order the extractions finished
+    """
+    pending = {}
+    while (source := read_source(sources)) is not None:
+        name, code, language = source
+        if isinstance(code, Exception):
+            yield failed_record(name, language, code)
+            continue
+        pending[executor.submit(run_batch_item, name, code, language, timeout)] = (name, language)
+        if len(pending) >= max_pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            yield from _finished(pending, done)
+    while pending:
+        done, _ = wait(pending, return_when=FIRST_COMPLETED)
+        yield from _finished(pending, done)
+
+
+async def extract_batch_async(sources, pool, max_pending: int, retry_delay: float = 0.5):
+    """
+    Same as extract_batch, for the event loop of the server. The scripts are
+    read in a thread and extracted through the admission control of the pool,
+    the extractions still pending are cancelled when the stream is closed,
+    e.g. because the client disconnected.
+
+    :param sources: iterator of (name, source, language) of the scripts
+    :param pool: ExtractionPool of the server
+    :param max_pending: number of scripts submitted at a time
+    :param retry_delay: seconds to wait when the pool is saturated
+    :return: records in the order the extractions finished
+    """
+    pending = {}
+    read = None
+    try:
+        while True:
+            read = asyncio.ensure_future(asyncio.to_thread(read_source, sources))
+            # the thread cannot be interrupted, a cancelled stream waits for it below
+            source = await asyncio.shield(read)
+            if source is None:
+                break
+            name, code, language = source
+            if isinstance(code, Exception):
+                yield failed_record(name, language, code)
+                continue
+            task = asyncio.ensure_future(extract_batch_item(pool, name, code, language, retry_delay))
+            pending[task] = (name, language)
+            if len(pending) >= max_pending:
+                done, _ = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for record in _finished(pending, done):
+                    yield record
+        while pending:
+            done, _ = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for record in _finished(pending, done):
+                yield record
+    finally:
+        for task in pending:
+            task.cancel()
+        if read is not None and not read.done():
+            await asyncio.wait([read])
+
+
+def init_batch_worker():
+    """
+    Sets up a worker of the command line batch, the progress printed by the
+    transformations would end up in the NDJSON written to stdout.
+    """
+    sys.stdout = open(os.devnull, "w")
+    init_worker()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Extracts the pipelines of all scripts in a directory or tarball "
+                                                 "and writes one JSON record per script.")
+    parser.add_argument("path", help="directory or tarball (.tar, .tar.gz, .tar.bz2, .tar.xz)")
+    parser.add_argument("-o", "--output", help="NDJSON file to write, defaults to stdout")
+    parser.add_argument("-w", "--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("-t", "--timeout", type=float, default=60.0, help="seconds per script")
+    args = parser.parse_args(argv)
+
+    output = open(args.output, "w") if args.output else sys.stdout
+    counts = {"ok": 0, "error": 0, "timeout": 0}
+    start = time.time()
+    # builds the grammars once before the workers are started
+    get_parser_pool().build()
+    with ProcessPoolExecutor(max_workers=args.workers, initializer=init_batch_worker) as executor:
+        for record in extract_batch(iter_sources(args.path), executor, 2 * args.workers, args.timeout):
+            output.write(json.dumps(record) + "\n")
+            output.flush()
+            counts[record["status"]] += 1
+            print("{} {} {}s".format(record["status"], record["file"], record["seconds"]), file=sys.stderr)
+    if output is not sys.stdout:
+        output.close()
+    print("--- {} scripts in {:.2f} seconds, {} ---".format(sum(counts.values()), time.time() - start, counts),
+          file=sys.stderr)
+    return 0 if counts["ok"] == sum(counts.values()) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,72 @@
+import time
+
+from regraph import NXGraph
+
+import test_scripts
+import utils
+from graph_extractor import GraphExtractor
+from indexed_graph import IndexedGraph
+from rule_executioner import INITIAL_CLEANUP_TYPES, clean_from_list, flip_tree
+from syntax_tree import CompactTree
+
+REPEAT = 5
+
+
+def clean_per_type(G: NXGraph, redundancy_list: list):
+    """
+    The cleanup before the bulk filter: one find_matching over the whole graph
+    per type and one remove_node per matched node.
+    """
+    for redundancy in redundancy_list:
+        redundancy_pattern = utils.create_pattern("node_id", "type", redundancy)
+        for instance in G.find_matching(redundancy_pattern):
+            G.remove_node(instance["node_id"])
+
+
+def copy_graph(G: NXGraph, graph_class):
+    copy = graph_class()
+    for node_id, attrs in G.nodes(data=True):
+        copy.add_node(node_id, attrs)
+    for source, target, attrs in G.edges(data=True):
+        copy.add_edge(source, target, attrs)
+    return copy
+
+
+def flipped_graph(extractor: GraphExtractor, code: str) -> IndexedGraph:
+    source = bytes(code, "utf8")
+    with extractor.parsers.parser("python") as parser:
+        tree = parser.parse(source)
+    G = CompactTree.from_tree(tree, source).to_nxgraph()
+    flip_tree(G)
+    return G
+
+
+def time_cleanup(G: NXGraph, graph_class, cleanup) -> (float, int):
+    """
+    :return: best time of REPEAT runs of the cleanup on fresh copies of the graph
+    and the number of nodes it left
+    """
+    best = None
+    for _ in range(REPEAT):
+        copy = copy_graph(G, graph_class)
+        start = time.perf_counter()
+        cleanup(copy, INITIAL_CLEANUP_TYPES)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, len(copy.nodes())
+
+
+if __name__ == "__main__":
+    extractor = GraphExtractor()
+    inputs = {
+        "code_5": test_scripts.Python.code_5,
+        "code_5 x10": test_scripts.Python.code_5 * 10,
+    }
+    for name, code in inputs.items():
+        G = flipped_graph(extractor, code)
+        print("--- {}: {} nodes ---".format(name, len(G.nodes())))
+        for graph_class in (NXGraph, IndexedGraph):
+            for cleanup in (clean_per_type, clean_from_list):
+                seconds, left = time_cleanup(G, graph_class, cleanup)
+                print("{:<14} {:<16} {:>10.4f}s {:>6} nodes left".format(
+                    graph_class.__name__, cleanup.__name__, seconds, left))
@@ -0,0 +1,67 @@
+import sqlite3
+import time
+
+import static_analysis
+import test_scripts
+from graph_extractor import GraphExtractor
+from kb_snapshot import get_knowledge_base
+from syntax_tree import CompactTree
+
+REPEAT = 20
+
+
+def call_names(extractor: GraphExtractor):
+    """
+    :return: (resolved call name, top-level modules imported by its script) of
+    every call in the Python test scripts
+    """
+    names = []
+    for name, code in vars(test_scripts.Python).items():
+        if not name.startswith("code"):
+            continue
+        source = bytes(code, "utf8")
+        with extractor.parsers.parser("python") as parser:
+            tree = CompactTree.from_tree(parser.parse(source), source)
+        mapping = static_analysis.extract_imports(tree)
+        files = static_analysis.extract_files(tree)
+        modules = {full_name.split(".")[0] for full_name in mapping.values()}
+        for node in tree.nodes_of_type("call"):
+            decoded = static_analysis.resolve_attribute_or_identifier(tree, tree.children(node)[0], mapping, files)
+            if decoded is not None:
+                names.append((decoded[0], modules))
+    return names
+
+
+def best_of(lookup, names) -> (float, int):
+    """
+    :return: best time per name of REPEAT runs of the lookup and the number of names it resolved
+    """
+    best = None
+    for _ in range(REPEAT):
+        start = time.perf_counter()
+        resolved = sum(1 for name, modules in names if lookup(name, modules) is not None)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best / len(names), resolved
+
+
+if __name__ == "__main__":
+    connection = sqlite3.connect("knowledge_base.db")
+    cursor = connection.cursor()
+    knowledge_base = get_knowledge_base(cursor)
+    names = call_names(GraphExtractor())
+
+    def sql_exact(name, modules):
+        cursor.execute("SELECT function_id FROM functions WHERE function_title = ?", (name,))
+        return cursor.fetchone()
+
+    lookups = {
+        "sql exact": sql_exact,
+        "snapshot exact": lambda name, modules: knowledge_base.get(name),
+        "snapshot suffix": knowledge_base.resolve,
+    }
+    print("--- {} calls, {} functions in the knowledge base ---".format(len(names), len(knowledge_base)))
+    for label, lookup in lookups.items():
+        seconds, resolved = best_of(lookup, names)
+        print("{:<16} {:>8.2f}us per call {:>5} resolved ({:.1%})".format(
+            label, seconds * 1e6, resolved, resolved / len(names)))
@@ -9,11 +9,12 @@ import time
 import utils
 from db_tracker import setup_db
 import itertools
+from collections import deque
 
 from tree_sitter import Language, Parser
 
 import test_scripts
-from graph_extractor import GraphExtractor
+from syntax_tree import CompactTree
 
 #We always follow up to the children of the following types
 nesting_types = {'module', 'expression_statement', 'assignment', 'call', 'argument_list', 'attribute', 'subscript', 'keyword_argument', 'from', 'dotted_name', 'block', 'for_statement'}
@@ -26,14 +27,14 @@ structure_types = nesting_types | identifier_types | {'import'}
 max_candidates = 10
 
 
-def structure_tracker(graph: NXGraph) -> Tuple[int, Dict[int, int]]:
+def structure_tracker(tree: CompactTree) -> Tuple[int, Dict[int, int]]:
     next_model_id = gen_model_id()
     down_to = max(next_model_id - max_candidates, 0)
     past_models = [(i, load_graph(i)) for i in range(down_to, next_model_id)]
-    stripped = strip_graph(graph, 0)
+    stripped = strip_graph(tree, 0)
     iso = find_isomorphism(stripped, past_models)
     if iso is None:
-        save_graph(graph, 0, next_model_id)
+        save_graph(stripped, 0, next_model_id)
         return next_model_id, dict(zip(stripped.nodes(), stripped.nodes()))
     else:
         return iso[0], iso[2]
@@ -87,32 +88,38 @@ def find_isomorphism(graph: NXGraph, comparison: List[Tuple[int, NXGraph]]) -> U
     return None
 
 
-def strip_graph(graph: NXGraph, root_id) -> NXGraph:
-    visited, queue = [], []
+def strip_graph(tree: CompactTree, root_id) -> NXGraph:
+    visited, queue = [], deque()
+    visited_set = set()
     G = NXGraph()
     queue.append(root_id)
     edge_candidates: Dict[int, List[int]] = {}
 
     while queue:
-        current_id = queue.pop(0)
-        attributes = graph.get_node(current_id)
-        (node_type,) = attributes["type"]
-        if node_type in structure_types and current_id not in visited:
+        current_id = queue.popleft()
+        node_type = tree.type(current_id)
+        if node_type in structure_types and current_id not in visited_set:
             visited.append(current_id)
+            visited_set.add(current_id)
+            attributes = {"type": node_type, "text": tree.text(current_id)}
             #Delete text attribute for everything that is not an identifier because it might contain constants
             if node_type not in identifier_types:
                 attributes["text"] = None
+            if tree.parent[current_id] != -1:
+                attributes.update({"pos": tree.position[current_id], "start": tree.start[current_id],
+                                   "end": tree.end[current_id]})
             G.add_node(current_id, attributes)
             if node_type in nesting_types:
-                queue += graph.successors(current_id)
-                edge_candidates[current_id] = graph.successors(current_id)
+                children = tree.children(current_id)
+                queue += children
+                edge_candidates[current_id] = children
 
     #Assembling edges afterwards makes sure we ignore edges from/to nodes we have removed
     edges = [
         (f, t)
         for f in visited
         for t in edge_candidates.get(f, [])
-        if t in visited
+        if t in visited_set
     ]
     G.add_edges_from(edges)
     return G
@@ -156,10 +163,9 @@ if __name__ == "__main__":
     parser.set_language(language)
     b = bytes(code, "utf8")
     tree = parser.parse(b)
-    extractor = GraphExtractor()
-    G = extractor.bfs_tree_traverser(tree)
-    utils.print_graph(G)
-    G = strip_graph(G, 0)
+    compact = CompactTree.from_tree(tree, b)
+    utils.print_graph(compact.to_nxgraph())
+    G = strip_graph(compact, 0)
     utils.print_graph(G)
     print("--- %s seconds ---" % (time.time() - start_time))
     #save_graph(G, 0, 0)
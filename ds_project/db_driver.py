@@ -5,12 +5,17 @@ from models.Function import Function
 import utils
 from utils import read_rule_from_line
 
+RULES_VERSION = "rules"
+KNOWLEDGE_BASE_VERSION = "knowledge_base"
+
 
 def init_db(cursor):
     """
     Initializes database.
 
     Creates empty tables "modules", "function", "arguments", "rules".
+    The "versions" table is kept, the versions of the rules and knowledge base
+    are bumped instead.
     :param cursor: connection cursor
     """
     cursor.execute("DROP TABLE IF EXISTS functions")
@@ -27,9 +32,38 @@ def init_db(cursor):
         "FOREIGN KEY(function_id) REFERENCES functions(function_id))")
     cursor.execute(
         "CREATE TABLE rules(rule_id, rule_name PRIMARY KEY, rule_description, rule, rule_type, added_by_user)")
+    bump_version(cursor, RULES_VERSION)
+    bump_version(cursor, KNOWLEDGE_BASE_VERSION)
     cursor.connection.commit()
 
 
+def bump_version(cursor, name):
+    """
+    Increments a version counter, to be called whenever the data it versions changes.
+
+    :param cursor: connection cursor
+    :param name: RULES_VERSION or KNOWLEDGE_BASE_VERSION
+    """
+    cursor.execute("CREATE TABLE IF NOT EXISTS versions(name PRIMARY KEY, version INTEGER)")
+    cursor.execute("INSERT OR IGNORE INTO versions(name, version) VALUES(?, 0)", [name])
+    cursor.execute("UPDATE versions SET version = version + 1 WHERE name = ?", [name])
+
+
+def get_version(cursor, name) -> int:
+    """
+    :param cursor: connection cursor
+    :param name: RULES_VERSION or KNOWLEDGE_BASE_VERSION
+    :return: current value of the version counter, 0 if it was never bumped
+    """
+    try:
+        cursor.execute("SELECT version FROM versions WHERE name = ?", [name])
+    except sqlite3.OperationalError:
+        # database created before version counters existed
+        return 0
+    row = cursor.fetchone()
+    return row[0] if row is not None else 0
+
+
 def init_module(filename, module_name, version, date, cursor):
     with open(filename, newline='') as csvfile:
         csvreader = csv.reader(csvfile)
@@ -49,6 +83,7 @@ def init_module(filename, module_name, version, date, cursor):
                 for arg in function.args:
                     cursor.execute("INSERT INTO arguments VALUES(?, ?, ?, ?, ?)",
                                    [added_function_id, arg.name, arg.type, arg.position, arg.default_value])
+    bump_version(cursor, KNOWLEDGE_BASE_VERSION)
     cursor.connection.commit()
 
 
@@ -71,6 +106,7 @@ def init_rules_from_file(cursor):
                 "INSERT INTO rules(rule_id, rule_name, rule_description, rule, rule_type, added_by_user) VALUES(?, ?, ?, ?, ?, ?)",
                 [added_rule_id, rule_name, rule_desc, str(json_rule), rule_type, added_by_user])
             added_rule_id = cursor.lastrowid
+    bump_version(cursor, RULES_VERSION)
     cursor.connection.commit()
     pass
 
@@ -37,11 +37,39 @@ def setup_db():
         )
         """
         cursor.executescript(query)
+        query = """
+        CREATE TABLE IF NOT EXISTS Hyperparameter_Counters (
+        name TEXT,
+        expr_id INTEGER,
+        run_id INTEGER,
+        next INTEGER,
+        PRIMARY KEY (name, expr_id, run_id)
+        )
+        """
+        cursor.executescript(query)
+        query = """
+        CREATE TABLE IF NOT EXISTS Tracker_Counts (
+        kind TEXT,
+        name TEXT,
+        expr_id INTEGER,
+        run_id INTEGER,
+        total INTEGER,
+        PRIMARY KEY (kind, name, expr_id, run_id)
+        )
+        """
+        cursor.executescript(query)
+        # plots used to be stored inline, one per run
+        columns = [column[1] for column in cursor.execute("PRAGMA table_info(Plots)")]
+        if "value" in columns:
+            cursor.execute("ALTER TABLE Plots RENAME TO Inline_Plots")
         query = """
            CREATE TABLE IF NOT EXISTS Plots (
-           run_id INTEGER PRIMARY KEY, 
+           run_id INTEGER, 
+           number INTEGER,
            graph_file TEXT,
-           value BLOB
+           hash TEXT,
+           size INTEGER,
+           PRIMARY KEY (run_id, number)
            )
           """
         cursor.executescript(query)
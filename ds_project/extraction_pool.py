@@ -0,0 +1,297 @@
+import asyncio
+import os
+import signal
+import sqlite3
+import threading
+import time
+import zlib
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import List
+
+import parser_pool
+from extraction_session import SessionStore
+from graph_extractor import GraphExtractor
+from kb_snapshot import get_knowledge_base
+from rule_set import get_rule_set, rule_stats
+
+# per worker process, created once by the pool initializer
+_extractor = None
+_kb_connection = None
+_sessions = None
+
+
+class PoolSaturatedError(Exception):
+    """
+    Raised when the extraction queue is full and the request should be retried later.
+    """
+    pass
+
+
+class ExtractionTimeoutError(Exception):
+    """
+    Raised when an extraction did not finish within its time limit.
+    """
+    pass
+
+
+def init_worker(session_limit=64, session_ttl=600.0):
+    """
+    Warms up a worker process with its own extractor, knowledge base connection,
+    knowledge base snapshot and compiled rule set.
+
+    :param session_limit: editor sessions kept by this worker
+    :param session_ttl: seconds after which an idle session is dropped
+    """
+    global _extractor, _kb_connection, _sessions
+    _extractor = GraphExtractor()
+    _kb_connection = sqlite3.connect("knowledge_base.db")
+    get_rule_set(_kb_connection.cursor())
+    get_knowledge_base(_kb_connection.cursor())
+    if _sessions is None:
+        _sessions = SessionStore(session_limit, session_ttl)
+
+
+def recycle_worker():
+    """
+    Replaces the extractor, parser pool and knowledge base connection of a
+    worker process. The timeout is raised wherever the extraction happens to
+    be, e.g. between two queries or while a parser is checked out, so none of
+    them are used again.
+    """
+    global _extractor, _kb_connection
+    if _kb_connection is not None:
+        try:
+            _kb_connection.close()
+        except sqlite3.Error:
+            pass
+    _extractor = _kb_connection = None
+    parser_pool.reset_parser_pool()
+    init_worker()
+
+
+def _raise_timeout(signum, frame):
+    raise ExtractionTimeoutError("extraction exceeded its time limit")
+
+
+def run_until(deadline, function, *args):
+    """
+    Calls function(*args) inside a worker process, cancelling it at the deadline.
+
+    :param deadline: time.time() value after which the job cancels itself
+    :return: what the function returns
+    """
+    use_timer = deadline is not None and hasattr(signal, "setitimer")
+    if deadline is not None:
+        remaining = deadline - time.time()
+        if remaining <= 0:
+            raise ExtractionTimeoutError("extraction expired while queued")
+        if use_timer:
+            signal.signal(signal.SIGALRM, _raise_timeout)
+            signal.setitimer(signal.ITIMER_REAL, remaining)
+    try:
+        try:
+            return function(*args)
+        finally:
+            if use_timer:
+                signal.setitimer(signal.ITIMER_REAL, 0)
+    except ExtractionTimeoutError:
+        recycle_worker()
+        raise
+
+
+def run_extraction(code, language, deadline=None):
+    """
+    Runs GraphExtractor.extract_pipeline inside a worker process.
+
+    :param code: script to extract the pipeline from
+    :param language: tree-sitter language name
+    :param deadline: time.time() value after which the job cancels itself
+    :return: graph in a json format
+    """
+    if _extractor is None:
+        init_worker()
+    return run_until(deadline, _extractor.extract_pipeline, code, language, _kb_connection)
+
+
+def run_session_update(session_id, code, language, rules_version, kb_version, deadline=None):
+    """
+    Runs ExtractionSession.update inside the worker process the session is pinned to.
+
+    :param session_id: id sent by the client
+    :param code: current script of the session
+    :param language: tree-sitter language name
+    :param rules_version: version of the rule base
+    :param kb_version: version of the knowledge base
+    :param deadline: time.time() value after which the job cancels itself
+    :return: graph in a json format
+    """
+    if _extractor is None:
+        init_worker()
+    session = _sessions.get(session_id, language)
+    return run_until(deadline, session.update, code, rules_version, kb_version, _kb_connection)
+
+
+def worker_stats() -> dict:
+    """
+    :return: counters kept inside the worker process
+    """
+    return {"sessions": _sessions.stats() if _sessions is not None else {}, "rules": rule_stats()}
+
+
+class ExtractionPool:
+    """
+    Worker processes running extractions off the event loop.
+
+    Every worker is a single process executor of its own, extractions go to
+    the least loaded worker and the updates of an editor session always go to
+    the same worker, which keeps the syntax tree of the session. At most
+    queue_size jobs are admitted at a time (running or waiting for a worker),
+    further requests are rejected with PoolSaturatedError. Every job is given
+    timeout seconds, after which it is cancelled.
+    """
+
+    def __init__(self, workers=None, queue_size=16, timeout=60.0, session_limit=64, session_ttl=600.0):
+        self.workers = workers or os.cpu_count() or 1
+        self.queue_size = queue_size
+        self.timeout = timeout
+        # the sessions are spread over the workers by their id
+        self._initargs = (-(-session_limit // self.workers), session_ttl)
+        self._executors = [self._new_executor() for _ in range(self.workers)]
+        self._load = [0] * self.workers
+        self._worker_stats = [{} for _ in range(self.workers)]
+        self.pending = 0
+        self._lock = threading.Lock()
+        self.counters = {"submitted": 0, "completed": 0, "rejected": 0, "timed_out": 0, "failed": 0,
+                         "restarted": 0}
+
+    def _new_executor(self) -> ProcessPoolExecutor:
+        return ProcessPoolExecutor(max_workers=1, initializer=init_worker, initargs=self._initargs)
+
+    def session_worker(self, session_id: str) -> int:
+        return zlib.crc32(session_id.encode("utf-8")) % self.workers
+
+    def submit(self, function, *args, worker: int = None) -> Future:
+        """
+        Runs function(*args) in a worker process, without admission control.
+
+        :param worker: index of the worker, the least loaded one if not given
+        :return: future of the result
+        """
+        with self._lock:
+            if worker is None:
+                worker = min(range(self.workers), key=self._load.__getitem__)
+            try:
+                future = self._executors[worker].submit(function, *args)
+            except BrokenProcessPool:
+                # the worker process died, together with its sessions
+                self._executors[worker] = self._new_executor()
+                self.counters["restarted"] += 1
+                future = self._executors[worker].submit(function, *args)
+            self._load[worker] += 1
+        future.add_done_callback(lambda _: self._finished(worker))
+        return future
+
+    def _replace_worker(self, worker: int):
+        """
+        Kills the process of a worker and starts a new one in its place, jobs
+        waiting for the old worker fail with BrokenProcessPool.
+
+        :param worker: index of the worker
+        """
+        with self._lock:
+            executor = self._executors[worker]
+            self._executors[worker] = self._new_executor()
+            self.counters["restarted"] += 1
+        for process in list((executor._processes or {}).values()):
+            process.terminate()
+        executor.shutdown(wait=False)
+
+    def _finished(self, worker: int):
+        with self._lock:
+            self._load[worker] -= 1
+
+    async def _run(self, worker, function, *args):
+        with self._lock:
+            if self.pending >= self.queue_size:
+                self.counters["rejected"] += 1
+                raise PoolSaturatedError("extraction queue is full")
+            if worker is None:
+                worker = min(range(self.workers), key=self._load.__getitem__)
+            self.pending += 1
+            self.counters["submitted"] += 1
+        try:
+            deadline = time.time() + self.timeout if self.timeout else None
+            future = self.submit(function, *args, deadline, worker=worker)
+            try:
+                # the worker stops itself at the deadline, this only guards against a lost worker
+                result = await asyncio.wait_for(asyncio.wrap_future(future),
+                                                self.timeout + 1 if self.timeout else None)
+            except asyncio.TimeoutError:
+                # the worker did not stop itself, e.g. stuck in a C call the alarm cannot interrupt
+                if not future.cancel():
+                    self._replace_worker(worker)
+                self.counters["timed_out"] += 1
+                raise ExtractionTimeoutError("extraction exceeded {} seconds".format(self.timeout))
+            except ExtractionTimeoutError:
+                self.counters["timed_out"] += 1
+                raise ExtractionTimeoutError("extraction exceeded {} seconds".format(self.timeout))
+            except Exception:
+                self.counters["failed"] += 1
+                raise
+            self.counters["completed"] += 1
+            return result
+        finally:
+            with self._lock:
+                self.pending -= 1
+
+    async def extract(self, code, language):
+        """
+        Extracts the pipeline of a script in a worker process.
+
+        :param code: script to extract the pipeline from
+        :param language: tree-sitter language name
+        :return: graph in a json format
+        """
+        return await self._run(None, run_extraction, code, language)
+
+    async def update_session(self, session_id, code, language, rules_version, kb_version):
+        """
+        Extracts the pipeline of the new version of a session's script
+        incrementally, in the worker the session is pinned to.
+
+        :return: graph in a json format
+        """
+        return await self._run(self.session_worker(session_id), run_session_update,
+                               session_id, code, language, rules_version, kb_version)
+
+    async def worker_stats(self, timeout=1.0) -> List[dict]:
+        """
+        Asks the idle workers for their counters, busy workers are reported
+        with the counters they last sent.
+
+        :param timeout: seconds to wait for a worker
+        :return: counters of every worker
+        """
+        for worker in range(self.workers):
+            if self._load[worker]:
+                continue
+            try:
+                self._worker_stats[worker] = await asyncio.wait_for(
+                    asyncio.wrap_future(self.submit(worker_stats, worker=worker)), timeout)
+            except (asyncio.TimeoutError, BrokenProcessPool):
+                pass
+        return list(self._worker_stats)
+
+    def stats(self) -> dict:
+        with self._lock:
+            stats = dict(self.counters)
+            stats["pending"] = self.pending
+            stats["queue_size"] = self.queue_size
+            stats["workers"] = self.workers
+            stats["load"] = list(self._load)
+            return stats
+
+    def shutdown(self):
+        for executor in self._executors:
+            executor.shutdown(wait=False, cancel_futures=True)
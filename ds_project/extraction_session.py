@@ -0,0 +1,259 @@
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+from regraph import NXGraph
+
+from indexed_graph import IndexedGraph
+from parser_pool import get_parser_pool
+from rule_executioner import apply_local_transformations, apply_global_transformations, convert_graph_to_json
+from rule_set import get_rule_set
+from syntax_tree import CompactTree
+from utils import print_graph
+
+
+def compute_edit(old: bytes, new: bytes) -> Optional[dict]:
+    """
+    Describes the change from old to new as a single tree-sitter edit, spanning
+    from the first to the last byte that differ.
+
+    :param old: previous source
+    :param new: current source
+    :return: keyword arguments for Tree.edit, None if the sources are equal
+    """
+    if old == new:
+        return None
+    limit = min(len(old), len(new))
+    start = matching_length(lambda length: old[:length] == new[:length], limit)
+    suffix = matching_length(lambda length: old[len(old) - length:] == new[len(new) - length:], limit - start)
+    return {
+        "start_byte": start,
+        "old_end_byte": len(old) - suffix,
+        "new_end_byte": len(new) - suffix,
+        "start_point": point_at(new, start),
+        "old_end_point": point_at(old, len(old) - suffix),
+        "new_end_point": point_at(new, len(new) - suffix),
+    }
+
+
+def matching_length(matches, limit: int) -> int:
+    """
+    Binary search for the longest length up to limit that matches, the slice
+    comparisons run in C instead of a Python loop over every byte.
+    """
+    low, high = 0, limit
+    while low < high:
+        middle = (low + high + 1) // 2
+        if matches(middle):
+            low = middle
+        else:
+            high = middle - 1
+    return low
+
+
+def point_at(source: bytes, offset: int) -> Tuple[int, int]:
+    """
+    :param source: source bytes
+    :param offset: byte offset into the source
+    :return: (row, column) of the offset as tree-sitter counts them
+    """
+    row = source.count(b"\n", 0, offset)
+    return row, offset - (source.rfind(b"\n", 0, offset) + 1)
+
+
+class Fragment:
+    """
+    A top-level statement after apply_local_transformations, together with
+    the imports found in it and the byte offset the statement started at
+    when it was transformed.
+    """
+
+    __slots__ = ("graph", "imports", "start")
+
+    def __init__(self, graph: NXGraph, imports: tuple, start: int):
+        self.graph = graph
+        self.imports = imports
+        self.start = start
+
+
+# id of the statement node in a graph built by CompactTree.from_statement
+STATEMENT_NODE_ID = 1
+
+
+def splice_fragments(placed: List[Tuple[Fragment, int, int]]):
+    """
+    Copies the fragments of a script into one graph, moving each to where its
+    statement is now.
+
+    :param placed: (fragment, start byte, position) of every top-level statement, in order
+    :return: the spliced graph and the merged imports
+    """
+    G = IndexedGraph()
+    aliases_dict, functions_dict, imported_modules = {}, {}, []
+    next_id = 0
+    for fragment, start, position in placed:
+        delta = start - fragment.start
+        mapping = {}
+        for node_id in sorted(fragment.graph.nodes()):
+            attrs = dict(fragment.graph.get_node(node_id))
+            if delta:
+                for key in ("start", "end"):
+                    if key in attrs:
+                        attrs[key] = {value + delta for value in attrs[key]}
+            if node_id == STATEMENT_NODE_ID and "pos" in attrs:
+                attrs["pos"] = position
+            mapping[node_id] = next_id
+            # add_node copies the attributes, the fragment stays untouched
+            G.add_node(next_id, attrs)
+            next_id += 1
+        for source_id, target_id, attrs in fragment.graph.edges(data=True):
+            G.add_edge(mapping[source_id], mapping[target_id], attrs)
+        if getattr(fragment.graph, "rule_limit", None) is not None:
+            G.rule_limit = fragment.graph.rule_limit
+        aliases, functions, modules = fragment.imports
+        aliases_dict.update(aliases)
+        functions_dict.update(functions)
+        imported_modules.extend(modules)
+    return G, (aliases_dict, functions_dict, imported_modules)
+
+
+class ExtractionSession:
+    """
+    Keeps the syntax tree and the transformed top-level statements of the
+    script an editor is working on, so an update only re-parses incrementally
+    and re-runs the local transformations of the statements that changed.
+
+    Statements are reused by their text, their result does not depend on the
+    rest of the script as long as no rule matches across top-level statements.
+    The global transformations always run on the whole spliced graph.
+    """
+
+    def __init__(self, language: str):
+        self.language = language
+        self.source: Optional[bytes] = None
+        self.tree = None
+        self.result: Optional[dict] = None
+        self.rules_version: Optional[int] = None
+        self.kb_version: Optional[int] = None
+        self.fragments: Dict[bytes, Fragment] = {}
+        self.last_used = time.time()
+        self.lock = threading.Lock()
+        self.counters = {"updates": 0, "statements_reused": 0, "statements_transformed": 0}
+
+    def update(self, code, rules_version: int = 0, kb_version: int = 0,
+               connection: sqlite3.Connection = None) -> dict:
+        """
+        Extracts the pipeline of the new version of the script.
+
+        :param code: current script, str or bytes
+        :param rules_version: version of the rule base, transformed statements are
+        dropped when it changes
+        :param kb_version: version of the knowledge base
+        :param connection: open knowledge base connection, a new one is opened if not given
+        :return: graph in a json format
+        """
+        source = code if isinstance(code, bytes) else bytes(code, "utf8")
+        with self.lock:
+            self.last_used = time.time()
+            if rules_version != self.rules_version:
+                self.fragments = {}
+            elif source == self.source and kb_version == self.kb_version and self.result is not None:
+                return self.result
+            self.rules_version, self.kb_version = rules_version, kb_version
+            try:
+                return self._update(source, connection)
+            except BaseException:
+                # the old tree may already be edited, the next update starts over
+                self.source, self.tree, self.result = None, None, None
+                raise
+
+    def _update(self, source: bytes, connection: sqlite3.Connection = None) -> dict:
+        old_tree = None
+        if self.tree is not None:
+            old_tree = self.tree
+            edit = compute_edit(self.source, source)
+            if edit is not None:
+                old_tree.edit(**edit)
+        with get_parser_pool().parser(self.language) as parser:
+            tree = parser.parse(source, old_tree) if old_tree is not None else parser.parse(source)
+
+        if connection is None:
+            connection = sqlite3.connect("knowledge_base.db")
+        cursor = connection.cursor()
+        rules = None
+        fragments = {}
+        placed = []
+        root_node = tree.root_node
+        for position, statement_node in enumerate(root_node.children):
+            key = source[statement_node.start_byte:statement_node.end_byte]
+            fragment = fragments.get(key) or self.fragments.get(key)
+            if fragment is None:
+                if rules is None:
+                    rules = get_rule_set(cursor)
+                G = CompactTree.from_statement(root_node, statement_node, position, source).to_nxgraph(flipped=True)
+                G, imports = apply_local_transformations(G, rules)
+                fragment = Fragment(G, imports, statement_node.start_byte)
+                self.counters["statements_transformed"] += 1
+            else:
+                self.counters["statements_reused"] += 1
+            fragments[key] = fragment
+            placed.append((fragment, statement_node.start_byte, position))
+
+        G, imports = splice_fragments(placed)
+        G = apply_global_transformations(G, imports, cursor)
+        print_graph(G)
+        self.result = convert_graph_to_json(G)
+        self.source, self.tree, self.fragments = source, tree, fragments
+        self.counters["updates"] += 1
+        return self.result
+
+
+class SessionStore:
+    """
+    Sessions by id, the least recently used one is dropped when there are more
+    than max_sessions and sessions idle for ttl seconds expire.
+    """
+
+    def __init__(self, max_sessions=64, ttl=600.0):
+        self.max_sessions = max_sessions
+        self.ttl = ttl
+        self._sessions: "OrderedDict[str, ExtractionSession]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.counters = {"created": 0, "expired": 0, "evicted": 0}
+
+    def get(self, session_id: str, language: str) -> ExtractionSession:
+        """
+        :param session_id: id sent by the client
+        :param language: tree-sitter language name, a session changing it starts over
+        :return: the session, created if it does not exist
+        """
+        with self._lock:
+            self._expire()
+            session = self._sessions.get(session_id)
+            if session is None or session.language != language:
+                session = ExtractionSession(language)
+                self._sessions[session_id] = session
+                self.counters["created"] += 1
+            self._sessions.move_to_end(session_id)
+            while len(self._sessions) > self.max_sessions:
+                self._sessions.popitem(last=False)
+                self.counters["evicted"] += 1
+            return session
+
+    def _expire(self):
+        now = time.time()
+        for session_id in [session_id for session_id, session in self._sessions.items()
+                           if now - session.last_used > self.ttl]:
+            del self._sessions[session_id]
+            self.counters["expired"] += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            stats = dict(self.counters)
+            stats["sessions"] = len(self._sessions)
+            for session in self._sessions.values():
+                for key, value in session.counters.items():
+                    stats[key] = stats.get(key, 0) + value
+            return stats
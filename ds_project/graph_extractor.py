@@ -1,70 +1,39 @@
 from rule_executioner import transform_graph
-from tree_sitter import Language, Parser
+from parser_pool import get_parser_pool
 import test_scripts
 import time
-from regraph import NXGraph
+from syntax_tree import CompactTree
 
 
 class GraphExtractor:
 
     def __init__(self):
-        Language.build_library(
-            # Store the library in the `build` directory
-            'build/my-languages.so',
-            # Include one or more languages
-            [
-                'parsers/tree-sitter-python',
-                'parsers/tree-sitter-r',
-                'parsers/tree-sitter-snakemake-pure'
-            ]
-        )
+        # compiles the grammars only if their sources changed since the last build
+        self.parsers = get_parser_pool()
+        self.parsers.build()
 
-    def extract_pipeline(self, code, language):
+    def extract_pipeline(self, code, language, connection=None, json_path=None):
         assert language != '', 'language is not set'
-        language = Language('build/my-languages.so', language)
-        parser = Parser()
-        parser.set_language(language)
-        b = bytes(code, "utf8")
-        tree = parser.parse(b)
-        nxgraph = self.bfs_tree_traverser(tree)
-        G = transform_graph(nxgraph)
+        # uploads are already bytes, only code from a form is encoded
+        b = code if isinstance(code, bytes) else bytes(code, "utf8")
+        with self.parsers.parser(language) as parser:
+            tree = parser.parse(b)
+        # the NXGraph is only materialised for the regraph based transformations,
+        # already flipped so flip_tree has nothing left to do
+        nxgraph = CompactTree.from_tree(tree, b).to_nxgraph(flipped=True)
+        G = transform_graph(nxgraph, connection, json_path)
         return G
 
 
-    def bfs_tree_traverser(self, tree):
+    def bfs_tree_traverser(self, tree, flipped=False):
         """
         Traverses a tree-sitter with Breadth-first search algorithm and
         converts it into an NXGraph
         :param tree: tree-sitter to be traversed
+        :param flipped: emit child -> parent edges, as flip_tree would turn them
         :return: NXGraph after traversal of a tree-sitter tree
         """
-        root_node = tree.root_node
-        G = NXGraph()
-        node_id, parent_id = 0, 0
-        # lists to queue the nodes in order and identify already visited nodes
-        visited, queue = [], []
-        visited.append(root_node)
-        queue.append(root_node)
-
-        # add root_node to the graph
-        G.add_node(0, attrs={"type": root_node.type, "text": root_node.text})
-
-        # loop to visit each node
-        while queue:
-            node = queue.pop(0)
-            for i, child_node in enumerate(node.children):
-                if child_node not in visited:
-                    node_id += 1
-                    # add child node to graph
-                    G.add_node(node_id, attrs={"type": child_node.type, "text": child_node.text, "pos": i, "start": child_node.start_byte, "end": child_node.end_byte})
-                    # add edge between parent_node and child_node
-                    G.add_edge(parent_id, node_id)
-                    visited.append(child_node)
-                    queue.append(child_node)
-            # set parent_id to the id of the next node in queue
-            parent_id = parent_id + 1
-
-        return G
+        return CompactTree.from_tree(tree).to_nxgraph(flipped)
 
 
 if __name__ == "__main__":
@@ -73,6 +42,6 @@ if __name__ == "__main__":
     code = test_scripts.Python.code_0
     start = time.time()
     extractor = GraphExtractor()
-    extractor.extract_pipeline(code, language)
+    extractor.extract_pipeline(code, language, json_path='graph.json')
     print("--- %s seconds ---" % (time.time() - start_time))
 
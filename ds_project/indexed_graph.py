@@ -0,0 +1,274 @@
+from typing import Dict, FrozenSet, List, Optional
+
+import networkx as nx
+from regraph import NXGraph, FiniteSet
+from regraph.exceptions import GraphError
+from regraph.utils import valid_attributes
+
+# node attributes whose values are indexed
+INDEXED_ATTRS = ("type", "text", "identifier")
+
+
+class IndexedGraph(NXGraph):
+    """
+    NXGraph keeping an index from the values of the type, text and identifier
+    attributes to the nodes carrying them.
+
+    The index follows add_node, remove_node and update_node_attrs, which every
+    other regraph method (add_node_attrs, rewrite, clone_node, ...) goes
+    through. Attribute dicts changed in place have to be written back with
+    update_node_attrs, as the transformations already do.
+
+    find_matching resolves the nodes of a pattern by index lookup and extends
+    a match along the pattern edges, instead of testing every combination of
+    matching nodes. It finds the same instances as NXGraph.find_matching,
+    ordered by the insertion order of their nodes. find_matching_anchored
+    only resolves one pattern node by lookup and reaches all others from it.
+    """
+
+    def __init__(self, incoming_graph_data=None, **attr):
+        super().__init__(incoming_graph_data, **attr)
+        self._index: Dict[str, Dict[object, set]] = {key: {} for key in INDEXED_ATTRS}
+        # nodes with a value of an indexed attribute that is not a FiniteSet
+        self._unindexed: Dict[str, set] = {key: set() for key in INDEXED_ATTRS}
+        # indexed values of every node, as they were when it was last indexed
+        self._indexed: Dict[object, Dict[str, Optional[FrozenSet]]] = {}
+        # insertion order of the nodes, the order find_matching goes through them
+        self._order: Dict[object, int] = {}
+        self._next_order = 0
+
+    def add_node(self, node_id, attrs=None):
+        node_id = super().add_node(node_id, attrs)
+        self._order[node_id] = self._next_order
+        self._next_order += 1
+        self._reindex(node_id)
+        return node_id
+
+    def remove_node(self, node_id):
+        super().remove_node(node_id)
+        self._reindex(node_id, removed=True)
+        del self._order[node_id]
+
+    def remove_nodes_from(self, node_ids):
+        """
+        Removes the nodes and their edges with a single networkx call instead
+        of one remove_node per node.
+
+        :param node_ids: ids of the nodes to remove
+        """
+        node_ids = list(dict.fromkeys(node_ids))
+        for node_id in node_ids:
+            if node_id not in self._graph:
+                raise GraphError("Node '{}' does not exist!".format(node_id))
+        self._graph.remove_nodes_from(node_ids)
+        for node_id in node_ids:
+            del self.node[node_id]
+            self._reindex(node_id, removed=True)
+            del self._order[node_id]
+
+    def update_node_attrs(self, node_id, attrs, normalize=True):
+        super().update_node_attrs(node_id, attrs, normalize)
+        self._reindex(node_id)
+
+    def _reindex(self, node_id, removed=False):
+        old = self._indexed.pop(node_id, {})
+        new = {}
+        if not removed:
+            attrs = self.get_node(node_id)
+            for key in INDEXED_ATTRS:
+                if key in attrs:
+                    value = attrs[key]
+                    new[key] = frozenset(value.fset) if isinstance(value, FiniteSet) else None
+            self._indexed[node_id] = new
+        for key in INDEXED_ATTRS:
+            old_values, new_values = old.get(key, frozenset()), new.get(key, frozenset())
+            if old_values == new_values:
+                continue
+            index = self._index[key]
+            if old_values is None:
+                self._unindexed[key].discard(node_id)
+            else:
+                for value in old_values - (new_values or frozenset()):
+                    nodes = index[value]
+                    nodes.discard(node_id)
+                    if not nodes:
+                        del index[value]
+            if new_values is None:
+                self._unindexed[key].add(node_id)
+            else:
+                for value in new_values - (old_values or frozenset()):
+                    index.setdefault(value, set()).add(node_id)
+
+    def nodes_with(self, key: str, value) -> set:
+        """
+        :param key: one of INDEXED_ATTRS
+        :param value: attribute value
+        :return: ids of the nodes whose attribute contains the value
+        """
+        return set(self._index[key].get(value, ())) | self._unindexed[key]
+
+    def nodes_of_type(self, types) -> set:
+        """
+        :param types: node types to look for
+        :return: ids of the nodes having one of the types
+        """
+        nodes = set()
+        for node_type in types:
+            nodes.update(self._index["type"].get(node_type, ()))
+        for node in self._unindexed["type"]:
+            if any(valid_attributes({"type": FiniteSet({node_type})}, self.get_node(node)) for node_type in types):
+                nodes.add(node)
+        return nodes
+
+    def present_types(self) -> Optional[set]:
+        """
+        :return: all node types in the graph, None if a node has a type that is
+        not a FiniteSet and could match any type
+        """
+        if self._unindexed["type"]:
+            return None
+        return set(self._index["type"])
+
+    def _candidates(self, attrs: dict, allowed: Optional[set]) -> List:
+        # smallest index bucket of the pattern node, checked against all its attributes
+        bucket = None
+        for key in INDEXED_ATTRS:
+            value = attrs.get(key)
+            if not isinstance(value, FiniteSet) or not value.fset:
+                continue
+            for element in value.fset:
+                nodes = self._index[key].get(element, ())
+                if bucket is None or len(nodes) < len(bucket):
+                    bucket = nodes
+                    unindexed = self._unindexed[key]
+        if bucket is None:
+            nodes = self._graph.nodes() if allowed is None else [node for node in allowed if node in self._graph]
+        else:
+            nodes = set(bucket) | unindexed
+            if allowed is not None:
+                nodes &= allowed
+        return [node for node in nodes if valid_attributes(attrs, self.get_node(node))]
+
+    def find_matching(self, pattern, nodes=None, graph_typing=None, pattern_typing=None):
+        """
+        Finds the instances of a pattern, see NXGraph.find_matching.
+
+        :param pattern: pattern graph
+        :param nodes: subset of nodes to search in
+        :return: list of instances, dicts from pattern nodes to graph nodes
+        """
+        pattern_nodes = list(pattern.nodes())
+        if graph_typing or pattern_typing or not pattern_nodes:
+            return super().find_matching(pattern, nodes, graph_typing, pattern_typing)
+        allowed = set(nodes) if nodes is not None else None
+
+        candidates = {}
+        for pattern_node in pattern_nodes:
+            candidates[pattern_node] = set(self._candidates(pattern.get_node(pattern_node), allowed))
+            if not candidates[pattern_node]:
+                return []
+
+        plan = self._plan(pattern, pattern_nodes, candidates)
+        return self._instances(pattern, pattern_nodes, plan, candidates)
+
+    def find_matching_anchored(self, pattern, anchor, anchor_nodes=None):
+        """
+        Finds the instances of a connected pattern by starting at every graph
+        node the anchor can be mapped to and extending the match along the
+        pattern edges, the other pattern nodes are only checked on the nodes
+        reached that way. The cost is proportional to the number of anchors
+        times the size of the pattern.
+
+        :param pattern: connected pattern graph
+        :param anchor: pattern node to start from
+        :param anchor_nodes: graph nodes the anchor may be mapped to, all by default
+        :return: list of instances, dicts from pattern nodes to graph nodes
+        """
+        pattern_nodes = list(pattern.nodes())
+        if not nx.is_weakly_connected(pattern._graph):
+            instances = self.find_matching(pattern)
+            if anchor_nodes is not None:
+                anchor_nodes = set(anchor_nodes)
+                instances = [instance for instance in instances if instance[anchor] in anchor_nodes]
+            return instances
+        allowed = set(anchor_nodes) if anchor_nodes is not None else None
+        candidates = {anchor: set(self._candidates(pattern.get_node(anchor), allowed))}
+        if not candidates[anchor]:
+            return []
+        plan = self._plan(pattern, pattern_nodes, candidates, anchor)
+        return self._instances(pattern, pattern_nodes, plan, candidates)
+
+    def _instances(self, pattern, pattern_nodes, plan, candidates):
+        instances = []
+        self._extend(pattern, plan, 0, {}, candidates, instances)
+        instances.sort(key=lambda instance: (sorted(self._order[node] for node in instance.values()),
+                                             [self._order[instance[node]] for node in pattern_nodes]))
+        return instances
+
+    @staticmethod
+    def _plan(pattern, pattern_nodes, candidates, first=None):
+        # visits the pattern so every node but the first of a component has a matched neighbour
+        plan, planned = [], set()
+        if first is not None:
+            plan.append((first, None, None))
+            planned.add(first)
+        while len(planned) < len(pattern_nodes):
+            anchored = None
+            for node in pattern_nodes:
+                if node in planned:
+                    continue
+                for neighbour in planned:
+                    if pattern._graph.has_edge(neighbour, node):
+                        anchored = (node, neighbour, True)
+                    elif pattern._graph.has_edge(node, neighbour):
+                        anchored = (node, neighbour, False)
+                    if anchored is not None:
+                        break
+                if anchored is not None:
+                    break
+            if anchored is None:
+                start = min((node for node in pattern_nodes if node not in planned),
+                            key=lambda node: len(candidates[node]))
+                anchored = (start, None, None)
+            plan.append(anchored)
+            planned.add(anchored[0])
+        return plan
+
+    def _extend(self, pattern, plan, step, mapping, candidates, instances):
+        if step == len(plan):
+            instances.append(dict(mapping))
+            return
+        pattern_node, anchor, outgoing = plan[step]
+        if anchor is None:
+            pool = candidates[pattern_node]
+        else:
+            neighbours = self._graph.succ[mapping[anchor]] if outgoing else self._graph.pred[mapping[anchor]]
+            if pattern_node in candidates:
+                pool = [node for node in neighbours if node in candidates[pattern_node]]
+            else:
+                # anchored matching checks the attributes of the reached nodes only
+                attrs = pattern.get_node(pattern_node)
+                pool = [node for node in neighbours if valid_attributes(attrs, self.get_node(node))]
+        used = set(mapping.values())
+        for node in pool:
+            if node in used:
+                continue
+            mapping[pattern_node] = node
+            if self._edges_match(pattern, pattern_node, mapping):
+                self._extend(pattern, plan, step + 1, mapping, candidates, instances)
+            del mapping[pattern_node]
+
+    def _edges_match(self, pattern, pattern_node, mapping):
+        # every pattern edge between the new node and the matched ones exists with its attributes
+        for other, node in mapping.items():
+            for source, target in ((pattern_node, other), (other, pattern_node)):
+                if not pattern._graph.has_edge(source, target):
+                    continue
+                if not self._graph.has_edge(mapping[source], mapping[target]):
+                    return False
+                if not valid_attributes(pattern.get_edge(source, target),
+                                        self.get_edge(mapping[source], mapping[target])):
+                    return False
+                if source == target:
+                    break
+        return True
@@ -0,0 +1,232 @@
+import os
+import threading
+from types import MappingProxyType
+from typing import Dict, Iterable, List, Optional, Tuple
+
+
+class FunctionEntry:
+    """
+    A function of the knowledge base: its full name, module, description and
+    its arguments as (position, name) pairs in position order.
+    """
+
+    __slots__ = ("title", "module", "description", "arguments")
+
+    def __init__(self, title: str, module: str, description: str, arguments: Tuple[Tuple[int, str], ...]):
+        self.title = title
+        self.module = module
+        self.description = description
+        self.arguments = arguments
+
+    def argument_names(self, up_to_position: int) -> List[str]:
+        """
+        :param up_to_position: last argument position to include
+        :return: names of the arguments at positions 1 to up_to_position
+        """
+        return [name for position, name in self.arguments if 1 <= position <= up_to_position]
+
+
+def is_module_function(title: str) -> bool:
+    """
+    :param title: full function name
+    :return: whether the function is defined in a module rather than in a
+    class, which by convention is the case when no segment is capitalized
+    """
+    return not any(segment[:1].isupper() for segment in title.split(".")[:-1])
+
+
+class SuffixTrie:
+    """
+    Trie over the dotted segments of the function titles, last segment first,
+    so the titles ending with the same segments share a path. Every trie node
+    keeps the titles below it.
+    """
+
+    __slots__ = ("children", "titles")
+
+    def __init__(self):
+        self.children: Dict[str, "SuffixTrie"] = {}
+        self.titles: List[str] = []
+
+    @classmethod
+    def from_titles(cls, titles: Iterable[str]) -> "SuffixTrie":
+        root = cls()
+        for title in titles:
+            node = root
+            for segment in reversed(title.split(".")):
+                node = node.children.setdefault(segment, cls())
+                node.titles.append(title)
+        return root
+
+    def longest_suffix(self, name: str) -> Tuple[int, List[str]]:
+        """
+        :param name: dotted name of a call
+        :return: number of trailing segments of the name that match and the
+        titles ending with those segments
+        """
+        node, depth = self, 0
+        for segment in reversed(name.split(".")):
+            child = node.children.get(segment)
+            if child is None:
+                break
+            node, depth = child, depth + 1
+        return depth, (node.titles if depth else [])
+
+
+class KnowledgeBaseSnapshot:
+    """
+    Read-only copy of the functions and arguments tables, small enough to be
+    kept in memory. Lookups need no connection. A snapshot is never changed,
+    a newer one replaces it when the database file changes.
+    """
+
+    def __init__(self, functions: Dict[str, FunctionEntry], stamp=None):
+        self.functions = MappingProxyType(functions)
+        self.suffixes = SuffixTrie.from_titles(functions)
+        # state of the database file the snapshot was read from
+        self.stamp = stamp
+
+    @classmethod
+    def from_cursor(cls, cursor, stamp=None) -> "KnowledgeBaseSnapshot":
+        """
+        :param cursor: knowledge base cursor
+        :param stamp: state of the database file before it was read
+        :return: snapshot of the functions and their arguments
+        """
+        arguments = {}
+        cursor.execute("SELECT function_id, argument_position, argument_name FROM arguments "
+                       "ORDER BY function_id, argument_position")
+        for function_id, position, name in cursor.fetchall():
+            arguments.setdefault(function_id, []).append((position, name))
+        functions = {}
+        cursor.execute("SELECT function_id, function_title, module_name, description FROM functions")
+        for function_id, title, module, description in cursor.fetchall():
+            functions[title] = FunctionEntry(title, module, description, tuple(arguments.get(function_id, ())))
+        return cls(functions, stamp)
+
+    def get(self, title: str) -> Optional[FunctionEntry]:
+        return self.functions.get(title)
+
+    def find_call(self, function_name: str, up_to_arguments: int) -> Optional[List[str]]:
+        """
+        :param function_name: full name of the called function
+        :param up_to_arguments: number of positional arguments of the call
+        :return: names of the first up_to_arguments arguments, None if the function
+        is unknown or, with positional arguments, has none of them documented
+        """
+        entry = self.functions.get(function_name)
+        if entry is None:
+            return None
+        if up_to_arguments <= 0:
+            return []
+        names = entry.argument_names(up_to_arguments)
+        return names if names else None
+
+    def candidates(self, name: str, modules: Iterable[str] = ()) -> Tuple[int, List[str]]:
+        """
+        Finds the titles sharing the longest dotted suffix with a call name, for
+        calls on objects or through names the imports do not resolve, e.g.
+        sc_X.fit_transform.
+
+        :param name: dotted name of a call
+        :param modules: top-level modules imported by the script, preferred
+        :return: number of matching trailing segments and the titles ending with
+        them, those of the imported modules first, then the shortest
+        """
+        depth, titles = self.suffixes.longest_suffix(name)
+        modules = set(modules)
+        return depth, sorted(titles, key=lambda title: self._rank(title, modules) + (title,))
+
+    def _rank(self, title: str, modules: set) -> tuple:
+        return self.functions[title].module not in modules, title.count(".")
+
+    def resolve(self, name: str, modules: Iterable[str] = ()) -> Optional[str]:
+        """
+        A suffix of a single segment only names the method, e.g. len or
+        line.split, and is only used when the call is made on an imported
+        module and the candidate is a function of that module, not a method of
+        one of its classes, e.g. pd.read_csv but not pd.split.
+
+        :param name: dotted name of a call
+        :param modules: top-level modules imported by the script
+        :return: the title equal to the name, else the best candidate sharing its
+        longest suffix if no other candidate ranks the same, else None
+        """
+        if name in self.functions:
+            return name
+        modules = set(modules)
+        depth, titles = self.candidates(name, modules)
+        if depth < 2:
+            receiver_module = name.rpartition(".")[0].split(".")[0]
+            if receiver_module not in modules:
+                return None
+            titles = [title for title in titles
+                      if self.functions[title].module == receiver_module and is_module_function(title)]
+        if not titles:
+            return None
+        if len(titles) > 1 and self._rank(titles[0], modules) == self._rank(titles[1], modules):
+            return None
+        return titles[0]
+
+    def descriptions(self, titles: Iterable[str]) -> Dict[str, str]:
+        """
+        :param titles: full function names
+        :return: dict from the titles in the knowledge base to their description
+        """
+        return {title: self.functions[title].description for title in titles if title in self.functions}
+
+    def __len__(self):
+        return len(self.functions)
+
+
+def database_path(cursor) -> str:
+    """
+    :param cursor: knowledge base cursor
+    :return: file of the main database of the connection, "" for an in-memory one
+    """
+    for _, name, path in cursor.execute("PRAGMA database_list").fetchall():
+        if name == "main":
+            return path or ""
+    return ""
+
+
+def file_stamp(path: str) -> tuple:
+    # the write-ahead log holds committed changes not yet in the database file
+    stamp = []
+    for file_path in (path, path + "-wal"):
+        try:
+            stat = os.stat(file_path)
+            stamp.append((stat.st_mtime_ns, stat.st_size))
+        except FileNotFoundError:
+            stamp.append(None)
+    return tuple(stamp)
+
+
+_snapshots: Dict[str, KnowledgeBaseSnapshot] = {}
+_snapshots_lock = threading.Lock()
+
+
+def get_knowledge_base(cursor) -> KnowledgeBaseSnapshot:
+    """
+    Returns the process-wide snapshot of the database the cursor reads, loading
+    it again only when the database file changed since it was loaded. The new
+    snapshot replaces the old one at once, lookups still running on the old
+    one are not affected. In-memory databases are read on every call.
+
+    :param cursor: knowledge base cursor
+    :return: the current KnowledgeBaseSnapshot
+    """
+    path = database_path(cursor)
+    if not path:
+        return KnowledgeBaseSnapshot.from_cursor(cursor)
+    stamp = file_stamp(path)
+    snapshot = _snapshots.get(path)
+    if snapshot is not None and snapshot.stamp == stamp:
+        return snapshot
+    with _snapshots_lock:
+        snapshot = _snapshots.get(path)
+        if snapshot is None or snapshot.stamp != stamp:
+            # the stamp is taken before reading, a change while reading loads it again next time
+            snapshot = KnowledgeBaseSnapshot.from_cursor(cursor, stamp)
+            _snapshots[path] = snapshot
+        return snapshot
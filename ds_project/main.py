@@ -1,22 +1,157 @@
+import json
+import os
+import sqlite3
+import tarfile
+import tempfile
 from pathlib import Path
+from typing import Optional
 
-from fastapi import FastAPI, File, UploadFile, Form
-from fastapi.responses import FileResponse
+from fastapi import FastAPI, File, UploadFile, Form, HTTPException, Request
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import FileResponse, JSONResponse, StreamingResponse
 
+from batch import extract_batch_async, iter_tarball
+from db_driver import get_version, RULES_VERSION, KNOWLEDGE_BASE_VERSION
+from extraction_pool import ExtractionPool, PoolSaturatedError, ExtractionTimeoutError
 from graph_extractor import GraphExtractor
+from parser_pool import LANGUAGES
+from result_cache import ResultCache
+from rule_set import merge_rule_stats
 
 app = FastAPI()
 
 jsons = Path('.')
 frontend = Path('dist/')
+# builds the grammars once before the workers are started
 extractor = GraphExtractor()
 
+EXTRACTION_WORKERS = int(os.environ.get("EXTRACTION_WORKERS", os.cpu_count() or 1))
+EXTRACTION_QUEUE_SIZE = int(os.environ.get("EXTRACTION_QUEUE_SIZE", 4 * EXTRACTION_WORKERS))
+EXTRACTION_TIMEOUT = float(os.environ.get("EXTRACTION_TIMEOUT", 60))
+RETRY_AFTER = os.environ.get("EXTRACTION_RETRY_AFTER", "5")
+# editor sessions keep their syntax tree in the worker they are pinned to, see /update
+SESSION_LIMIT = int(os.environ.get("EXTRACTION_SESSIONS", 64))
+SESSION_TTL = float(os.environ.get("EXTRACTION_SESSION_TTL", 600))
+extraction_pool = ExtractionPool(EXTRACTION_WORKERS, EXTRACTION_QUEUE_SIZE, EXTRACTION_TIMEOUT,
+                                 SESSION_LIMIT, SESSION_TTL)
+
+RESULT_CACHE_BYTES = int(os.environ.get("RESULT_CACHE_BYTES", 64 * 1024 * 1024))
+RESULT_CACHE_DIR = os.environ.get("RESULT_CACHE_DIR")
+RESULT_CACHE_DISK_BYTES = int(os.environ.get("RESULT_CACHE_DISK_BYTES", 256 * 1024 * 1024))
+result_cache = ResultCache(RESULT_CACHE_BYTES, RESULT_CACHE_DIR, RESULT_CACHE_DISK_BYTES)
+
+UPLOAD_LIMIT = int(os.environ.get("UPLOAD_LIMIT", 16 * 1024 * 1024))
+UPLOAD_CHUNK_SIZE = int(os.environ.get("UPLOAD_CHUNK_SIZE", 64 * 1024))
+# room for the multipart boundaries and the language field around the file
+UPLOAD_FORM_OVERHEAD = 64 * 1024
+
+BATCH_LIMIT = int(os.environ.get("BATCH_LIMIT", 512 * 1024 * 1024))
+# scripts of a batch given to the workers at a time
+BATCH_CONCURRENCY = int(os.environ.get("BATCH_CONCURRENCY", EXTRACTION_WORKERS))
+
+# only used to read the rule base and knowledge base versions
+kb_connection = sqlite3.connect("knowledge_base.db", check_same_thread=False)
+
+
+@app.middleware("http")
+async def limit_upload_size(request: Request, call_next):
+    # rejects oversized uploads before the multipart body is read
+    if request.url.path == "/upload":
+        content_length = request.headers.get("content-length")
+        if content_length is not None:
+            if not content_length.isdigit():
+                return JSONResponse(status_code=400, content={"detail": "Invalid Content-Length"})
+            if int(content_length) > UPLOAD_LIMIT + UPLOAD_FORM_OVERHEAD:
+                return JSONResponse(status_code=413,
+                                    content={"detail": "Upload exceeds {} bytes".format(UPLOAD_LIMIT)})
+    return await call_next(request)
+
+
+@app.on_event("shutdown")
+def shutdown():
+    extraction_pool.shutdown()
+
+
+async def extract(code, language, session_id=None):
+    """
+    Returns the cached result for the script or runs the extraction in the
+    worker pool, mapping pool errors to HTTP errors. With a session id the
+    script is extracted incrementally from the previous version of the session.
+    """
+    if language not in LANGUAGES:
+        raise HTTPException(status_code=400, detail="Unsupported language {!r}".format(language))
+    cursor = kb_connection.cursor()
+    rules_version = get_version(cursor, RULES_VERSION)
+    kb_version = get_version(cursor, KNOWLEDGE_BASE_VERSION)
+    if session_id is not None:
+        return await run_in_pool(extraction_pool.update_session(session_id, code, language,
+                                                                rules_version, kb_version))
+    result_cache.check_versions(rules_version, kb_version)
+    key = ResultCache.make_key(language, code, rules_version, kb_version)
+    data = result_cache.get(key)
+    if data is not None:
+        return data
+    data = await run_in_pool(extraction_pool.extract(code, language))
+    result_cache.put(key, data)
+    return data
+
+
+async def run_in_pool(job):
+    """
+    Awaits a job of the extraction pool, mapping pool errors to HTTP errors.
+    """
+    try:
+        return await job
+    except PoolSaturatedError:
+        raise HTTPException(status_code=503, detail="Extraction queue is full",
+                            headers={"Retry-After": RETRY_AFTER})
+    except ExtractionTimeoutError:
+        raise HTTPException(status_code=504, detail="Extraction timed out")
+
+
+async def read_upload(file: UploadFile) -> bytes:
+    """
+    Reads an uploaded file into one buffer, failing with 413 as soon as it
+    exceeds UPLOAD_LIMIT.
+    """
+    if file.size is not None and file.size > UPLOAD_LIMIT:
+        raise HTTPException(status_code=413, detail="Upload exceeds {} bytes".format(UPLOAD_LIMIT))
+    buffer = bytearray()
+    while chunk := await file.read(UPLOAD_CHUNK_SIZE):
+        if len(buffer) + len(chunk) > UPLOAD_LIMIT:
+            raise HTTPException(status_code=413, detail="Upload exceeds {} bytes".format(UPLOAD_LIMIT))
+        buffer += chunk
+    return bytes(buffer)
+
+
+def merge_counters(counters) -> dict:
+    """
+    Sums the counters reported by the workers.
+    """
+    merged = {}
+    for worker_counters in counters:
+        for key, value in worker_counters.items():
+            merged[key] = merged.get(key, 0) + value
+    return merged
+
 
 @app.get("/")
 async def root():
     return FileResponse(frontend / 'index.html')
 
 
+@app.get("/metrics")
+async def metrics():
+    worker_stats = await extraction_pool.worker_stats()
+    return {
+        "result_cache": result_cache.stats(),
+        "extraction_pool": extraction_pool.stats(),
+        "parsers": extractor.parsers.stats(),
+        "sessions": merge_counters(stats.get("sessions", {}) for stats in worker_stats),
+        "rules": merge_rule_stats([stats.get("rules", {}) for stats in worker_stats]),
+    }
+
+
 @app.get("/main.js")
 async def js():
     return FileResponse(frontend / 'main.js')
@@ -29,17 +164,16 @@ async def css():
 
 @app.post("/upload")
 async def upload_data(file: UploadFile = File(...), language: str = Form(...)):
-    code = b''
-    while content := await file.read(1024):  # async read chunk
-        code += content  # async write chunk
+    # the bytes are parsed as they are, only the response needs them decoded
+    code = await read_upload(file)
 
-    data = extractor.extract_pipeline(code, language)
+    data = await extract(code, language)
     # print(data)
     return {
         "type": "graph",
         "error": None,
         "values": {
-            "code": code.decode('utf-8'),
+            "code": code.decode('utf-8', errors='replace'),
             "nodes": data["nodes"],
             "edges": data["edges"],
         }
@@ -47,8 +181,8 @@ async def upload_data(file: UploadFile = File(...), language: str = Form(...)):
 
 
 @app.post("/update")
-async def update_code(code: str = Form(...), language: str = Form(...)):
-    data = extractor.extract_pipeline(code, language)
+async def update_code(code: str = Form(...), language: str = Form(...), session_id: Optional[str] = Form(None)):
+    data = await extract(code, language, session_id)
     # print(data)
     return {
         "type": "graph",
@@ -59,3 +193,39 @@ async def update_code(code: str = Form(...), language: str = Form(...)):
             "edges": data["edges"],
         }
     }
+
+
+@app.post("/batch")
+async def batch_extract(file: UploadFile = File(...)):
+    """
+    Extracts every script in an uploaded tarball and streams one JSON record
+    per script as NDJSON, in the order the extractions finish.
+    """
+    # the upload is closed once the handler returns, the stream reads its own copy
+    tarball = tempfile.TemporaryFile()
+    size = 0
+    while chunk := await file.read(UPLOAD_CHUNK_SIZE):
+        size += len(chunk)
+        if size > BATCH_LIMIT:
+            tarball.close()
+            raise HTTPException(status_code=413, detail="Batch exceeds {} bytes".format(BATCH_LIMIT))
+        await run_in_threadpool(tarball.write, chunk)
+    tarball.seek(0)
+    if not await run_in_threadpool(tarfile.is_tarfile, tarball):
+        tarball.close()
+        raise HTTPException(status_code=400, detail="Batch is not a tarball")
+    tarball.seek(0)
+
+    async def records():
+        sources = iter_tarball(tarball, file.filename)
+        batch = extract_batch_async(sources, extraction_pool, BATCH_CONCURRENCY)
+        try:
+            async for record in batch:
+                yield json.dumps(record) + "\n"
+        finally:
+            # cancels the extractions still pending when the client disconnected
+            await batch.aclose()
+            sources.close()
+            tarball.close()
+
+    return StreamingResponse(records(), media_type="application/x-ndjson")
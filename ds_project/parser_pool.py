@@ -0,0 +1,176 @@
+import hashlib
+import os
+import threading
+from contextlib import contextmanager
+from typing import Dict, List
+
+from tree_sitter import Language, Parser
+
+LIBRARY_PATH = 'build/my-languages.so'
+# tree-sitter language names built from GRAMMAR_PATHS
+LANGUAGES = ("python", "r", "snakemake")
+GRAMMAR_PATHS = [
+    'parsers/tree-sitter-python',
+    'parsers/tree-sitter-r',
+    'parsers/tree-sitter-snakemake-pure'
+]
+
+
+def hash_grammar_sources(grammar_paths: List[str]) -> str:
+    """
+    Computes a content hash over all grammar source files.
+
+    :param grammar_paths: grammar repositories as passed to Language.build_library
+    :return: hex digest identifying the current grammar sources
+    """
+    digest = hashlib.sha256()
+    for grammar_path in grammar_paths:
+        src_path = os.path.join(grammar_path, 'src')
+        for directory, dirnames, filenames in sorted(os.walk(src_path)):
+            dirnames.sort()
+            for filename in sorted(filenames):
+                file_path = os.path.join(directory, filename)
+                digest.update(os.path.relpath(file_path, src_path).encode('utf-8'))
+                with open(file_path, 'rb') as f:
+                    for chunk in iter(lambda: f.read(1 << 16), b''):
+                        digest.update(chunk)
+        digest.update(grammar_path.encode('utf-8'))
+    return digest.hexdigest()
+
+
+class ParserPool:
+    """
+    Process-wide holder of the compiled grammar library and of ready to use
+    tree-sitter parsers, one free list per language.
+
+    The grammar sources are only compared with the stamp of the library by
+    the first build() of the process. A library loaded by a process stays
+    loaded (the dynamic loader returns the same handle for the same path), so
+    a library rebuilt by another process is only used after a restart,
+    stats() reports it as library_stale.
+    """
+
+    def __init__(self, library_path=LIBRARY_PATH, grammar_paths=None):
+        self.library_path = library_path
+        self.grammar_paths = list(grammar_paths) if grammar_paths is not None else list(GRAMMAR_PATHS)
+        self._lock = threading.Lock()
+        self._built = False
+        self._languages: Dict[str, Language] = {}
+        self._free: Dict[str, List[Parser]] = {}
+        # modification time and size of the library when it was built or checked
+        self._library_stamp = None
+        self.counters = {"builds": 0, "build_skips": 0, "pool_hits": 0, "pool_misses": 0}
+
+    def build(self) -> bool:
+        """
+        Compiles the grammars into the shared library unless the library was
+        already built from identical grammar sources.
+
+        :return: True if the library was (re)built, False if the build was skipped
+        """
+        with self._lock:
+            if self._built:
+                self.counters["build_skips"] += 1
+                return False
+            stamp_path = self.library_path + '.sha256'
+            source_hash = hash_grammar_sources(self.grammar_paths)
+            stamp = None
+            if os.path.exists(stamp_path):
+                with open(stamp_path) as f:
+                    stamp = f.read().strip()
+            if stamp == source_hash and os.path.exists(self.library_path):
+                self._built = True
+                self._library_stamp = self._stamp()
+                self.counters["build_skips"] += 1
+                return False
+            # remove a stale library, build_library only compares modification times
+            if os.path.exists(self.library_path):
+                os.remove(self.library_path)
+            Language.build_library(self.library_path, self.grammar_paths)
+            with open(stamp_path, 'w') as f:
+                f.write(source_hash)
+            self._languages.clear()
+            self._free.clear()
+            self._built = True
+            self._library_stamp = self._stamp()
+            self.counters["builds"] += 1
+            return True
+
+    def _stamp(self):
+        try:
+            stat = os.stat(self.library_path)
+        except FileNotFoundError:
+            return None
+        return stat.st_mtime_ns, stat.st_size
+
+    def stale(self) -> bool:
+        """
+        :return: True if the library file changed after this process built or checked it
+        """
+        return self._built and self._stamp() != self._library_stamp
+
+    def language(self, name: str) -> Language:
+        with self._lock:
+            if name not in self._languages:
+                self._languages[name] = Language(self.library_path, name)
+            return self._languages[name]
+
+    def acquire(self, name: str) -> Parser:
+        """
+        Borrows a parser for the given language, creating one if none is free.
+
+        :param name: tree-sitter language name, e.g. 'python'
+        :return: a Parser set to the language
+        """
+        with self._lock:
+            free = self._free.get(name)
+            if free:
+                self.counters["pool_hits"] += 1
+                return free.pop()
+            self.counters["pool_misses"] += 1
+        parser = Parser()
+        parser.set_language(self.language(name))
+        return parser
+
+    def release(self, name: str, parser: Parser):
+        with self._lock:
+            self._free.setdefault(name, []).append(parser)
+
+    @contextmanager
+    def parser(self, name: str):
+        parser = self.acquire(name)
+        try:
+            yield parser
+        finally:
+            self.release(name, parser)
+
+    def stats(self) -> dict:
+        with self._lock:
+            stats = dict(self.counters)
+            stats["free_parsers"] = {name: len(free) for name, free in self._free.items()}
+            stats["library_stale"] = self.stale()
+            return stats
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_parser_pool() -> ParserPool:
+    """
+    Returns the process-wide parser pool.
+    """
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ParserPool()
+        return _pool
+
+
+def reset_parser_pool():
+    """
+    Drops the process-wide parser pool, the next get_parser_pool() creates a new one.
+    """
+    global _pool
+    with _pool_lock:
+        _pool = None
@@ -0,0 +1,162 @@
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+from typing import Optional, Tuple, Union
+
+from parser_pool import LANGUAGES
+
+
+class ResultCache:
+    """
+    Content-addressed cache of extraction results.
+
+    Results are kept JSON encoded, in least recently used order, and evicted
+    once their total size exceeds max_bytes. If a directory is given, results
+    are also written there and survive a restart. The files are evicted in
+    least recently used order as well once they take more than max_disk_bytes.
+    """
+
+    def __init__(self, max_bytes=64 * 1024 * 1024, directory=None, max_disk_bytes=256 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.directory = directory
+        self.max_disk_bytes = max_disk_bytes
+        self.versions: Optional[Tuple[int, int]] = None
+        self.total_bytes = 0
+        self.disk_bytes = 0
+        self._entries: "OrderedDict[str, bytes]" = OrderedDict()
+        # size of every file in the directory, least recently used first
+        self._files: "OrderedDict[str, int]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.counters = {"hits": 0, "misses": 0, "evictions": 0, "disk_evictions": 0, "invalidations": 0}
+        if directory is not None:
+            os.makedirs(directory, exist_ok=True)
+            self._scan_directory()
+
+    def _scan_directory(self):
+        files = []
+        for filename in os.listdir(self.directory):
+            path = os.path.join(self.directory, filename)
+            if filename.endswith(".tmp"):
+                # left by a write that did not finish
+                os.remove(path)
+            elif filename.endswith(".json"):
+                stat = os.stat(path)
+                files.append((stat.st_mtime_ns, filename[:-len(".json")], stat.st_size))
+        for _, key, size in sorted(files):
+            self._files[key] = size
+            self.disk_bytes += size
+        self._evict_files()
+
+    @staticmethod
+    def make_key(language: str, code: Union[str, bytes], rules_version: int, kb_version: int) -> str:
+        """
+        :param language: tree-sitter language name
+        :param code: script the result was extracted from
+        :param rules_version: version of the rule base the result was produced with
+        :param kb_version: version of the knowledge base the result was produced with
+        :return: cache key
+        """
+        # the key is used as a file name
+        if language not in LANGUAGES:
+            raise ValueError("unsupported language {!r}".format(language))
+        if isinstance(code, str):
+            code = code.encode("utf-8")
+        digest = hashlib.sha256(code).hexdigest()
+        return "{}-{}-{}-{}".format(language, digest, rules_version, kb_version)
+
+    def check_versions(self, rules_version: int, kb_version: int):
+        """
+        Drops every result produced with a different rule base or knowledge base.
+        """
+        versions = (rules_version, kb_version)
+        with self._lock:
+            if self.versions == versions:
+                return
+            if self.versions is not None:
+                self.counters["invalidations"] += 1
+            self.versions = versions
+            suffix = "-{}-{}".format(rules_version, kb_version)
+            for key in [key for key in self._entries if not key.endswith(suffix)]:
+                self.total_bytes -= len(self._entries.pop(key))
+            for key in [key for key in self._files if not key.endswith(suffix)]:
+                self._remove_file(key)
+
+    def get(self, key: str) -> Optional[dict]:
+        with self._lock:
+            encoded = self._entries.get(key)
+            if encoded is not None:
+                self._entries.move_to_end(key)
+            elif key in self._files:
+                try:
+                    with open(self._path(key), "rb") as f:
+                        encoded = f.read()
+                    # keeps the order of the files across restarts
+                    os.utime(self._path(key))
+                except FileNotFoundError:
+                    self.disk_bytes -= self._files.pop(key)
+                else:
+                    self._files.move_to_end(key)
+                    self._insert(key, encoded)
+            if encoded is None:
+                self.counters["misses"] += 1
+                return None
+            self.counters["hits"] += 1
+        return json.loads(encoded)
+
+    def put(self, key: str, result: dict):
+        encoded = json.dumps(result).encode("utf-8")
+        with self._lock:
+            self._insert(key, encoded)
+            if self.directory is not None:
+                tmp_path = self._path(key) + ".tmp"
+                with open(tmp_path, "wb") as f:
+                    f.write(encoded)
+                os.replace(tmp_path, self._path(key))
+                self.disk_bytes += len(encoded) - self._files.pop(key, 0)
+                self._files[key] = len(encoded)
+                self._evict_files()
+
+    def _evict_files(self):
+        while self.disk_bytes > self.max_disk_bytes and self._files:
+            self._remove_file(next(iter(self._files)))
+            self.counters["disk_evictions"] += 1
+
+    def _remove_file(self, key: str):
+        self.disk_bytes -= self._files.pop(key)
+        try:
+            os.remove(self._path(key))
+        except FileNotFoundError:
+            pass
+
+    def _insert(self, key: str, encoded: bytes):
+        if len(encoded) > self.max_bytes:
+            return
+        if key in self._entries:
+            self.total_bytes -= len(self._entries.pop(key))
+        self._entries[key] = encoded
+        self.total_bytes += len(encoded)
+        while self.total_bytes > self.max_bytes:
+            _, evicted = self._entries.popitem(last=False)
+            self.total_bytes -= len(evicted)
+            self.counters["evictions"] += 1
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, key + ".json")
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.total_bytes = 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            stats = dict(self.counters)
+            stats["entries"] = len(self._entries)
+            stats["bytes"] = self.total_bytes
+            stats["max_bytes"] = self.max_bytes
+            stats["files"] = len(self._files)
+            stats["disk_bytes"] = self.disk_bytes
+            stats["max_disk_bytes"] = self.max_disk_bytes
+            return stats
@@ -1,6 +1,7 @@
 import json
 import sqlite3
 from regraph import NXGraph, Rule
+from db_driver import bump_version, RULES_VERSION
 
 
 class RuleEntry:
@@ -43,6 +44,8 @@ class RuleEntry:
         out_file.write(str(rule) + "\n")
         out_file.close()
 
+        # invalidates cached extraction results
+        bump_version(cursor, RULES_VERSION)
         connection.commit()
 
         print(rule)
@@ -1,39 +1,50 @@
+import bisect
+import os
 import sqlite3
 from regraph import NXGraph, Rule, FiniteSet, plot_graph
+from regraph.utils import valid_attributes
 import json
 import time
 import utils
 from utils import draw_graph, print_graph, read_rule_from_line
-from models.Function import Function
+from kb_snapshot import get_knowledge_base
 from rule_extractor import RuleExtractor
-from rule_creator import get_rules_from_db
+from rule_set import CompiledRule, get_rule_set
+from syntax_tree import SourceText
 import matplotlib.pyplot as plt
 
+# "single_pass" applies every rule once to the instances found up front,
+# "fixed_point" applies the rule set until no rule matches anything new
+RULE_ENGINE = os.environ.get("RULE_ENGINE", "single_pass")
+# caps of the fixed point engine, reached only by rule sets that keep rewriting
+RULE_MAX_REWRITES = int(os.environ.get("RULE_MAX_REWRITES", 10000))
+RULE_MAX_ITERATIONS = int(os.environ.get("RULE_MAX_ITERATIONS", 1000))
+
 
 def flip_tree(G: NXGraph):
     """
     Turns the initial tree upside down, allows for better rules definition
-    and application.
+    and application. A tree built already flipped, with
+    CompactTree.to_nxgraph(flipped=True), has no edge leaving its root and is
+    left as it is.
 
     :param G: an NXGraph object
     """
     root_node = utils.get_root_node_id(G)
-    flip_node(G, root_node)
-
-
-def flip_node(G: NXGraph, node_to_flip, id_to_ignore=-1):
-    if not G.successors(node_to_flip):
+    if not list(G.successors(root_node)):
         return
-    children = list()
-    for child in G.successors(node_to_flip):
-        children.append(child)
-    while children:
-        child = children.pop(0)
-        if child == id_to_ignore:
-            continue
-        G.add_edge(child, node_to_flip)
-        G.remove_edge(node_to_flip, child)
-        flip_node(G, child, node_to_flip)
+    # collects the edges depth first without recursion, deeply nested
+    # expressions exceed the recursion limit
+    edges = []
+    stack = [root_node]
+    while stack:
+        node = stack.pop()
+        children = list(G.successors(node))
+        edges.extend((node, child) for child in children)
+        stack.extend(reversed(children))
+    for parent, child in edges:
+        G.add_edge(child, parent)
+        G.remove_edge(parent, child)
 
 
 def append_identifier_to_call(G: NXGraph):
@@ -55,7 +66,11 @@ def append_identifier_to_call(G: NXGraph):
         call_id = instance[2]
         identifier_attrs = G.get_node(identifier_id)
         identifier_text = identifier_attrs["text"]
-        G.update_node_attrs(call_id, {"type": "call", "text": identifier_text})
+        # the position orders the outputs of the call before its inputs
+        call_attrs = G.get_node(call_id)
+        attrs = {key: call_attrs[key] for key in ("start", "end") if key in call_attrs}
+        attrs.update({"type": "call", "text": identifier_text})
+        G.update_node_attrs(call_id, attrs)
         G.remove_node(identifier_id)
     return
 
@@ -71,7 +86,10 @@ def adjust_attributes(G: NXGraph):
         call_id = instance[2]
         attr_attrs = G.get_node(attr_id)
         attr_text = attr_attrs["text"]
-        G.update_node_attrs(call_id, {"type": "call", "text": attr_text})
+        call_attrs = G.get_node(call_id)
+        attrs = {key: call_attrs[key] for key in ("start", "end") if key in call_attrs}
+        attrs.update({"type": "call", "text": attr_text})
+        G.update_node_attrs(call_id, attrs)
         parents = G.predecessors(attr_id)
         children = G.successors(attr_id)
         for child in children:
@@ -97,7 +115,10 @@ def adjust_arguments(G: NXGraph):
                 # if it is an identifier, rename to input variable
                 for elem in parent_node["type"]:
                     if elem == "identifier":
-                        G.update_node_attrs(parent, {"text": parent_node["text"], "type": "input_variable"})
+                        # the position orders the input after the outputs it reads
+                        attrs = {key: parent_node[key] for key in ("start", "end") if key in parent_node}
+                        attrs.update({"text": parent_node["text"], "type": "input_variable"})
+                        G.update_node_attrs(parent, attrs)
         G.remove_node(argument_id)
     return
 
@@ -162,15 +183,7 @@ def save_import_aliases(G: NXGraph):
     pattern.add_edge(2, 1)
     pattern.add_edge(3, 1)
 
-    instances = []
-
-    if utils.pattern_connected(pattern):
-        # get subgraphs
-        subgraphs = get_ascendant_subgraphs_by_pattern(G, pattern)
-        for subgraph in subgraphs:
-            instances.extend(G.find_matching(pattern, subgraph))
-    else:
-        instances = G.find_matching(pattern)
+    instances = find_pattern_instances(G, pattern)
 
     aliases_dict = {}
 
@@ -201,15 +214,7 @@ def save_imported_functions(G: NXGraph):
     pattern.add_edge(1, 2)
     pattern.add_edge(3, 2)
 
-    instances = []
-
-    if utils.pattern_connected(pattern):
-        # get subgraphs
-        subgraphs = get_ascendant_subgraphs_by_pattern(G, pattern)
-        for subgraph in subgraphs:
-            instances.extend(G.find_matching(pattern, subgraph))
-    else:
-        instances = G.find_matching(pattern)
+    instances = find_pattern_instances(G, pattern)
 
     functions_dict = {}
     if instances:
@@ -238,15 +243,7 @@ def save_imported_modules(G: NXGraph):
     pattern.add_node(1, {'type': 'dotted_name'})
     pattern.add_node(2, {'type': 'import_statement'})
     pattern.add_edge(1, 2)
-    instances = []
-
-    if utils.pattern_connected(pattern):
-        # get subgraphs
-        subgraphs = get_ascendant_subgraphs_by_pattern(G, pattern)
-        for subgraph in subgraphs:
-            instances.extend(G.find_matching(pattern, subgraph))
-    else:
-        instances = G.find_matching(pattern)
+    instances = find_pattern_instances(G, pattern)
 
     imported_modules = []
     if instances:
@@ -284,6 +281,41 @@ def remove_import_statements(G: NXGraph):
     return
 
 
+# node types carrying no information, removed right after parsing
+INITIAL_CLEANUP_TYPES = [
+    "comment",
+    ".",
+    ",",
+    ")",
+    "(",
+    "[",
+    "]",
+    ":",
+    ";",
+    "}",
+    "{",
+    "\"",
+    "\'"
+]
+
+# node types that no longer carry information after the transformations
+POST_CLEANUP_TYPES = [
+    "expression_statement",
+    "assignment",
+    "pattern_list",
+    "module",
+    "slice",
+    "=",
+    "+",
+    "*",
+    "%",
+    "-",
+    "<",
+    ">",
+    "expression_list"
+]
+
+
 def initial_cleanup(G: NXGraph):
     """
     Removes nodes that are not carrying any information and are not required
@@ -291,22 +323,7 @@ def initial_cleanup(G: NXGraph):
 
     :param G: an NXGraph object
     """
-    redundancy_list = [
-        "comment",
-        ".",
-        ",",
-        ")",
-        "(",
-        "[",
-        "]",
-        ":",
-        ";",
-        "}",
-        "{",
-        "\"",
-        "\'"
-    ]
-    clean_from_list(G, redundancy_list)
+    clean_from_list(G, INITIAL_CLEANUP_TYPES)
 
 
 def clean_from_list(G: NXGraph, redundancy_list: list):
@@ -317,11 +334,7 @@ def clean_from_list(G: NXGraph, redundancy_list: list):
     :param redundancy_list: A list of values to be used as criteria for removing nodes.
     :return:
     """
-    for redundancy in redundancy_list:
-        redundancy_pattern = utils.create_pattern("node_id", "type", redundancy)
-        instances = G.find_matching(redundancy_pattern)
-        for instance in instances:
-            utils.remove_nodes(G, [instance["node_id"]])
+    utils.remove_nodes(G, utils.nodes_of_type(G, redundancy_list))
 
 
 def post_cleanup(G: NXGraph):
@@ -331,22 +344,7 @@ def post_cleanup(G: NXGraph):
 
     :param G: an NXGraph objec
     """
-    redundancy_list = [
-        "expression_statement",
-        "assignment",
-        "pattern_list",
-        "module",
-        "slice",
-        "=",
-        "+",
-        "*",
-        "%",
-        "-",
-        "<",
-        ">",
-        "expression_list"
-    ]
-    clean_from_list(G, redundancy_list)
+    clean_from_list(G, POST_CLEANUP_TYPES)
 
     # keyword argument children
     # eventually save them into the node instead
@@ -357,60 +355,105 @@ def post_cleanup(G: NXGraph):
         "true",
         "false"
     ]
-    for parent in keyword_parents:
-        keyword_pattern = NXGraph()
-        keyword_pattern.add_node(1, {'type': parent})
-        keyword_pattern.add_node(2, {'type': 'keyword_argument'})
-        keyword_pattern.add_edge(1, 2)
-        keyword_instances = G.find_matching(keyword_pattern)
-        for keyword_instance in keyword_instances:
-            G.remove_node(keyword_instance[1])
+    keyword_arguments = set(utils.nodes_of_type(G, ["keyword_argument"]))
+    keyword_children = [node for node in utils.nodes_of_type(G, keyword_parents)
+                        if not keyword_arguments.isdisjoint(G.successors(node))]
+    utils.remove_nodes(G, keyword_children)
+
+
+def node_position(G: NXGraph, node_id, key: str):
+    """
+    :param G: a NXGraph object
+    :param node_id: node to get the position of
+    :param key: "start" or "end"
+    :return: byte offset of the node in the script, None if it has none
+    """
+    value = G.get_node(node_id).get(key)
+    if not value:
+        return None
+    return min(value) if key == "start" else max(value)
 
 
-def compare_outputs_inputs(G: NXGraph, output_instances, input_instances, nodes_to_remove):
+def index_outputs(G: NXGraph, output_instances) -> dict:
     """
-    Compares the output instances and the input instances, and if they have the same
-    name, it adds the input node to the nodes_to_remove list, updates the attribute
-    of the output node, setting its "type" to "passable_data" and its
-    "text" to the text of the input node and then adds an
-    edge between the output node and the input node's caller function
+    Indexes the output instances by the text of their variable, for the join
+    of compare_outputs_inputs.
+
+    An output is placed at the end of the node producing it, the assignment
+    or call, or at its own end if the producer has no position. Outputs
+    without any position cannot be ordered.
 
     :param G: a NXGraph object
     :param output_instances: a list of output instances
-    :param input_instances: a list of input instances
-    :param nodes_to_remove: a list of nodes to be removed from the graph
-    :return: an updated NXGraph object, the output instances, the input instances and the nodes_to_remove list
+    :return: dict from variable text to the positions of its outputs in
+    increasing order, the outputs at those positions and the outputs without a position
     """
-    # check if same names, remove input node, update output attriute
+    writers = {}
     for output_instance in output_instances:
         output_identifier = output_instance[2]
-        output_caller_function = output_instance[1]
-        output_node = G.get_node(output_identifier)
-        for input_instance in input_instances:
-            input_identifier = input_instance[1]
-            input_caller_function = input_instance[2]
-            input_node = G.get_node(input_identifier)
-            # if same, remove nodes and add edge
-            if output_node['text'] == input_node['text']:
-                # if output_identifier not in nodes_to_remove:
-                # nodes_to_remove.append(output_identifier)
-                if input_identifier not in nodes_to_remove:
-                    nodes_to_remove.append(input_identifier)
-                G.update_node_attrs(output_identifier, {"type": "passable_data", "text": output_node['text']})
-                # add edge between caller functions
-                # if exists, add further attribute
-                G.add_edge(output_identifier, input_caller_function)
+        key = frozenset(G.get_node(output_identifier)['text'])
+        position = node_position(G, output_instance[1], "end")
+        if position is None:
+            position = node_position(G, output_identifier, "end")
+        writers.setdefault(key, []).append((position, output_instance))
+    index = {}
+    for key, entries in writers.items():
+        positioned = sorted((entry for entry in entries if entry[0] is not None), key=lambda entry: entry[0])
+        index[key] = ([position for position, _ in positioned], [instance for _, instance in positioned],
+                      [instance for position, instance in entries if position is None])
+    return index
+
+
+def compare_outputs_inputs(G: NXGraph, output_index: dict, input_instances, nodes_to_remove: dict):
+    """
+    Joins the input instances with the outputs of the same name, and for every
+    output an input reads it adds the input node to nodes_to_remove, updates
+    the attribute of the output node, setting its "type" to "passable_data"
+    and its "text" to the text of the input node and then adds an edge
+    between the output node and the input node's caller function
 
-                continue
+    An input reads the last output of its name that ends before the input
+    starts, a later reassignment shadows the earlier ones. Outputs without a
+    position are read by every input of their name, as are all outputs of the
+    name by an input without a position.
+
+    :param G: a NXGraph object
+    :param output_index: outputs indexed by index_outputs
+    :param input_instances: a list of input instances
+    :param nodes_to_remove: nodes to be removed from the graph, as dict keys in removal order
+    :return: an updated NXGraph object and the nodes_to_remove dict
+    """
+    for input_instance in input_instances:
+        input_identifier = input_instance[1]
+        input_caller_function = input_instance[2]
+        input_node = G.get_node(input_identifier)
+        writers = output_index.get(frozenset(input_node['text']))
+        if writers is None:
+            continue
+        positions, positioned, unordered = writers
+        input_position = node_position(G, input_identifier, "start")
+        if input_position is None:
+            read = positioned + unordered
+        else:
+            last = bisect.bisect_right(positions, input_position)
+            read = positioned[last - 1:last] + unordered
+        for output_instance in read:
+            output_identifier = output_instance[2]
+            nodes_to_remove[input_identifier] = None
+            G.update_node_attrs(output_identifier, {"type": "passable_data", "text": input_node['text']})
+            # add edge between caller functions
+            # if exists, add further attribute
+            G.add_edge(output_identifier, input_caller_function)
 
-    return G, output_instances, input_instances, nodes_to_remove
+    return G, nodes_to_remove
 
 
 def establish_dependencies(G: NXGraph):
     """
     1. Find output and input instances in the graph
-    2. Compare the output instances and input instances with compare_outputs_inputs()
-    and if they have the same name, it updates the attribute of the output node,
+    2. Join the input instances with the output instances they read with
+    compare_outputs_inputs(), a hash join on the variable name that follows
+    the statement order, and update the attribute of every output read,
     adding an edge between the output node and the input node's caller function.
     3. Go leftover input instances and save them into their belonging functions as
     an attribute.
@@ -439,10 +482,11 @@ def establish_dependencies(G: NXGraph):
     input_pattern.add_edge(1, 2)
     input_instances = G.find_matching(input_pattern)
 
-    nodes_to_remove = []
+    # positions are taken before the outputs read lose their attributes
+    output_index = index_outputs(G, output_instances)
+    nodes_to_remove = {}
 
-    G, output_instances, input_instances, nodes_to_remove = compare_outputs_inputs(G, output_instances,
-                                                                                   input_instances, nodes_to_remove)
+    G, nodes_to_remove = compare_outputs_inputs(G, output_index, input_instances, nodes_to_remove)
     # go though leftover inputs, save them into their
     # belonging functions as attribute
     for input_instance in input_instances:
@@ -461,8 +505,7 @@ def establish_dependencies(G: NXGraph):
             child_node["input_variable"] = input_node["text"]
         G.update_node_attrs(child_id, child_node)
         # uncomment this to make input variables that werent defined anywhere before invisible
-        # if input_id not in nodes_to_remove:
-        # nodes_to_remove.append(input_id)
+        # nodes_to_remove[input_id] = None
 
     # check identifiers for potential inputs
     input_pattern = NXGraph()
@@ -471,8 +514,7 @@ def establish_dependencies(G: NXGraph):
     input_pattern.add_edge(1, 2)
 
     input_instances = G.find_matching(input_pattern)
-    G, output_instances, input_instances, nodes_to_remove = compare_outputs_inputs(G, output_instances,
-                                                                                   input_instances, nodes_to_remove)
+    G, nodes_to_remove = compare_outputs_inputs(G, output_index, input_instances, nodes_to_remove)
     for input_instance in input_instances:
         input_id = input_instance[1]
         children = G.successors(input_id)
@@ -490,8 +532,7 @@ def establish_dependencies(G: NXGraph):
             else:
                 child_node["identifier"] = input_node["text"]
         G.update_node_attrs(child_id, child_node)
-        if input_id not in nodes_to_remove:
-            nodes_to_remove.append(input_id)
+        nodes_to_remove[input_id] = None
 
     # go through leftover outputs, save them into their
     # belonging functions as attribute
@@ -510,10 +551,8 @@ def establish_dependencies(G: NXGraph):
         else:
             parent_node["output_variable"] = output_node["text"]
         G.update_node_attrs(parent_id, parent_node)
-        # if output_id not in nodes_to_remove:
-        # nodes_to_remove.append(output_id)
-    for id in nodes_to_remove:
-        G.remove_node(id)
+        # nodes_to_remove[output_id] = None
+    utils.remove_nodes(G, list(nodes_to_remove))
 
 
 def connect_parents_children_drop_node(G: NXGraph, attr: str):
@@ -538,88 +577,79 @@ def connect_parents_children_drop_node(G: NXGraph, attr: str):
         G.remove_node(node_id)
 
 
-def add_attributes_from_import_aliases(G: NXGraph, alieses_dict: dict, cursor):
+def add_attributes_from_knowledge_base(G: NXGraph, aliases_dict: dict, functions_dict: dict,
+                                      imported_modules: list, cursor):
     """
-    Looks for instances of nodes with the attribute "identifier" that match a key
-    in the aliases_dict. If such nodes are found, the function removes the "identifier"
-    attribute and adds the "module" attribute with the value of the corresponding value
-    in the aliases_dict. The function also adds the "full_function_call" attribute
-    by concatenating the value of the aliases_dict with the text attribute of the node,
-    if the key appears in the text attribute. The function also attempts to retrieve a
-    knowledge base entry for the function and adds the description of that entry as an
-    attribute to the node, if it is found.
+    Enriches the nodes from the imports of the script and the knowledge base in
+    a single pass over the graph, then looks up the descriptions of all full
+    function names found in the in-memory knowledge base snapshot.
+
+    For every node, in this order:
+    - an "identifier" that is a key of aliases_dict is removed, the node gets
+      the aliased name as "module" and its text with the alias replaced as
+      "full_function_call"
+    - a "text" that is a key of functions_dict gives the node the module the
+      function was imported from and its full name
+    - an "identifier" that is an imported module gives the node that module
+      and its text as full name
+    Nodes whose full name is in the knowledge base get its "description".
 
     :param G: a NXGraph object
-    :param alieses_dict: A dictionary of import aliases, where keys are the short identifiers
-     and values are the full function names.
-    :param cursor: A cursor object to access a database, which is used to retrieve a
-    knowledge base entry for the functions
-    """
-    for key in alieses_dict:
-        pattern = NXGraph()
-        pattern.add_node(1, {'identifier': key})
-        instances = (G.find_matching(pattern))
-        if instances:
-            for instance in instances:
+    :param aliases_dict: import aliases, short identifiers to full module names
+    :param functions_dict: functions imported by name to their full names
+    :param imported_modules: texts of the modules imported without an alias
+    :param cursor: knowledge base cursor
+    """
+    alias_order = {key: index for index, key in enumerate(aliases_dict)}
+    function_order = {key: index for index, key in enumerate(functions_dict)}
+    module_order = {}
+    for module in imported_modules:
+        for module_name in module:
+            module_order.setdefault(module_name, len(module_order))
+    # (node, full function name) of every knowledge base lookup
+    lookups = []
+
+    for node_id in list(G.nodes()):
+        node_attrs = G.get_node(node_id)
+        if "identifier" in node_attrs:
+            aliases = sorted((key for key in node_attrs["identifier"].fset if key in alias_order),
+                             key=alias_order.get)
+            for key in aliases:
                 # remove short identifier from identifiers list
-                node_id = instance[1]
-                node_attrs = G.get_node(node_id)
                 G.remove_node_attrs(node_id, {'identifier': key})
                 # add "module" attribute and put full function name there
-                module_name = alieses_dict[key].decode("utf-8")
+                module_name = aliases_dict[key].decode("utf-8")
                 G.add_node_attrs(node_id, {"module": module_name})
                 # add full function call to the node
+                short_name = key.decode("utf-8")
                 for value in node_attrs["text"]:
                     node_text = value.decode("utf-8")
-                    short_name = key.decode("utf-8")
-                    long_name = alieses_dict[key].decode("utf-8")
                     if short_name in node_text:
-                        full_name = long_name + node_text[len(short_name):]
+                        full_name = module_name + node_text[len(short_name):]
                         G.add_node_attrs(node_id, {"full_function_call": full_name})
-                # get knowledge base entry
-                kb_function = Function.parse_from_db(cursor, module_name, full_name)
-                if kb_function != -1:
-                    G.add_node_attrs(node_id, {"description": kb_function.description})
-
-
-def add_attributes_from_functions_dict(G: NXGraph, functions_dict: dict, cursor):
-    for key in functions_dict:
-        pattern = NXGraph()
-        pattern.add_node(1, {'text': key})
-        instances = (G.find_matching(pattern))
-        for instance in instances:
-            # add "module" attribute and put full function name there
-            node_id = instance[1]
-            index = functions_dict[key].find(".")
-            module_name = functions_dict[key][:index]
-            G.add_node_attrs(node_id, {"module": module_name})
-            # add full function call to the node
-            full_name = functions_dict[key]
-            G.add_node_attrs(node_id, {"full_function_call": full_name})
-            # get knowledge base entry
-            kb_function = Function.parse_from_db(cursor, module_name, full_name)
-            if kb_function != -1:
-                G.add_node_attrs(node_id, {"description": kb_function.description})
-
-
-def add_attributes_from_module_list(G: NXGraph, imported_modules: list, cursor):
-    for module in imported_modules:
-        for module_name in module:
-            pattern = NXGraph()
-            pattern.add_node(1, {'identifier': module_name})
-            instances = (G.find_matching(pattern))
-            for instance in instances:
-                # add "module" attribute and put full function name there
-                node_id = instance[1]
-                function_call = G.get_node(node_id)["text"]
-                for function_name in function_call:
+                        lookups.append((node_id, full_name))
+        if "text" in node_attrs:
+            functions = sorted((key for key in node_attrs["text"].fset if key in function_order),
+                               key=function_order.get)
+            for key in functions:
+                full_name = functions_dict[key]
+                G.add_node_attrs(node_id, {"module": full_name[:full_name.find(".")]})
+                G.add_node_attrs(node_id, {"full_function_call": full_name})
+                lookups.append((node_id, full_name))
+        node_attrs = G.get_node(node_id)
+        if "identifier" in node_attrs:
+            modules = sorted((key for key in node_attrs["identifier"].fset if key in module_order),
+                             key=module_order.get)
+            for module_name in modules:
+                for function_name in node_attrs["text"]:
                     G.add_node_attrs(node_id, {"module": module_name.decode("utf-8")})
-                    # add full function call
                     G.add_node_attrs(node_id, {"full_function_call": function_name.decode("utf-8")})
-                    kb_function = Function.parse_from_db(cursor, module_name.decode("utf-8"),
-                                                         function_name.decode("utf-8"))
-                    if kb_function != -1:
-                        G.add_node_attrs(node_id, {"description": kb_function.description})
+                    lookups.append((node_id, function_name.decode("utf-8")))
+
+    descriptions = get_knowledge_base(cursor).descriptions(full_name for _, full_name in lookups)
+    for node_id, full_name in lookups:
+        if full_name in descriptions:
+            G.add_node_attrs(node_id, {"description": descriptions[full_name]})
 
 
 def add_labels(G: NXGraph):
@@ -635,69 +665,276 @@ def add_labels(G: NXGraph):
         G.add_node_attrs(node_id, {"label": node_text})
 
 
-def get_ascendant_subgraphs_by_pattern(G: NXGraph, pattern: NXGraph):
+def find_anchored_instances(G, pattern: NXGraph, anti_root_id, anchor_nodes=None) -> list:
     """
-    Finds a complete subgraph of ascendants for a given pattern.
+    Finds the instances of a connected pattern starting from the nodes its
+    anti-root can be mapped to. An IndexedGraph extends every anchor along the
+    pattern edges, other graphs match the pattern on the ascendant subgraph of
+    every anchor.
 
     :param G: an NXGraph object
-    :param pattern: pattern to find ascendants of
-    :return: found subgraphs
+    :param pattern: connected pattern
+    :param anti_root_id: pattern node without descendants
+    :param anchor_nodes: graph nodes the anti-root may be mapped to, all by default
+    :return: found instances
     """
-    anti_root_id = [node for node in pattern.nodes() if len(pattern.descendants(node)) == 0][0]
-    anti_root_attrs = pattern.get_node(anti_root_id)
-    # find all instances of root in graph
+    if hasattr(G, "find_matching_anchored"):
+        return G.find_matching_anchored(pattern, anti_root_id, anchor_nodes)
     root_pattern = NXGraph()
-    root_pattern.add_node(anti_root_id, anti_root_attrs)
-    instances = G.find_matching(root_pattern)
-    subgraphs = []
-    if instances:
-        for instance in instances:
-            subgraphs.append(utils.get_ancestors_nodes(G, list(instance.values())[0]))
-    return subgraphs
+    root_pattern.add_node(anti_root_id, pattern.get_node(anti_root_id))
+    instances = []
+    for anchor in G.find_matching(root_pattern, anchor_nodes):
+        subgraph = utils.get_ancestors_nodes(G, anchor[anti_root_id])
+        instances.extend(G.find_matching(pattern, subgraph))
+    return instances
 
 
-def apply_rule(G, json_rule):
+def find_pattern_instances(G, pattern: NXGraph) -> list:
+    """
+    Finds the instances of a pattern, anchored at its anti-root if it is connected.
+
+    :param G: an NXGraph object
+    :param pattern: pattern to find
+    :return: found instances
+    """
+    if not utils.pattern_connected(pattern):
+        return G.find_matching(pattern)
+    anti_root_id = [node for node in pattern.nodes() if len(pattern.descendants(node)) == 0][0]
+    return find_anchored_instances(G, pattern, anti_root_id)
+
+
+def find_rule_instances(G, rule: CompiledRule) -> list:
+    """
+    Finds the instances of the left-hand side of a rule.
+
+    :param G: an NXGraph object
+    :param rule: CompiledRule
+    :return: found instances
+    """
+    if not rule.connected:
+        return G.find_matching(rule.lhs)
+    return find_anchored_instances(G, rule.lhs, rule.anti_root_id)
+
+
+def apply_rule(G, rule):
     """
     Applies given rule on a graph.
 
     :param G: an NXGraph object
-    :param json_rule: rule instance
+    :param rule: CompiledRule, or a rule instance as json
     """
-    rule = Rule.from_json(json_rule)
-    pattern = rule.lhs
-    instances = []
-    if utils.pattern_connected(pattern):
-        # get subgraphs for faster instance finding
-        subgraphs = get_ascendant_subgraphs_by_pattern(G, pattern)
-        for subgraph in subgraphs:
-            instances.extend(G.find_matching(pattern, subgraph))
-    else:
-        instances = G.find_matching(pattern)
+    if not isinstance(rule, CompiledRule):
+        rule = CompiledRule(rule)
+    for instance in find_rule_instances(G, rule):
+        G.rewrite(rule.rule, instance)
 
-    if instances:
+    return G
+
+
+def apply_rules(G, rules):
+    """
+    Applies the rules in order, skipping every rule whose required node types
+    are not all in the graph. The types present are taken once before the
+    first rule and only grow by the types a rule produces when it rewrote
+    something, so a skipped rule is only reconsidered after a rule before it
+    could have created its anchors. Removals are not tracked, the set of
+    present types can only be too large and a rule is never wrongly skipped.
+
+    :param G: an NXGraph object
+    :param rules: RuleSet or list of compiled rules, a RuleSet also records its stats
+    :return: the transformed graph
+    """
+    stats = getattr(rules, "stats", None)
+    present = utils.present_types(G)
+    applied = skipped = 0
+    start = time.time()
+    for index, rule in enumerate(rules):
+        if present is not None and not rule.required_types <= present:
+            skipped += 1
+            if stats is not None:
+                stats.record(index, skipped=True)
+            continue
+        start_iner = time.time()
+        instances = find_rule_instances(G, rule)
         for instance in instances:
-            G.rewrite(rule, instance)
+            G.rewrite(rule.rule, instance)
+        if instances and present is not None:
+            present |= rule.produced_types
+        applied += 1
+        if stats is not None:
+            stats.record(index, instances=len(instances), rewrites=len(instances),
+                         seconds=time.time() - start_iner)
+    print(f'{applied} rules applied, {skipped} skipped in {time.time() - start}')
+    return G
+
 
+def instance_matches(G, pattern: NXGraph, instance: dict) -> bool:
+    """
+    Checks that an instance found before some rewrites still matches the pattern.
+
+    :param G: an NXGraph object
+    :param pattern: pattern the instance was found for
+    :param instance: dict from pattern nodes to graph nodes
+    :return: True if all nodes, attributes and edges of the instance are still there
+    """
+    for pattern_node, node in instance.items():
+        if node not in G.nodes() or not valid_attributes(pattern.get_node(pattern_node), G.get_node(node)):
+            return False
+    for source, target in pattern.edges():
+        if not G.exists_edge(instance[source], instance[target]):
+            return False
+        if not valid_attributes(pattern.get_edge(source, target), G.get_edge(instance[source], instance[target])):
+            return False
+    return True
+
+
+def find_rule_instances_near(G, rule: CompiledRule, dirty: set) -> list:
+    """
+    Finds the instances of a rule that can involve one of the dirty nodes. For
+    a connected rule these are the instances whose anti-root is a dirty node
+    or one of its descendants, other rules are matched on the whole graph.
+
+    :param G: an NXGraph object
+    :param rule: CompiledRule
+    :param dirty: nodes changed since the rule was last matched
+    :return: found instances
+    """
+    if not rule.connected:
+        return G.find_matching(rule.lhs)
+    region = set()
+    for node in dirty:
+        if node in G.nodes() and node not in region:
+            region.add(node)
+            region.update(G.descendants(node))
+    return find_anchored_instances(G, rule.lhs, rule.anti_root_id, region)
+
+
+def apply_rules_fixed_point(G, rules, max_rewrites: int = RULE_MAX_REWRITES,
+                            max_iterations: int = RULE_MAX_ITERATIONS):
+    """
+    Applies the rules until none of them has an instance left to rewrite.
+
+    Every rule keeps a worklist of dirty nodes, the whole graph at first. The
+    pending rule that comes first in the rule set is matched around its dirty
+    nodes and every instance still matching is rewritten; the nodes a rewrite
+    touched are marked dirty for all rules, so only their neighbourhood is
+    matched again. An instance is rewritten at most once per rule, a rule
+    whose right-hand side changes nothing does not match forever. A rule whose
+    required node types are absent is not matched.
+
+    Only the rules that can match one of the touched nodes, because they
+    require one of its types or have a pattern node of any type, are given
+    the touched nodes again.
+
+    Stops after max_rewrites rewrites or max_iterations rule matchings, the
+    cap is then set as rule_limit of the graph, see convert_graph_to_json,
+    and counted in the stats of a RuleSet.
+
+    :param G: an NXGraph object
+    :param rules: RuleSet or list of compiled rules, a RuleSet also records its stats
+    :param max_rewrites: rewrites after which the engine stops
+    :param max_iterations: rule matchings after which the engine stops
+    :return: the transformed graph
+    """
+    stats = getattr(rules, "stats", None)
+    rule_list = list(rules)
+    rules_by_type, any_type_rules = {}, []
+    for index, rule in enumerate(rule_list):
+        if rule.any_type:
+            any_type_rules.append(index)
+        for node_type in rule.required_types:
+            rules_by_type.setdefault(node_type, []).append(index)
+    # None stands for the whole graph
+    pending = {index: None for index in range(len(rule_list))}
+    fired = set()
+    iterations = rewrites = 0
+    start = time.time()
+    while pending:
+        if iterations >= max_iterations or rewrites >= max_rewrites:
+            limit = "max_iterations" if iterations >= max_iterations else "max_rewrites"
+            print(f'rule engine stopped at {limit} after {iterations} iterations and {rewrites} rewrites')
+            G.rule_limit = limit
+            if stats is not None:
+                stats.record_limit(limit)
+            break
+        index = min(pending)
+        dirty = pending.pop(index)
+        rule = rule_list[index]
+        present = utils.present_types(G)
+        if present is not None and not rule.required_types <= present:
+            if stats is not None:
+                stats.record(index, skipped=True)
+            continue
+        iterations += 1
+        start_iner = time.time()
+        instances = find_rule_instances(G, rule) if dirty is None else find_rule_instances_near(G, rule, dirty)
+        rule_rewrites = 0
+        for instance in instances:
+            key = (index, frozenset(instance.items()))
+            if key in fired or not instance_matches(G, rule.lhs, instance):
+                continue
+            fired.add(key)
+            touched = set(G.rewrite(rule.rule, instance).values())
+            rule_rewrites += 1
+            for other in affected_rules(G, touched, rules_by_type, any_type_rules, len(rule_list)):
+                if other in pending and pending[other] is None:
+                    continue
+                pending.setdefault(other, set()).update(touched)
+            if rewrites + rule_rewrites >= max_rewrites:
+                break
+        rewrites += rule_rewrites
+        if stats is not None:
+            stats.record(index, instances=len(instances), rewrites=rule_rewrites, seconds=time.time() - start_iner)
+    print(f'{rewrites} rewrites in {iterations} iterations in {time.time() - start}')
     return G
 
 
+def affected_rules(G, touched: set, rules_by_type: dict, any_type_rules: list, count: int):
+    """
+    :param G: an NXGraph object
+    :param touched: nodes a rewrite created or changed
+    :param rules_by_type: indices of the rules requiring each node type
+    :param any_type_rules: indices of the rules with a pattern node of any type
+    :param count: number of rules
+    :return: indices of the rules that can match one of the touched nodes
+    """
+    affected = set(any_type_rules)
+    for node in touched:
+        node_type = G.get_node(node).get("type")
+        if node_type is None:
+            continue
+        if not isinstance(node_type, FiniteSet):
+            return range(count)
+        for value in node_type.fset:
+            affected.update(rules_by_type.get(value, ()))
+    return sorted(affected)
+
+
 def jsonify_finite_set(param):
     if len(param.to_json()["data"]) > 1:
         result_list = list()
         for element in param.to_json()["data"]:
-            if isinstance(element, (bytes, bytearray)):
+            if isinstance(element, (bytes, bytearray, SourceText)):
                 result_list.append(element.decode("utf-8"))
             else:
                 result_list.append(element)
         return result_list
     data = param.to_json()["data"][0]
-    if isinstance(data, (bytes, bytearray)):
+    if isinstance(data, (bytes, bytearray, SourceText)):
         data = data.decode("utf-8")
     return data
 
 
-def convert_graph_to_json(G):
+def convert_graph_to_json(G, json_path: str = None):
+    """
+    :param G: transformed graph
+    :param json_path: file the graph is also written to, for debugging
+    :return: graph in the json format of the frontend, with the cap the rule
+    engine stopped at as rule_limit if it did not finish
+    """
     graph_dict = {"nodes": [], "edges": []}
+    if getattr(G, "rule_limit", None) is not None:
+        graph_dict["rule_limit"] = G.rule_limit
     for n, attrs in G.nodes(data=True):
         if str(attrs["type"]) == "{'input'}":
             metadata = {"id": str(n), "type": "input", "targetPosition": "top", "position": {"x": 0, "y": 0},
@@ -720,8 +957,9 @@ def convert_graph_to_json(G):
         edge_attrs = {"id": edge_id, "source": str(s), "target": str(t), 'type': 'smoothstep'}
         graph_dict["edges"].append(edge_attrs)
         i += 1
-    with open('graph.json', 'w') as fp:
-        json.dump(graph_dict, fp, indent=4)
+    if json_path is not None:
+        with open(json_path, 'w') as fp:
+            json.dump(graph_dict, fp, indent=4)
     # print(graph_dict)
     return graph_dict
 
@@ -740,20 +978,19 @@ def draw_rule():
                 plt.show()
 
 
-def transform_graph(G: NXGraph):
+def apply_local_transformations(G: NXGraph, rules: list):
     """
-    Applies rules from the rule base and further transformations to the given graph.
+    Applies the transformations that only look at a node and its neighbourhood,
+    from flipping the tree to the post cleanup. Their result for a top-level
+    statement does not depend on the rest of the script.
 
     :param G: an NXGraph object
-    :return: graph in a json format
+    :param rules: compiled rules of the rule base
+    :return: the transformed graph and the import aliases, imported functions and
+    imported modules found in it
     """
-
     start_iner = time.time()
 
-    # connect to db
-    connection = sqlite3.connect("knowledge_base.db")
-    cursor = connection.cursor()
-
     # initial graph transformation
     flip_tree(G)
     initial_cleanup(G)
@@ -773,20 +1010,12 @@ def transform_graph(G: NXGraph):
 
     end_iner = time.time()
     print(f'pre transformations done in {end_iner - start_iner}')
-    start_outer = time.time()
 
-    # apply rules from rule base one by one
-    rules = get_rules_from_db(cursor)
-    for counter, rule in enumerate(rules, 1):
-        start_iner = time.time()
-        json_rule = read_rule_from_line(rule[0])
-        # print(f'Applying rule #{counter}')
-        G = apply_rule(G, json_rule)
-        end_iner = time.time()
-        # print(f'line {counter} done in {end_iner - start_iner}')
-    end_outer = time.time()
-    # print(f'apply rule  done in {end_outer - start_outer}')
-    start_iner = time.time()
+    # apply rules from rule base one by one, skipping those that cannot match
+    if RULE_ENGINE == "fixed_point":
+        G = apply_rules_fixed_point(G, rules)
+    else:
+        G = apply_rules(G, rules)
 
     # apply transformations that are required after application from rules from rule base
     connect_parents_children_drop_node(G, "subscript")
@@ -795,17 +1024,52 @@ def transform_graph(G: NXGraph):
     connect_parents_children_drop_node(G, "expression_list")
     post_cleanup(G)
 
+    return G, (aliases_dict, functions_dict, imported_modules)
+
+
+def apply_global_transformations(G: NXGraph, imports: tuple, cursor):
+    """
+    Applies the transformations that connect nodes across the whole script and
+    enriches the graph from the knowledge base.
+
+    :param G: an NXGraph object after apply_local_transformations
+    :param imports: import aliases, imported functions and imported modules of the script
+    :param cursor: knowledge base cursor
+    :return: the transformed graph
+    """
+    start_iner = time.time()
+    aliases_dict, functions_dict, imported_modules = imports
+
     # find and connect related nodes
     establish_dependencies(G)
 
     # add knowledge base enrichment to functions that are present there
-    add_attributes_from_import_aliases(G, aliases_dict, cursor)
-    add_attributes_from_functions_dict(G, functions_dict, cursor)
-    add_attributes_from_module_list(G, imported_modules, cursor)
+    add_attributes_from_knowledge_base(G, aliases_dict, functions_dict, imported_modules, cursor)
     add_labels(G)
 
     end_iner = time.time()
     print(f'post transformations done in {end_iner - start_iner}')
+    return G
+
+
+def transform_graph(G: NXGraph, connection: sqlite3.Connection = None, json_path: str = None):
+    """
+    Applies rules from the rule base and further transformations to the given graph.
+
+    :param G: an NXGraph object
+    :param connection: open knowledge base connection, a new one is opened if not given
+    :param json_path: file the result is also written to, workers running
+    concurrently must not share one
+    :return: graph in a json format
+    """
+    # connect to db
+    if connection is None:
+        connection = sqlite3.connect("knowledge_base.db")
+    cursor = connection.cursor()
+
+    G, imports = apply_local_transformations(G, get_rule_set(cursor))
+    G = apply_global_transformations(G, imports, cursor)
+
     print_graph(G)
-    graph_dict = convert_graph_to_json(G)
+    graph_dict = convert_graph_to_json(G, json_path)
     return graph_dict
@@ -0,0 +1,216 @@
+import threading
+from typing import Iterator, List, Optional
+
+from regraph import FiniteSet, NXGraph, Rule
+
+import utils
+from db_driver import get_version, RULES_VERSION
+from rule_creator import get_rules_from_db
+from utils import read_rule_from_line
+
+
+class CompiledRule:
+    """
+    A rule of the rule base with everything apply_rule needs prepared once:
+    the Rule, its left-hand side, whether that pattern is connected and its
+    anti-root, the node without descendants.
+
+    required_types are the node types the left-hand side matches on, the rule
+    cannot match a graph missing any of them. any_type is set when a node of
+    the left-hand side is not restricted to a type and matches every node.
+    produced_types are the types the right-hand side adds to the graph, either
+    on new nodes or on kept ones.
+    """
+
+    __slots__ = ("rule", "lhs", "connected", "anti_root_id", "required_types", "any_type", "produced_types")
+
+    def __init__(self, json_rule: dict):
+        self.rule = Rule.from_json(json_rule)
+        self.lhs = self.rule.lhs
+        self.connected = utils.pattern_connected(self.lhs)
+        self.anti_root_id = None
+        if self.connected:
+            self.anti_root_id = [node for node in self.lhs.nodes() if len(self.lhs.descendants(node)) == 0][0]
+        node_types = [pattern_node_types(self.lhs, node) for node in self.lhs.nodes()]
+        self.required_types = frozenset().union(*node_types)
+        self.any_type = not all(node_types)
+        self.produced_types = frozenset(self._produced_types())
+
+    def _produced_types(self) -> set:
+        rhs, p = self.rule.rhs, self.rule.p
+        kept = {}
+        for p_node, rhs_node in self.rule.p_rhs.items():
+            kept.setdefault(rhs_node, set()).update(pattern_node_types(p, p_node))
+        produced = set()
+        for rhs_node in rhs.nodes():
+            # types of kept or merged nodes were already in the graph
+            produced.update(pattern_node_types(rhs, rhs_node) - kept.get(rhs_node, set()))
+        return produced
+
+
+def pattern_node_types(graph: NXGraph, node_id) -> set:
+    """
+    :param graph: a rule pattern
+    :param node_id: node of the pattern
+    :return: the types the node is restricted to, empty if it matches any type
+    """
+    node_type = graph.get_node(node_id).get("type")
+    return set(node_type.fset) if isinstance(node_type, FiniteSet) else set()
+
+
+class RuleStats:
+    """
+    Counts per rule of a rule set, accumulated over the extractions of this
+    process: how often it was matched against a graph or skipped because a
+    required type was missing, how many instances the matching tried, how
+    many of them were rewritten and the time it took. limits counts the
+    graphs the fixed point engine stopped on before all rules were done.
+    """
+
+    def __init__(self, size: int):
+        self._lock = threading.Lock()
+        self.counters = [{"applied": 0, "skipped": 0, "instances": 0, "rewrites": 0, "seconds": 0.0} for _ in range(size)]
+        self.limits = {"max_rewrites": 0, "max_iterations": 0}
+
+    def record(self, index: int, skipped: bool = False, instances: int = 0, rewrites: int = 0,
+               seconds: float = 0.0):
+        with self._lock:
+            counters = self.counters[index]
+            if skipped:
+                counters["skipped"] += 1
+                return
+            counters["applied"] += 1
+            counters["instances"] += instances
+            counters["rewrites"] += rewrites
+            counters["seconds"] += seconds
+
+    def record_limit(self, limit: str):
+        """
+        :param limit: max_rewrites or max_iterations, the cap the engine stopped at
+        """
+        with self._lock:
+            self.limits[limit] += 1
+
+    def stats(self) -> List[dict]:
+        """
+        :return: counters of every rule, rule is its position in the rule set and
+        so the line of knowledge_base/rule_base.txt it was read from, counting from 0
+        """
+        with self._lock:
+            return [dict(counters, rule=index, seconds=round(counters["seconds"], 4))
+                    for index, counters in enumerate(self.counters)]
+
+    def limit_stats(self) -> dict:
+        """
+        :return: number of times the engine stopped at each cap
+        """
+        with self._lock:
+            return dict(self.limits)
+
+    def most_expensive(self, count: int = 10) -> List[dict]:
+        """
+        :param count: number of rules to return
+        :return: counters of the rules that took the most time, slowest first
+        """
+        return most_expensive(self.stats(), count)
+
+
+def most_expensive(stats: List[dict], count: int = 10) -> List[dict]:
+    return sorted(stats, key=lambda counters: counters["seconds"], reverse=True)[:count]
+
+
+class RuleSet:
+    """
+    The compiled rules of the rule base, in the order they are applied, and
+    the version of the rules table they were compiled from.
+    """
+
+    def __init__(self, rules: List[CompiledRule], version: int):
+        self.rules = rules
+        self.version = version
+        self.stats = RuleStats(len(rules))
+
+    @classmethod
+    def from_cursor(cls, cursor, version: int = None) -> "RuleSet":
+        """
+        :param cursor: knowledge base cursor
+        :param version: version of the rules table, read from the database if not given
+        :return: RuleSet compiled from the rules table
+        """
+        if version is None:
+            version = get_version(cursor, RULES_VERSION)
+        rules = [CompiledRule(read_rule_from_line(row[0])) for row in get_rules_from_db(cursor)]
+        return cls(rules, version)
+
+    def __iter__(self) -> Iterator[CompiledRule]:
+        return iter(self.rules)
+
+    def __len__(self):
+        return len(self.rules)
+
+
+_rule_set: Optional[RuleSet] = None
+_rule_set_lock = threading.Lock()
+
+
+def get_rule_set(cursor) -> RuleSet:
+    """
+    Returns the process-wide compiled rule set, compiling it again only when
+    the version of the rules table changed since it was compiled.
+
+    :param cursor: knowledge base cursor
+    :return: the current RuleSet
+    """
+    global _rule_set
+    version = get_version(cursor, RULES_VERSION)
+    with _rule_set_lock:
+        if _rule_set is None or _rule_set.version != version:
+            _rule_set = RuleSet.from_cursor(cursor, version)
+        return _rule_set
+
+
+def rule_stats() -> dict:
+    """
+    :return: version of the rule set compiled in this process and the counters
+    of its rules, empty if none was compiled yet
+    """
+    rule_set = _rule_set
+    if rule_set is None:
+        return {}
+    return {"version": rule_set.version, "rules": rule_set.stats.stats(), "limits": rule_set.stats.limit_stats()}
+
+
+def merge_rule_stats(reports: List[dict], count: int = 10) -> dict:
+    """
+    Sums the rule counters reported by several processes, e.g. the workers of
+    the extraction pool. Reports of an older version of the rule set are left out.
+
+    :param reports: results of rule_stats
+    :param count: number of rules to return in most_expensive
+    :return: version, totals over all rules and the rules that took the most time
+    """
+    reports = [report for report in reports if report]
+    if not reports:
+        return {}
+    version = max(report["version"] for report in reports)
+    merged = {}
+    limits = {}
+    for report in reports:
+        if report["version"] != version:
+            continue
+        for key, value in report.get("limits", {}).items():
+            limits[key] = limits.get(key, 0) + value
+        for counters in report["rules"]:
+            total = merged.setdefault(counters["rule"], {"rule": counters["rule"]})
+            for key, value in counters.items():
+                if key != "rule":
+                    total[key] = total.get(key, 0) + value
+    totals = {}
+    for counters in merged.values():
+        counters["seconds"] = round(counters["seconds"], 4)
+        for key, value in counters.items():
+            if key != "rule":
+                totals[key] = totals.get(key, 0) + value
+    totals["seconds"] = round(totals.get("seconds", 0.0), 4)
+    return {"version": version, "rules": len(merged), "totals": totals, "limits": limits,
+            "most_expensive": most_expensive(list(merged.values()), count)}
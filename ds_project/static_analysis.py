@@ -1,104 +1,94 @@
 import sqlite3
 from typing import Dict, List, Union, Tuple, Set
 
-import utils
-from regraph import NXGraph
+import trackers
+from kb_snapshot import KnowledgeBaseSnapshot, get_knowledge_base
+from syntax_tree import CompactTree
 from utils import format_b_string
 
 argument_list_ignore = {"(", ",", ")"}
+loop_types = {"for_statement", "while_statement"}
 
 
-def extract_imports(graph: NXGraph) -> Dict[str, str]:
+def extract_imports(tree: CompactTree) -> Dict[str, str]:
     mappings = {}
-    for node, attr in graph.nodes(data=True):
-        (node_type,) = attr["type"]
+    for node in tree.nodes_of_type("import_from_statement", "aliased_import"):
+        node_type = tree.type(node)
         if node_type == "import_from_statement":
-            children = utils.get_successor_list(graph, node)
-            prefix_id = children[1]
-            (prefix,) = graph.get_node(prefix_id)["text"]
-            prefix = format_b_string(prefix)
+            children = tree.children(node)
+            prefix = format_b_string(tree.text(children[1]))
             for child in children[3:]:
-                child_attrs = graph.get_node(child)
-                (child_type,) = child_attrs["type"]
-                if child_type == "dotted_name":
-                    (child_text,) = child_attrs["text"]
-                    child_text = format_b_string(child_text)
+                if tree.type(child) == "dotted_name":
+                    child_text = format_b_string(tree.text(child))
                     mappings[child_text] = prefix + "." + child_text
         if node_type == "aliased_import":
-            children = utils.get_successor_list(graph, node)
-            (prefix, ) = graph.get_node(children[0])["text"]
-            (alias,) = graph.get_node(children[2])["text"]
-            alias = format_b_string(alias)
+            children = tree.children(node)
+            prefix = tree.text(children[0])
+            alias = format_b_string(tree.text(children[2]))
             mappings[alias] = format_b_string(prefix)
     return mappings
 
 
-def extract_files(graph: NXGraph) -> Set[str]:
+def extract_files(tree: CompactTree) -> Set[str]:
     files = []
-    for node, attr in graph.nodes(data=True):
-        (node_type,) = attr["type"]
-        if node_type == "assignment":
-            assignment_children = utils.get_successor_list(graph, node)
-            assigned_to_attr = graph.get_node(assignment_children[2])
-            (assigned_type,) = assigned_to_attr["type"]
-            if assigned_type == "call":
-                call_children = utils.get_successor_list(graph, assignment_children[2])
-                f_name_attr = graph.get_node(call_children[0])
-                (f_name_type,) = f_name_attr["type"]
-                (f_name,) = f_name_attr["text"]
-                if f_name_type == "identifier" and format_b_string(f_name) == "open":
-                    file_name_attr = graph.get_node(assignment_children[0])
-                    (file_name,) = file_name_attr["text"]
-                    files.append(format_b_string(file_name))
+    for node in tree.nodes_of_type("assignment"):
+        assignment_children = tree.children(node)
+        if tree.type(assignment_children[2]) == "call":
+            call_children = tree.children(assignment_children[2])
+            f_name_type = tree.type(call_children[0])
+            f_name = tree.text(call_children[0])
+            if f_name_type == "identifier" and format_b_string(f_name) == "open":
+                file_name = tree.text(assignment_children[0])
+                files.append(format_b_string(file_name))
     return set(files)
 
-def find_call_in_kb(function_name: str, up_to_arguments: int, con: sqlite3.Connection) -> Union[None, List[str]]:
-    cur = con.cursor()
-    if up_to_arguments > 0:
-        cur.execute(
-            """SELECT argument_name
-             FROM functions as f, arguments as a 
-             WHERE function_title = ? 
-             AND f.function_id = a.function_id
-             AND argument_position BETWEEN 1 AND ?""",
-            (function_name, up_to_arguments))
-        result = [arg_name for (arg_name,) in cur.fetchall()]
-        return result if len(result) > 0 else None
-    else:
-        cur.execute("""
-        SELECT function_id FROM functions as f WHERE function_title = ?""", (function_name, ))
-        return [] if (len(cur.fetchall()) > 0) else None
-
-def find_arguments(graph: NXGraph, call_node: int) -> Tuple[List[int], Dict[str, int]]:
-    arguments = utils.get_successor_list(graph, utils.get_successor_list(graph, call_node)[1])
-    arguments = [(node, graph.get_node(node)["type"]) for node in arguments]
-    arguments = [(node, node_type) for (node, (node_type,)) in arguments if node_type not in argument_list_ignore]
+def find_call_in_kb(function_name: str, up_to_arguments: int,
+                    knowledge_base: KnowledgeBaseSnapshot) -> Union[None, List[str]]:
+    return knowledge_base.find_call(function_name, up_to_arguments)
+
+def find_arguments(tree: CompactTree, call_node: int) -> Tuple[List[int], Dict[str, int]]:
+    arguments = tree.children(tree.children(call_node)[1])
+    arguments = [(node, tree.type(node)) for node in arguments]
+    arguments = [(node, node_type) for (node, node_type) in arguments if node_type not in argument_list_ignore]
     named_arguments = {}
     positional_arguments = []
 
     for (node, node_type) in arguments:
         if node_type == "keyword_argument":
-            children = utils.get_successor_list(graph, node)
-            (name, ) = graph.get_node(children[0])["text"]
+            children = tree.children(node)
+            name = tree.text(children[0])
             named_arguments[format_b_string(name)] = children[2]
         else:
             positional_arguments.append(node)
 
     return positional_arguments, named_arguments
 
-def create_parameter_tracker(function_name: str, argument_name: str, run_id: int, expr_id: int) -> Tuple[bytes, bytes]:
+def sample_argument(sample: Union[None, str], site: int = None) -> str:
+    """
+    :param sample: sampling policy of the tracker, see trackers.create_sampler
+    :param site: id of the call, given to output trackers that do not get an expr_id
+    :return: keyword arguments passing the policy to the tracker, empty if every value is recorded
+    """
+    if sample is None:
+        return ""
+    if site is None:
+        return ", sample=\"{}\"".format(sample)
+    return ", sample=\"{}\", site={}".format(sample, site)
+
+def create_parameter_tracker(function_name: str, argument_name: str, run_id: int, expr_id: int,
+                             sample: str = None) -> Tuple[bytes, bytes]:
     before = "trackers.hyperparam_tracker(\"{}\", \"{}\", ".format(function_name, argument_name)
-    after = ", run_id={}, expr_id={})".format(run_id, expr_id)
+    after = ", run_id={}, expr_id={}{})".format(run_id, expr_id, sample_argument(sample))
     return (bytes(before, "utf8"), bytes(after, "utf8"))
 
-def create_stdout_tracker(run_id: int) -> Tuple[bytes, bytes]:
+def create_stdout_tracker(run_id: int, sample: str = None, site: int = None) -> Tuple[bytes, bytes]:
     before = "trackers.stdout_tracker("
-    after = ", {})".format(run_id)
+    after = ", {}{})".format(run_id, sample_argument(sample, site))
     return (bytes(before, "utf8"), bytes(after, "utf8"))
 
-def create_file_tracker(file: str, run_id: int) -> Tuple[bytes, bytes]:
+def create_file_tracker(file: str, run_id: int, sample: str = None, site: int = None) -> Tuple[bytes, bytes]:
     before = "trackers.file_tracker("
-    after = ", {}, {})".format(file, run_id)
+    after = ", {}, {}{})".format(file, run_id, sample_argument(sample, site))
     return (bytes(before, "utf8"), bytes(after, "utf8"))
 
 def create_plot_tracker(run_id: int) -> Tuple[bytes, bytes]:
@@ -107,76 +97,91 @@ def create_plot_tracker(run_id: int) -> Tuple[bytes, bytes]:
     return (bytes(before, "utf8"), bytes(after, "utf8"))
 
 
-def resolve_attribute_or_identifier(graph: NXGraph, node: int, name_mapping: Dict[str, str], files: Set[str]) -> Union[Tuple[str], Tuple[str, str]]:
-    attrs = graph.get_node(node)
-    (kind, ) = attrs["type"]
+def in_loop(tree: CompactTree, node: int) -> bool:
+    parent = tree.parent[node]
+    while parent != -1:
+        if tree.type(parent) in loop_types:
+            return True
+        parent = tree.parent[parent]
+    return False
+
+
+def resolve_attribute_or_identifier(tree: CompactTree, node: int, name_mapping: Dict[str, str], files: Set[str]) -> Union[Tuple[str], Tuple[str, str]]:
+    kind = tree.type(node)
     if kind == "identifier":
-        (name,) = attrs["text"]
-        name = format_b_string(name)
+        name = format_b_string(tree.text(node))
         if name in name_mapping:
             return (name_mapping[name],)
         else:
             return (name,)
     if kind == "attribute":
-        children = utils.get_successor_list(graph, node)
-        (first_identifier,) = graph.get_node(children[0])["text"]
-        first_identifier = format_b_string(first_identifier)
+        children = tree.children(node)
+        first_identifier = format_b_string(tree.text(children[0]))
         if first_identifier in files:
-            (function_name,) = graph.get_node(children[2])["text"]
-            function_name = format_b_string(function_name)
+            function_name = format_b_string(tree.text(children[2]))
             return (function_name, first_identifier)
         if first_identifier in name_mapping:
             first_identifier = name_mapping[first_identifier]
         name_parts = [first_identifier] + \
-                     [format_b_string(graph.get_node(child)["text"])
+                     [format_b_string(tree.text(child))
                       for child in children[1:]]
         return ("".join([part.replace("'", "") for part in name_parts]),)
 
 def insert_trackers(
-        graph: NXGraph,
+        tree: CompactTree,
         script: bytes,
         name_mapping: Dict[str, str],
         kb_con: sqlite3.Connection,
         isomorphism: Dict[int, int],
         run_id: int,
-        files: Set[str]) -> bytes:
+        files: Set[str],
+        loop_sampling: str = None) -> bytes:
+    """
+    :param loop_sampling: sampling policy of the output and hyperparameter
+    trackers inserted inside loops, see trackers.create_sampler, by default
+    they record every value. Output trackers are sampled per call, the call
+    is identified by its start byte in the script.
+    """
+    if loop_sampling is not None:
+        # raises ValueError for an unknown policy before it is written into the script
+        trackers.create_sampler(loop_sampling)
     insertions: List[Tuple[int, bytes]] = []
+    knowledge_base = get_knowledge_base(kb_con.cursor())
+    imported_modules = {full_name.split(".")[0] for full_name in name_mapping.values()}
     def remember_tracker(to_insert: Tuple[bytes, bytes], node: int):
-        arg_attr = graph.get_node(node)
-        (begin,) = arg_attr["start"]
-        (end,) = arg_attr["end"]
-        insertions.append((begin, to_insert[0]))
-        insertions.append((end, to_insert[1]))
-
-    for node, attr in graph.nodes(data=True):
-        (node_type,) = attr["type"]
-        if node_type == "call":
-            #Extract all necessary information from the node
-            children = utils.get_successor_list(graph, node)
-            decoded_name = resolve_attribute_or_identifier(graph, children[0], name_mapping, files)
-            if len(decoded_name) == 1:
-                (function_name,) = decoded_name
-                file_name = None
-            else:
-                (function_name, file_name) = decoded_name
-            positional_arguments, named_arguments = find_arguments(graph, node)
-            positional_naming = find_call_in_kb(function_name, len(positional_arguments), kb_con)
-            if file_name is not None and function_name == "write":
-                to_insert = create_file_tracker(file_name, run_id)
-                remember_tracker(to_insert, positional_arguments[0])
-            if function_name == "print":
-                to_insert = create_stdout_tracker(run_id)
-                remember_tracker(to_insert, positional_arguments[0])
-            elif function_name == "matplotlib.pyplot.savefig":
-                to_insert = create_plot_tracker(run_id)
-                remember_tracker(to_insert, positional_arguments[0])
-            #Check if call is in KB, if so insert hyperparameter tracker
-            elif positional_naming is not None:
-                #Only continue if function is in knowledge base
-                named_arguments.update({function_name: node for (function_name, node) in zip(positional_naming, positional_arguments)})
-                for arg_name, arg_node in named_arguments.items():
-                    to_insert = create_parameter_tracker(function_name, arg_name, run_id, isomorphism[node])
-                    remember_tracker(to_insert, arg_node)
+        insertions.append((tree.start[node], to_insert[0]))
+        insertions.append((tree.end[node], to_insert[1]))
+
+    for node in tree.nodes_of_type("call"):
+        #Extract all necessary information from the node
+        children = tree.children(node)
+        decoded_name = resolve_attribute_or_identifier(tree, children[0], name_mapping, files)
+        if len(decoded_name) == 1:
+            (function_name,) = decoded_name
+            file_name = None
+        else:
+            (function_name, file_name) = decoded_name
+        positional_arguments, named_arguments = find_arguments(tree, node)
+        # calls the imports do not resolve are matched by their longest dotted suffix
+        kb_name = knowledge_base.resolve(function_name, imported_modules) or function_name
+        positional_naming = find_call_in_kb(kb_name, len(positional_arguments), knowledge_base)
+        sample = loop_sampling if loop_sampling is not None and in_loop(tree, node) else None
+        if file_name is not None and function_name == "write":
+            to_insert = create_file_tracker(file_name, run_id, sample, tree.start[node])
+            remember_tracker(to_insert, positional_arguments[0])
+        if function_name == "print":
+            to_insert = create_stdout_tracker(run_id, sample, tree.start[node])
+            remember_tracker(to_insert, positional_arguments[0])
+        elif function_name == "matplotlib.pyplot.savefig":
+            to_insert = create_plot_tracker(run_id)
+            remember_tracker(to_insert, positional_arguments[0])
+        #Check if call is in KB, if so insert hyperparameter tracker
+        elif positional_naming is not None:
+            #Only continue if function is in knowledge base
+            named_arguments.update({function_name: node for (function_name, node) in zip(positional_naming, positional_arguments)})
+            for arg_name, arg_node in named_arguments.items():
+                to_insert = create_parameter_tracker(kb_name, arg_name, run_id, isomorphism[node], sample)
+                remember_tracker(to_insert, arg_node)
 
     #Sort insertions by position
     insertions.sort(key=lambda it: it[0])
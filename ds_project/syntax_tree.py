@@ -0,0 +1,227 @@
+from array import array
+from collections import deque
+from typing import Dict, Iterator, List, Union
+
+from indexed_graph import IndexedGraph
+
+# texts up to this length are copied, once per distinct text, a SourceText
+# would take more memory than them
+INLINE_TEXT_LIMIT = 64
+
+
+class SourceText:
+    """
+    Text of a node stored as a (start, end) reference into the shared source
+    buffer instead of a copy of the bytes.
+
+    Hashes and compares equal to the bytes it refers to, so it can be used as
+    a regraph attribute value and in rule patterns. The bytes are only
+    materialised when the text is actually read, e.g. by decode().
+    """
+
+    __slots__ = ("buffer", "start", "end", "_hash")
+
+    def __init__(self, buffer: memoryview, start: int, end: int):
+        self.buffer = buffer
+        self.start = start
+        self.end = end
+        self._hash = None
+
+    def view(self) -> memoryview:
+        return self.buffer[self.start:self.end]
+
+    def decode(self, encoding="utf-8", errors="strict") -> str:
+        return str(self.view(), encoding, errors)
+
+    def __bytes__(self):
+        return bytes(self.view())
+
+    def __len__(self):
+        return self.end - self.start
+
+    def __hash__(self):
+        # a read-only memoryview hashes like the bytes it contains, without copying them
+        if self._hash is None:
+            self._hash = hash(self.view())
+        return self._hash
+
+    def __eq__(self, other):
+        if isinstance(other, SourceText):
+            return self.view() == other.view()
+        if isinstance(other, (bytes, bytearray, memoryview)):
+            return self.view() == other
+        return NotImplemented
+
+    def __str__(self):
+        return str(bytes(self))
+
+    def __repr__(self):
+        return repr(bytes(self))
+
+    def __copy__(self):
+        return self
+
+    def __deepcopy__(self, memo):
+        return self
+
+    def __reduce__(self):
+        return bytes, (bytes(self),)
+
+
+class CompactTree:
+    """
+    Array-backed representation of a tree-sitter syntax tree.
+
+    Nodes are numbered in breadth-first order, which are the same ids the
+    NXGraph built by GraphExtractor.bfs_tree_traverser uses. Node types are
+    interned into a small table, the structure is kept in parent/first-child/
+    next-sibling arrays and the text of a node is a slice of the source buffer.
+    """
+
+    def __init__(self, source: bytes, offset: int = 0):
+        # the buffer has to be read-only for SourceText to be hashable
+        self.source = bytes(source)
+        self.buffer = memoryview(self.source)
+        # byte offset of the source within the parsed script
+        self.offset = offset
+        self.type_names: List[str] = []
+        self._type_ids: Dict[str, int] = {}
+        self.types = array('H')
+        self.parent = array('i')
+        self.first_child = array('i')
+        self.next_sibling = array('i')
+        self.position = array('I')
+        self.start = array('I')
+        self.end = array('I')
+        # one copy per distinct short text, shared by all nodes with that text
+        self._texts: Dict[bytes, bytes] = {}
+
+    @classmethod
+    def from_tree(cls, tree, source: bytes = None) -> "CompactTree":
+        """
+        Traverses a tree-sitter tree breadth-first and stores it in arrays.
+
+        :param tree: tree-sitter tree to be traversed
+        :param source: bytes the tree was parsed from, defaults to tree.text
+        :return: CompactTree of the tree
+        """
+        compact = cls(tree.text if source is None else source)
+        compact._append(tree.root_node, -1, 0)
+        compact._traverse(deque([(0, tree.root_node)]))
+        return compact
+
+    @classmethod
+    def from_statement(cls, root_node, statement_node, position: int, source: bytes) -> "CompactTree":
+        """
+        Stores the root of a tree with only one of its top-level statements
+        below it. Only the text of the statement is kept, node ids are numbered
+        in breadth-first order of the statement, start and end stay byte
+        offsets into the whole script.
+
+        :param root_node: root node of the tree-sitter tree
+        :param statement_node: child of the root node to keep
+        :param position: index of the statement among the children of the root
+        :param source: bytes the whole tree was parsed from
+        :return: CompactTree of the statement
+        """
+        start, end = statement_node.start_byte, statement_node.end_byte
+        compact = cls(source[start:end], start)
+        compact._append(root_node, -1, 0)
+        # the root is cut down to the statement
+        compact.start[0], compact.end[0] = start, end
+        compact.first_child[0] = compact._append(statement_node, 0, position)
+        compact._traverse(deque([(1, statement_node)]))
+        return compact
+
+    def _traverse(self, queue: deque):
+        while queue:
+            parent_id, node = queue.popleft()
+            previous_id = -1
+            for i, child_node in enumerate(node.children):
+                node_id = self._append(child_node, parent_id, i)
+                if previous_id == -1:
+                    self.first_child[parent_id] = node_id
+                else:
+                    self.next_sibling[previous_id] = node_id
+                previous_id = node_id
+                queue.append((node_id, child_node))
+
+    def _append(self, node, parent_id: int, position: int) -> int:
+        type_id = self._type_ids.get(node.type)
+        if type_id is None:
+            type_id = len(self.type_names)
+            self._type_ids[node.type] = type_id
+            self.type_names.append(node.type)
+        self.types.append(type_id)
+        self.parent.append(parent_id)
+        self.first_child.append(-1)
+        self.next_sibling.append(-1)
+        self.position.append(position)
+        self.start.append(node.start_byte)
+        self.end.append(node.end_byte)
+        return len(self.types) - 1
+
+    def __len__(self):
+        return len(self.types)
+
+    def type(self, node_id: int) -> str:
+        return self.type_names[self.types[node_id]]
+
+    def text(self, node_id: int) -> bytes:
+        return bytes(self.buffer[self.start[node_id] - self.offset:self.end[node_id] - self.offset])
+
+    def text_ref(self, node_id: int) -> Union[SourceText, bytes]:
+        """
+        :param node_id: id of the node
+        :return: the text of the node as a SourceText, or as bytes if it is short
+        """
+        start, end = self.start[node_id] - self.offset, self.end[node_id] - self.offset
+        if end - start <= INLINE_TEXT_LIMIT:
+            text = bytes(self.buffer[start:end])
+            return self._texts.setdefault(text, text)
+        return SourceText(self.buffer, start, end)
+
+    def children(self, node_id: int) -> List[int]:
+        """
+        :param node_id: id of the parent node
+        :return: ids of the children in source order
+        """
+        children = []
+        child_id = self.first_child[node_id]
+        while child_id != -1:
+            children.append(child_id)
+            child_id = self.next_sibling[child_id]
+        return children
+
+    def nodes_of_type(self, *type_names: str) -> Iterator[int]:
+        """
+        :param type_names: node types to look for
+        :return: ids of all nodes of one of the given types, in ascending order
+        """
+        type_ids = {self._type_ids[name] for name in type_names if name in self._type_ids}
+        if not type_ids:
+            return
+        for node_id, type_id in enumerate(self.types):
+            if type_id in type_ids:
+                yield node_id
+
+    def to_nxgraph(self, flipped: bool = False) -> IndexedGraph:
+        """
+        Materialises the tree as the NXGraph regraph rewriting works on.
+
+        :param flipped: emit child -> parent edges, the orientation flip_tree
+        turns the tree into, instead of parent -> child ones
+        :return: IndexedGraph with type, text, pos, start and end node attributes, long
+        texts being SourceText references into the source buffer
+        """
+        G = IndexedGraph()
+        G.add_node(0, attrs={"type": self.type(0), "text": self.text_ref(0)})
+        for node_id in range(1, len(self)):
+            G.add_node(node_id, attrs={"type": self.type(node_id), "text": self.text_ref(node_id),
+                                       "pos": self.position[node_id], "start": self.start[node_id],
+                                       "end": self.end[node_id]})
+            if flipped:
+                G.add_edge(node_id, self.parent[node_id])
+            else:
+                G.add_edge(self.parent[node_id], node_id)
+        return G
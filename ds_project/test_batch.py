@@ -0,0 +1,112 @@
+import asyncio
+import io
+import os
+import tarfile
+
+import test_scripts
+from batch import extract_batch_async, iter_sources, iter_tarball
+from extraction_pool import ExtractionPool, ExtractionTimeoutError, PoolSaturatedError
+
+
+def tarball(files: dict) -> io.BytesIO:
+    buffer = io.BytesIO()
+    with tarfile.open(fileobj=buffer, mode="w:gz") as tar:
+        for name, source in files.items():
+            info = tarfile.TarInfo(name)
+            info.size = len(source)
+            tar.addfile(info, io.BytesIO(source))
+    buffer.seek(0)
+    return buffer
+
+
+def truncated_tarball(members=20) -> bytes:
+    # random sources do not compress, the cut falls in the middle of the members
+    archive = tarball({"{:02}.py".format(i): "x = {!r}\n".format(os.urandom(256).hex()).encode()
+                       for i in range(members)}).getvalue()
+    return archive[:len(archive) // 2]
+
+
+class FakePool:
+    """
+    Answers extractions by the first line of the script.
+    """
+
+    def __init__(self):
+        self.saturated = 1
+        self.cancelled = []
+
+    async def extract(self, code, language):
+        if code.startswith(b"saturated") and self.saturated:
+            self.saturated -= 1
+            raise PoolSaturatedError("full")
+        if code.startswith(b"slow"):
+            try:
+                await asyncio.sleep(60)
+            except asyncio.CancelledError:
+                self.cancelled.append(code)
+                raise
+        if code.startswith(b"timeout"):
+            raise ExtractionTimeoutError("slow")
+        return {"nodes": [code.decode()], "edges": []}
+
+
+def collect(sources, pool, max_pending=4):
+    async def run():
+        return [record async for record in extract_batch_async(sources, pool, max_pending, retry_delay=0)]
+    return asyncio.run(run())
+
+
+def test_records_of_a_tarball():
+    sources = iter_tarball(tarball({"a.py": b"a = 1", "notes.txt": b"skipped", "b.py": b"timeout",
+                                    "c.py": b"saturated"}))
+    pool = FakePool()
+    records = {record["file"]: record for record in collect(sources, pool)}
+    assert sorted(records) == ["a.py", "b.py", "c.py"]
+    assert records["a.py"]["status"] == "ok" and records["a.py"]["graph"]["nodes"] == ["a = 1"]
+    assert records["b.py"]["status"] == "timeout"
+    # waited for room in the pool instead of failing
+    assert records["c.py"]["status"] == "ok" and pool.saturated == 0
+
+
+def test_pending_extractions_are_cancelled_when_the_stream_closes():
+    pool = FakePool()
+
+    async def run():
+        sources = iter([("fast.py", b"fast", "python"), ("slow1.py", b"slow 1", "python"),
+                        ("slow2.py", b"slow 2", "python")])
+        batch = extract_batch_async(sources, pool, 4)
+        first = await batch.__anext__()
+        # the client disconnected
+        await batch.aclose()
+        await asyncio.sleep(0)
+        return first
+
+    assert asyncio.run(run())["file"] == "fast.py"
+    assert sorted(pool.cancelled) == [b"slow 1", b"slow 2"]
+
+
+def test_batch_goes_through_the_pool_counters():
+    pool = ExtractionPool(workers=1, queue_size=1, timeout=30)
+    try:
+        sources = iter([("a.py", test_scripts.Python.code_0.encode(), "python"),
+                        ("b.py", b"x = 1\n", "python")])
+        records = collect(sources, pool, max_pending=2)
+        stats = pool.stats()
+    finally:
+        pool.shutdown()
+    assert [record["status"] for record in records] == ["ok", "ok"]
+    assert stats["completed"] == 2 and stats["rejected"] >= 1 and stats["pending"] == 0
+
+
+def test_truncated_tarball_ends_with_an_error_record(tmp_path):
+    archive = truncated_tarball()
+    assert tarfile.is_tarfile(io.BytesIO(archive))
+    records = collect(iter_tarball(io.BytesIO(archive), "batch.tar.gz"), FakePool())
+    ok = [record for record in records if record["status"] == "ok"]
+    errors = [record for record in records if record["status"] == "error"]
+    assert 5 <= len(ok) < 20 and len(errors) == 1
+    assert errors[0]["file"] in ("batch.tar.gz", "{:02}.py".format(len(ok)))
+    path = tmp_path / "batch.tar.gz"
+    path.write_bytes(archive)
+    sources = list(iter_sources(str(path)))
+    assert isinstance(sources[-1][1], Exception) and sources[-1][0] in (str(path), errors[0]["file"])
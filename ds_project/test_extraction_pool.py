@@ -0,0 +1,120 @@
+import asyncio
+import os
+import signal
+import time
+
+import pytest
+
+import extraction_pool
+import test_scripts
+from extraction_pool import ExtractionPool, ExtractionTimeoutError, PoolSaturatedError, run_extraction
+
+
+class SlowExtractor:
+    def extract_pipeline(self, code, language, connection=None, json_path=None):
+        deadline = time.time() + 10
+        while time.time() < deadline:
+            pass
+
+
+def hang(deadline):
+    # a job the alarm cannot stop
+    signal.signal(signal.SIGALRM, signal.SIG_IGN)
+    time.sleep(60)
+
+
+def test_timed_out_worker_is_recycled(monkeypatch):
+    recycled = []
+    monkeypatch.setattr(extraction_pool, "_extractor", SlowExtractor())
+    monkeypatch.setattr(extraction_pool, "recycle_worker", lambda: recycled.append(True))
+    start = time.time()
+    with pytest.raises(ExtractionTimeoutError):
+        run_extraction("x = 1", "python", time.time() + 0.2)
+    assert time.time() - start < 5
+    assert recycled == [True]
+    # expired while queued, nothing ran that could need recycling
+    with pytest.raises(ExtractionTimeoutError):
+        run_extraction("x = 1", "python", time.time() - 1)
+    assert recycled == [True]
+
+
+def test_recycled_worker_extracts_again():
+    extraction_pool.init_worker()
+    old_extractor = extraction_pool._extractor
+    extraction_pool.recycle_worker()
+    assert extraction_pool._extractor is not old_extractor
+    assert extraction_pool._extractor.parsers is not old_extractor.parsers
+    written_before = os.path.getmtime("graph.json") if os.path.exists("graph.json") else None
+    result = run_extraction(test_scripts.Python.code_0, "python")
+    assert result["nodes"]
+    # concurrent workers do not write graph.json into the working directory
+    assert (os.path.getmtime("graph.json") if os.path.exists("graph.json") else None) == written_before
+
+
+def test_pool_rejects_when_saturated_and_times_out():
+    async def run():
+        pool = ExtractionPool(workers=1, queue_size=1, timeout=30)
+        try:
+            first = asyncio.ensure_future(pool.extract(test_scripts.Python.code_0, "python"))
+            await asyncio.sleep(0)
+            with pytest.raises(PoolSaturatedError):
+                await pool.extract("x = 1", "python")
+            assert (await first)["nodes"]
+            # the worker is up, a deadline it cannot meet makes the job expire
+            pool.timeout = 1e-6
+            with pytest.raises(ExtractionTimeoutError):
+                await pool.extract(test_scripts.Python.code_0, "python")
+            return pool.stats()
+        finally:
+            pool.shutdown()
+
+    stats = asyncio.run(run())
+    assert stats["rejected"] == 1
+    assert stats["completed"] == 1
+    assert stats["timed_out"] == 1
+    assert stats["pending"] == 0
+
+
+def test_hung_worker_is_replaced():
+    async def run():
+        pool = ExtractionPool(workers=1, queue_size=2, timeout=0.5)
+        try:
+            await pool.extract("x = 1", "python")
+            process = next(iter(pool._executors[0]._processes.values()))
+            with pytest.raises(ExtractionTimeoutError):
+                await pool._run(None, hang)
+            process.join(5)
+            assert not process.is_alive()
+            pool.timeout = 30
+            assert (await pool.extract("x = 1", "python"))["nodes"]
+            return pool.stats()
+        finally:
+            pool.shutdown()
+
+    stats = asyncio.run(run())
+    assert stats["restarted"] == 1 and stats["timed_out"] == 1
+    assert stats["completed"] == 2 and stats["pending"] == 0 and stats["load"] == [0]
+
+
+def test_session_updates_are_pinned_to_one_worker():
+    async def run():
+        pool = ExtractionPool(workers=2, queue_size=4, timeout=30)
+        try:
+            worker = pool.session_worker("editor")
+            code = test_scripts.Python.code_0
+            first = await pool.update_session("editor", code, "python", 1, 1)
+            second = await pool.update_session("editor", code + "\nz = 1\n", "python", 1, 1)
+            return worker, first, second, await pool.worker_stats(), pool.stats()
+        finally:
+            pool.shutdown()
+
+    worker, first, second, worker_stats, stats = asyncio.run(run())
+    assert len(second["nodes"]) > len(first["nodes"])
+    sessions = worker_stats[worker]["sessions"]
+    assert sessions["sessions"] == 1 and sessions["updates"] == 2
+    assert sessions["statements_reused"] > 0
+    assert worker_stats[1 - worker]["sessions"]["sessions"] == 0
+    # the rule counters of the worker cover both updates
+    assert worker_stats[worker]["rules"]["rules"]
+    assert worker_stats[1 - worker]["rules"]["version"] == worker_stats[worker]["rules"]["version"]
+    assert stats["completed"] == 2 and stats["pending"] == 0
@@ -0,0 +1,83 @@
+import json
+from collections import Counter
+
+import pytest
+from regraph import NXGraph
+
+import test_scripts
+from extraction_session import ExtractionSession, Fragment, STATEMENT_NODE_ID, compute_edit, splice_fragments
+from graph_extractor import GraphExtractor
+from parser_pool import get_parser_pool
+
+SCRIPTS = sorted(name for name in vars(test_scripts.Python) if name.startswith("code"))
+
+
+def canonical(graph: dict):
+    # node ids differ between a spliced and a freshly built graph, lists come from sets
+    nodes = {node["id"]: json.dumps({key: sorted(value, key=str) if isinstance(value, list) else value
+                                     for key, value in node["data"].items()}, sort_keys=True, default=str)
+             for node in graph["nodes"]}
+    return (Counter(nodes.values()),
+            Counter((nodes[edge["source"]], nodes[edge["target"]]) for edge in graph["edges"]))
+
+
+def edits(code: str):
+    lines = code.split("\n")
+    middle = len(lines) // 2
+    return [
+        code + "\nz = np.mean(x)\n",
+        "\n".join(lines[1:]),
+        "\n".join(line.replace("x", "xx", 1) if i == middle else line for i, line in enumerate(lines)),
+    ]
+
+
+def test_compute_edit():
+    assert compute_edit(b"a = 1\n", b"a = 1\n") is None
+    assert compute_edit(b"ab\ncd", b"ab\nXcd") == {
+        "start_byte": 3, "old_end_byte": 3, "new_end_byte": 4,
+        "start_point": (1, 0), "old_end_point": (1, 0), "new_end_point": (1, 1),
+    }
+    # a deletion, the common prefix and suffix do not overlap
+    assert compute_edit(b"aaaa", b"aa") == {
+        "start_byte": 2, "old_end_byte": 4, "new_end_byte": 2,
+        "start_point": (0, 2), "old_end_point": (0, 4), "new_end_point": (0, 2),
+    }
+
+
+def test_edited_tree_reparses_like_a_fresh_parse():
+    old = test_scripts.Python.code_0.encode()
+    for new in (edit.encode() for edit in edits(test_scripts.Python.code_0) if edit != test_scripts.Python.code_0):
+        with get_parser_pool().parser("python") as parser:
+            tree = parser.parse(old)
+            tree.edit(**compute_edit(old, new))
+            incremental = parser.parse(new, tree)
+            fresh = parser.parse(new)
+        assert incremental.root_node.sexp() == fresh.root_node.sexp()
+
+
+def test_splice_fragments_moves_statements():
+    first, second = NXGraph(), NXGraph()
+    first.add_node(STATEMENT_NODE_ID, {"type": {"call"}, "pos": {0}, "start": {0}, "end": {5}})
+    second.add_node(STATEMENT_NODE_ID, {"type": {"assignment"}, "pos": {3}, "start": {40}, "end": {45}})
+    second.add_node(2, {"type": {"identifier"}, "start": {40}, "end": {41}})
+    second.add_edge(STATEMENT_NODE_ID, 2)
+    placed = [(Fragment(first, ({"pd": "pandas"}, {}, ["pandas"]), 0), 0, 0),
+              (Fragment(second, ({}, {"read_csv": "pandas"}, []), 40), 10, 1)]
+    G, (aliases, functions, modules) = splice_fragments(placed)
+    assert sorted(G.nodes()) == [0, 1, 2]
+    assert G.get_node(1)["pos"].fset == {1}
+    assert G.get_node(2)["start"].fset == {10} and G.get_node(2)["end"].fset == {11}
+    assert list(G.edges()) == [(1, 2)]
+    assert (aliases, functions, modules) == ({"pd": "pandas"}, {"read_csv": "pandas"}, ["pandas"])
+    # the fragments are reused by the next update and stay untouched
+    assert second.get_node(2)["start"].fset == {40}
+
+
+@pytest.mark.parametrize("name", SCRIPTS)
+def test_session_matches_full_extraction(name):
+    extractor = GraphExtractor()
+    session = ExtractionSession("python")
+    code = getattr(test_scripts.Python, name)
+    for version in [code] + edits(code):
+        assert canonical(session.update(version)) == canonical(extractor.extract_pipeline(version, "python"))
+    assert session.counters["statements_reused"] > 0
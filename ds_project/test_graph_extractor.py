@@ -0,0 +1,75 @@
+from regraph import NXGraph
+
+import test_scripts
+from graph_extractor import GraphExtractor
+from rule_executioner import flip_tree
+
+
+def reference_bfs_tree_traverser(tree):
+    # traversal as originally implemented, kept to check the linear-time version against
+    root_node = tree.root_node
+    G = NXGraph()
+    node_id, parent_id = 0, 0
+    visited, queue = [], []
+    visited.append(root_node)
+    queue.append(root_node)
+    G.add_node(0, attrs={"type": root_node.type, "text": root_node.text})
+    while queue:
+        node = queue.pop(0)
+        for i, child_node in enumerate(node.children):
+            if child_node not in visited:
+                node_id += 1
+                G.add_node(node_id, attrs={"type": child_node.type, "text": child_node.text, "pos": i,
+                                           "start": child_node.start_byte, "end": child_node.end_byte})
+                G.add_edge(parent_id, node_id)
+                visited.append(child_node)
+                queue.append(child_node)
+        parent_id = parent_id + 1
+    return G
+
+
+def python_scripts():
+    return [(name, code) for name, code in vars(test_scripts.Python).items() if name.startswith("code")]
+
+
+def test_bfs_tree_traverser_matches_reference():
+    extractor = GraphExtractor()
+    for name, code in python_scripts():
+        with extractor.parsers.parser("python") as parser:
+            tree = parser.parse(bytes(code, "utf8"))
+        expected = reference_bfs_tree_traverser(tree)
+        G = extractor.bfs_tree_traverser(tree)
+        assert sorted(G.nodes()) == sorted(expected.nodes()), name
+        assert sorted(G.edges()) == sorted(expected.edges()), name
+        for node_id in expected.nodes():
+            expected_attrs = expected.get_node(node_id)
+            attrs = G.get_node(node_id)
+            for key in ["type", "text", "pos", "start", "end"]:
+                assert attrs.get(key) == expected_attrs.get(key), (name, node_id, key)
+
+
+def test_flipped_traversal_matches_flip_tree():
+    extractor = GraphExtractor()
+    for name, code in python_scripts():
+        with extractor.parsers.parser("python") as parser:
+            tree = parser.parse(bytes(code, "utf8"))
+        expected = extractor.bfs_tree_traverser(tree)
+        flip_tree(expected)
+        G = extractor.bfs_tree_traverser(tree, flipped=True)
+        assert list(G.edges()) == list(expected.edges()), name
+        for node_id in expected.nodes():
+            assert list(G.predecessors(node_id)) == list(expected.predecessors(node_id)), (name, node_id)
+        # already flipped
+        flip_tree(G)
+        assert list(G.edges()) == list(expected.edges()), name
+
+
+def test_flip_tree_deeply_nested_expression():
+    extractor = GraphExtractor()
+    code = "df = pd.read_csv('data.csv')" + ".dropna()" * 2000
+    with extractor.parsers.parser("python") as parser:
+        tree = parser.parse(bytes(code, "utf8"))
+    G = extractor.bfs_tree_traverser(tree)
+    flip_tree(G)
+    assert not list(G.successors(0))
+    assert all(len(list(G.successors(node_id))) == 1 for node_id in G.nodes() if node_id != 0)
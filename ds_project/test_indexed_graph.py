@@ -0,0 +1,131 @@
+from regraph import NXGraph
+
+import test_scripts
+import utils
+from graph_extractor import GraphExtractor
+from rule_executioner import INITIAL_CLEANUP_TYPES, apply_local_transformations, clean_from_list, flip_tree
+from rule_set import CompiledRule
+from syntax_tree import CompactTree
+
+
+def pattern(nodes, edges=()):
+    P = NXGraph()
+    for node_id, attrs in nodes.items():
+        P.add_node(node_id, attrs)
+    for source, target in edges:
+        P.add_edge(source, target)
+    return P
+
+
+# the shapes of patterns the transformations look for
+PATTERNS = [
+    pattern({1: {'type': 'call'}}),
+    pattern({1: {'type': 'argument_list'}}),
+    pattern({1: {'type': 'identifier'}, 2: {'type': 'call'}}, [(1, 2)]),
+    pattern({1: {'type': 'attribute'}, 2: {'type': 'call'}}, [(1, 2)]),
+    pattern({1: {'type': 'identifier'}, 2: {'type': 'assignment'}, 3: {'type': 'identifier'}}, [(1, 2), (3, 2)]),
+    pattern({1: {'type': 'aliased_import'}, 2: {'type': 'dotted_name'}, 3: {'type': 'identifier'}},
+            [(2, 1), (3, 1)]),
+    pattern({1: {}, 2: {'type': 'output_variable'}}, [(1, 2)]),
+    pattern({1: {'type': 'input_variable'}, 2: {}}, [(1, 2)]),
+    pattern({1: {'type': 'identifier'}, 2: {}}, [(1, 2)]),
+    pattern({1: {'type': 'call'}, 2: {'type': 'call'}}, [(1, 2)]),
+    pattern({1: {'type': 'identifier'}, 2: {'type': 'call'}}),
+    pattern({1: {'text': b'np'}}),
+    pattern({1: {'identifier': b'np'}}),
+]
+
+RULES = [
+    {'lhs': {'edges': [{'from': 1, 'to': 2, 'attrs': {}}],
+             'nodes': [{'id': 1, 'attrs': {'type': {'type': 'FiniteSet', 'data': ['call']}}},
+                       {'id': 2, 'attrs': {'type': {'type': 'FiniteSet', 'data': ['call']}}}]},
+     'p': {'edges': [{'from': 1, 'to': 2, 'attrs': {}}],
+           'nodes': [{'id': 1, 'attrs': {'type': {'type': 'FiniteSet', 'data': ['call']}}},
+                     {'id': 2, 'attrs': {'type': {'type': 'FiniteSet', 'data': ['call']}}}]},
+     'rhs': {'edges': [{'from': 1, 'to': 2, 'attrs': {}}],
+             'nodes': [{'id': 1, 'attrs': {'type': {'type': 'FiniteSet', 'data': ['call']}}},
+                       {'id': 2, 'attrs': {'type': {'type': 'FiniteSet', 'data': ['call']},
+                                           'nested': {'type': 'FiniteSet', 'data': ['yes']}}}]},
+     'p_lhs': {1: 1, 2: 2}, 'p_rhs': {1: 1, 2: 2}},
+    {'lhs': {'edges': [], 'nodes': [{'id': 1, 'attrs': {'type': {'type': 'FiniteSet', 'data': ['integer']}}}]},
+     'p': {'edges': [], 'nodes': []}, 'rhs': {'edges': [], 'nodes': []}, 'p_lhs': {}, 'p_rhs': {}},
+]
+
+
+def plain_copy(G):
+    copy = NXGraph()
+    for node_id, attrs in G.nodes(data=True):
+        copy.add_node(node_id, attrs)
+    for source, target, attrs in G.edges(data=True):
+        copy.add_edge(source, target, attrs)
+    return copy
+
+
+def instance_set(instances):
+    return {tuple(sorted(instance.items())) for instance in instances}
+
+
+def assert_same_instances(G, name):
+    expected_graph = plain_copy(G)
+    subgraph = sorted(G.nodes())[::2]
+    for P in PATTERNS:
+        # NXGraph orders the instances by the iteration order of a set of node ids
+        instances = G.find_matching(P)
+        all_expected = expected_graph.find_matching(P)
+        assert len(instances) == len(instance_set(instances)), (name, P.nodes(data=True))
+        assert instance_set(instances) == instance_set(all_expected), (name, P.nodes(data=True))
+        instances = G.find_matching(P, subgraph)
+        expected = expected_graph.find_matching(P, subgraph)
+        assert instance_set(instances) == instance_set(expected), (name, P.nodes(data=True))
+        # anchored matching finds every instance, not only those inside a subgraph
+        anchor = list(P.nodes())[0]
+        instances = G.find_matching_anchored(P, anchor)
+        assert instance_set(instances) == instance_set(all_expected), (name, P.nodes(data=True))
+        instances = G.find_matching_anchored(P, anchor, subgraph)
+        expected = [instance for instance in all_expected if instance[anchor] in subgraph]
+        assert instance_set(instances) == instance_set(expected), (name, P.nodes(data=True))
+
+
+# NXGraph.find_matching takes minutes on the larger scripts
+MAX_NODES = 200
+
+
+def test_indexed_find_matching_matches_nxgraph():
+    extractor = GraphExtractor()
+    rules = [CompiledRule(rule) for rule in RULES]
+    for name, code in vars(test_scripts.Python).items():
+        if not name.startswith("code"):
+            continue
+        source = bytes(code, "utf8")
+        with extractor.parsers.parser("python") as parser:
+            tree = parser.parse(source)
+        G = CompactTree.from_tree(tree, source).to_nxgraph()
+        if len(G.nodes()) > MAX_NODES:
+            continue
+        flip_tree(G)
+        assert_same_instances(G, name)
+        # the index has to follow the removals, attribute updates and rewrites
+        G, _ = apply_local_transformations(G, rules)
+        assert_same_instances(G, name)
+
+
+def test_clean_from_list_matches_per_type_removal():
+    extractor = GraphExtractor()
+    source = bytes(test_scripts.Python.code_5, "utf8")
+    with extractor.parsers.parser("python") as parser:
+        tree = parser.parse(source)
+    G = CompactTree.from_tree(tree, source).to_nxgraph()
+    flip_tree(G)
+    expected = plain_copy(G)
+    for node_type in INITIAL_CLEANUP_TYPES:
+        for instance in expected.find_matching(pattern({1: {'type': node_type}})):
+            expected.remove_node(instance[1])
+    plain = plain_copy(G)
+    clean_from_list(plain, INITIAL_CLEANUP_TYPES)
+    clean_from_list(G, INITIAL_CLEANUP_TYPES)
+    for graph in (plain, G):
+        assert set(graph.nodes()) == set(expected.nodes())
+        assert set(graph.edges()) == set(expected.edges())
+    # the index forgets the removed nodes
+    assert not G.nodes_of_type(INITIAL_CLEANUP_TYPES)
+    assert G.nodes_of_type(["call"]) == set(utils.nodes_of_type(expected, ["call"]))
@@ -0,0 +1,98 @@
+import os
+import sqlite3
+
+from db_driver import init_db
+from kb_snapshot import get_knowledge_base
+
+
+def add_function(connection, module_name, title, description, arguments):
+    cursor = connection.cursor()
+    cursor.execute("INSERT INTO functions(module_name, function_title, description, link) VALUES(?, ?, ?, ?)",
+                   [module_name, title, description, ""])
+    function_id = cursor.lastrowid
+    for position, name in arguments:
+        cursor.execute("INSERT INTO arguments VALUES(?, ?, ?, ?, ?)", [function_id, name, "", position, None])
+    connection.commit()
+
+
+def test_snapshot_lookups(tmp_path):
+    connection = sqlite3.connect(str(tmp_path / "knowledge_base.db"))
+    init_db(connection.cursor())
+    add_function(connection, "pandas", "pandas.read_csv", "reads a csv file",
+                 [(2, "sep"), (1, "filepath_or_buffer"), (3, "delimiter")])
+    add_function(connection, "pandas", "pandas.DataFrame.info", "prints a summary", [])
+
+    knowledge_base = get_knowledge_base(connection.cursor())
+    assert knowledge_base.find_call("pandas.read_csv", 2) == ["filepath_or_buffer", "sep"]
+    assert knowledge_base.find_call("pandas.read_csv", 0) == []
+    assert knowledge_base.find_call("pandas.DataFrame.info", 1) is None
+    assert knowledge_base.find_call("pandas.DataFrame.info", 0) == []
+    assert knowledge_base.find_call("pandas.to_csv", 1) is None
+    assert knowledge_base.descriptions(["pandas.read_csv", "pandas.to_csv"]) == {"pandas.read_csv": "reads a csv file"}
+    # unchanged file, same snapshot
+    assert get_knowledge_base(connection.cursor()) is knowledge_base
+
+
+def test_snapshot_reloads_when_the_file_changes(tmp_path):
+    path = str(tmp_path / "knowledge_base.db")
+    connection = sqlite3.connect(path)
+    init_db(connection.cursor())
+    add_function(connection, "sklearn", "sklearn.svm.SVC", "support vector classifier", [(1, "C")])
+    old = get_knowledge_base(connection.cursor())
+
+    writer = sqlite3.connect(path)
+    add_function(writer, "sklearn", "sklearn.cluster.KMeans", "k-means clustering", [(1, "n_clusters")])
+    writer.close()
+    # the modification time may not have moved within its resolution
+    stat = os.stat(path)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1000000))
+
+    new = get_knowledge_base(connection.cursor())
+    assert new is not old
+    assert new.find_call("sklearn.cluster.KMeans", 1) == ["n_clusters"]
+    # the old snapshot is left as it was
+    assert old.get("sklearn.cluster.KMeans") is None
+
+
+def test_suffix_resolution(tmp_path):
+    connection = sqlite3.connect(str(tmp_path / "knowledge_base.db"))
+    init_db(connection.cursor())
+    add_function(connection, "sklearn", "sklearn.preprocessing.StandardScaler.fit_transform", "", [])
+    add_function(connection, "sklearn", "sklearn.decomposition.PCA.fit_transform", "", [])
+    add_function(connection, "sklearn", "sklearn.base.Model.fit", "", [])
+    add_function(connection, "keras", "keras.engine.Model.fit", "", [])
+    add_function(connection, "pandas", "pandas.read_csv", "", [])
+
+    knowledge_base = get_knowledge_base(connection.cursor())
+    assert knowledge_base.resolve("pandas.read_csv") == "pandas.read_csv"
+    assert knowledge_base.resolve("pandas.io.read_csv", {"pandas"}) == "pandas.read_csv"
+    assert knowledge_base.candidates("sc_X.fit_transform") == \
+        (1, ["sklearn.decomposition.PCA.fit_transform", "sklearn.preprocessing.StandardScaler.fit_transform"])
+    # two candidates rank the same, the name stays ambiguous
+    assert knowledge_base.resolve("sc_X.fit_transform", {"sklearn"}) is None
+    assert knowledge_base.resolve("StandardScaler.fit_transform") == \
+        "sklearn.preprocessing.StandardScaler.fit_transform"
+    # the imported module breaks the tie
+    assert knowledge_base.resolve("Model.fit") is None
+    assert knowledge_base.resolve("Model.fit", {"keras"}) == "keras.engine.Model.fit"
+    assert knowledge_base.resolve("model.predict") is None
+
+
+def test_single_segment_suffixes_are_not_resolved(tmp_path):
+    connection = sqlite3.connect(str(tmp_path / "knowledge_base.db"))
+    init_db(connection.cursor())
+    add_function(connection, "pandas", "pandas.Series.str.len", "", [])
+    add_function(connection, "pandas", "pandas.Series.str.split", "", [(1, "pat")])
+    add_function(connection, "keras", "keras.models.Sequential.fit", "", [])
+    add_function(connection, "pandas", "pandas.io.parsers.read_csv", "", [(1, "filepath_or_buffer")])
+
+    knowledge_base = get_knowledge_base(connection.cursor())
+    # unique candidates, but only the method name matches
+    assert knowledge_base.candidates("len", {"pandas"}) == (1, ["pandas.Series.str.len"])
+    assert knowledge_base.resolve("len", {"pandas"}) is None
+    assert knowledge_base.resolve("line.split", {"pandas"}) is None
+    assert knowledge_base.resolve("model.fit", {"keras"}) is None
+    # a call on the module itself names a function of the module, not a method of one of its classes
+    assert knowledge_base.resolve("pandas.split", {"pandas"}) is None
+    assert knowledge_base.resolve("pandas.read_csv", {"pandas"}) == "pandas.io.parsers.read_csv"
+    assert knowledge_base.resolve("numpy.split", {"pandas", "numpy"}) is None
@@ -0,0 +1,133 @@
+import asyncio
+import io
+import json
+import tarfile
+
+import pytest
+from fastapi import HTTPException, UploadFile
+from fastapi.testclient import TestClient
+
+import main
+from extraction_pool import ExtractionTimeoutError, PoolSaturatedError
+from test_batch import truncated_tarball
+
+client = TestClient(main.app)
+
+
+def upload(code: bytes, language="python", **kwargs):
+    return client.post("/upload", files={"file": ("script.py", code)}, data={"language": language}, **kwargs)
+
+
+def failing_extract(error):
+    async def extract(code, language):
+        raise error
+    return extract
+
+
+def test_pool_errors_map_to_http_errors(monkeypatch):
+    monkeypatch.setattr(main.extraction_pool, "extract", failing_extract(PoolSaturatedError("full")))
+    response = upload(b"saturated = 1\n")
+    assert response.status_code == 503
+    assert response.headers["retry-after"] == main.RETRY_AFTER
+
+    monkeypatch.setattr(main.extraction_pool, "extract", failing_extract(ExtractionTimeoutError("slow")))
+    response = upload(b"timed_out = 1\n")
+    assert response.status_code == 504
+
+
+def test_unsupported_language_is_rejected():
+    response = upload(b"x = 1\n", language="../secrets")
+    assert response.status_code == 400
+
+
+def test_session_updates_use_the_pool(monkeypatch):
+    updates = []
+
+    async def update_session(session_id, code, language, rules_version, kb_version):
+        updates.append((session_id, code))
+        return {"nodes": [], "edges": []}
+    monkeypatch.setattr(main.extraction_pool, "update_session", update_session)
+    response = client.post("/update", data={"code": "x = 1\n", "language": "python", "session_id": "editor"})
+    assert response.status_code == 200
+    assert updates == [("editor", "x = 1\n")]
+
+    async def saturated(*args):
+        raise PoolSaturatedError("full")
+    monkeypatch.setattr(main.extraction_pool, "update_session", saturated)
+    response = client.post("/update", data={"code": "x = 2\n", "language": "python", "session_id": "editor"})
+    assert response.status_code == 503
+
+
+def test_oversized_uploads_are_rejected(monkeypatch):
+    async def extract(code, language):
+        return {"nodes": [], "edges": []}
+    monkeypatch.setattr(main.extraction_pool, "extract", extract)
+    monkeypatch.setattr(main, "UPLOAD_LIMIT", 100)
+    # declared by the request, rejected before the body is read
+    response = upload(b"x" * (100 + main.UPLOAD_FORM_OVERHEAD + 1))
+    assert response.status_code == 413
+    # within the form overhead, rejected by the size of the file part
+    response = upload(b"x" * 101)
+    assert response.status_code == 413
+    assert upload(b"x" * 100).status_code == 200
+
+
+def test_uploads_of_unknown_size_are_read_up_to_the_limit(monkeypatch):
+    monkeypatch.setattr(main, "UPLOAD_LIMIT", 100)
+    monkeypatch.setattr(main, "UPLOAD_CHUNK_SIZE", 16)
+    assert asyncio.run(main.read_upload(UploadFile(io.BytesIO(b"x" * 100)))) == b"x" * 100
+    with pytest.raises(HTTPException) as error:
+        asyncio.run(main.read_upload(UploadFile(io.BytesIO(b"x" * 101))))
+    assert error.value.status_code == 413
+
+
+def test_malformed_content_length_is_rejected():
+    response = client.post("/upload", content=b"x = 1\n", headers={"content-length": "abc"})
+    assert response.status_code == 400
+    assert response.json()["detail"] == "Invalid Content-Length"
+
+
+def test_batch_streams_one_record_per_script(monkeypatch):
+    async def extract(code, language):
+        return {"nodes": [code.decode()], "edges": []}
+    monkeypatch.setattr(main.extraction_pool, "extract", extract)
+    archive = io.BytesIO()
+    with tarfile.open(fileobj=archive, mode="w") as tar:
+        for name, source in (("a.py", b"a = 1"), ("README", b"skipped"), ("b.py", b"b = 2")):
+            info = tarfile.TarInfo(name)
+            info.size = len(source)
+            tar.addfile(info, io.BytesIO(source))
+    response = client.post("/batch", files={"file": ("batch.tar", archive.getvalue())})
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/x-ndjson"
+    records = [json.loads(line) for line in response.text.splitlines()]
+    assert sorted((record["file"], record["status"], record["graph"]["nodes"]) for record in records) == \
+        [("a.py", "ok", ["a = 1"]), ("b.py", "ok", ["b = 2"])]
+
+
+def test_truncated_batch_keeps_the_records_read_before(monkeypatch):
+    async def extract(code, language):
+        return {"nodes": [], "edges": []}
+    monkeypatch.setattr(main.extraction_pool, "extract", extract)
+    response = client.post("/batch", files={"file": ("batch.tar.gz", truncated_tarball())})
+    assert response.status_code == 200
+    records = [json.loads(line) for line in response.text.splitlines()]
+    errors = [record for record in records if record["status"] == "error"]
+    assert len(errors) == 1 and len(records) > 5
+
+
+def test_batch_must_be_a_tarball():
+    response = client.post("/batch", files={"file": ("batch.tar", b"not a tarball")})
+    assert response.status_code == 400
+
+
+def test_metrics_collect_the_worker_counters(monkeypatch):
+    async def worker_stats():
+        rules = [{"rule": 0, "applied": 1, "skipped": 0, "instances": 2, "rewrites": 1, "seconds": 0.5}]
+        return [{"sessions": {"sessions": 1, "updates": 3}, "rules": {"version": 1, "rules": rules}},
+                {"sessions": {"sessions": 2, "updates": 1}, "rules": {"version": 1, "rules": rules}}]
+    monkeypatch.setattr(main.extraction_pool, "worker_stats", worker_stats)
+    metrics = client.get("/metrics").json()
+    assert metrics["sessions"] == {"sessions": 3, "updates": 4}
+    assert metrics["rules"]["totals"]["applied"] == 2
+    assert metrics["rules"]["most_expensive"][0]["seconds"] == 1.0
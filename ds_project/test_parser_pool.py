@@ -0,0 +1,64 @@
+import os
+
+import parser_pool
+from parser_pool import ParserPool, get_parser_pool
+
+
+def fake_grammar(tmp_path, source):
+    src = tmp_path / "tree-sitter-fake" / "src"
+    src.mkdir(parents=True, exist_ok=True)
+    (src / "parser.c").write_text(source)
+    return str(tmp_path / "tree-sitter-fake")
+
+
+def test_build_is_skipped_for_unchanged_grammars(tmp_path, monkeypatch):
+    builds = []
+
+    def build_library(library_path, grammar_paths):
+        builds.append(library_path)
+        with open(library_path, "w") as f:
+            f.write("library {}".format(len(builds)))
+    monkeypatch.setattr(parser_pool.Language, "build_library", staticmethod(build_library))
+    library_path = str(tmp_path / "languages.so")
+    grammar = fake_grammar(tmp_path, "int a;")
+
+    pool = ParserPool(library_path, [grammar])
+    assert pool.build()
+    assert not pool.build()
+    assert pool.counters["builds"] == 1 and pool.counters["build_skips"] == 1
+    # a new process finds the stamp of the same sources
+    assert not ParserPool(library_path, [grammar]).build()
+    assert len(builds) == 1
+
+    fake_grammar(tmp_path, "int b;")
+    assert ParserPool(library_path, [grammar]).build()
+    assert len(builds) == 2
+    # the first pool still has the old library loaded
+    assert pool.stale()
+    assert pool.stats()["library_stale"]
+
+
+def test_parsers_are_returned_to_the_pool():
+    pool = get_parser_pool()
+    pool.build()
+    before = dict(pool.counters)
+    with pool.parser("python") as first:
+        with pool.parser("python") as second:
+            assert first is not second
+    with pool.parser("python") as again:
+        assert again in (first, second)
+        assert again.parse(b"x = 1").root_node.type == "module"
+    assert pool.counters["pool_hits"] - before["pool_hits"] >= 1
+    assert pool.stats()["free_parsers"]["python"] >= 2
+    assert not pool.stats()["library_stale"]
+
+
+def test_parser_is_returned_when_parsing_fails():
+    pool = ParserPool(os.path.join("build", "my-languages.so"))
+    pool.build()
+    try:
+        with pool.parser("python"):
+            raise RuntimeError("parse failed")
+    except RuntimeError:
+        pass
+    assert pool.stats()["free_parsers"] == {"python": 1}
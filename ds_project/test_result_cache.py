@@ -0,0 +1,68 @@
+import os
+
+import pytest
+
+from result_cache import ResultCache
+
+
+def result(size):
+    return {"nodes": ["n" * size], "edges": []}
+
+
+def keys(count, version=1):
+    return [ResultCache.make_key("python", "x = {}".format(i), version, 1) for i in range(count)]
+
+
+def test_hits_and_least_recently_used_eviction():
+    cache = ResultCache(max_bytes=300)
+    first, second, third = keys(3)
+    assert cache.get(first) is None
+    cache.put(first, result(100))
+    cache.put(second, result(100))
+    assert cache.get(first) == result(100)
+    # the second result is the least recently used one
+    cache.put(third, result(100))
+    assert cache.get(second) is None
+    assert cache.get(first) == result(100)
+    assert cache.get(third) == result(100)
+    stats = cache.stats()
+    assert (stats["hits"], stats["misses"], stats["evictions"]) == (3, 2, 1)
+    assert stats["bytes"] <= 300
+
+
+def test_files_are_bounded_and_reloaded(tmp_path):
+    directory = str(tmp_path / "cache")
+    cache = ResultCache(max_bytes=10000, directory=directory, max_disk_bytes=300)
+    first, second, third = keys(3)
+    cache.put(first, result(100))
+    cache.put(second, result(100))
+    cache.put(third, result(100))
+    assert cache.stats()["disk_evictions"] == 1
+    assert sorted(os.listdir(directory)) == sorted([second + ".json", third + ".json"])
+    assert cache.disk_bytes <= 300
+
+    restarted = ResultCache(max_bytes=10000, directory=directory, max_disk_bytes=300)
+    assert restarted.get(first) is None
+    assert restarted.get(second) == result(100)
+    assert restarted.stats()["disk_bytes"] == cache.disk_bytes
+    # a smaller bound evicts the files left by the last run
+    smaller = ResultCache(max_bytes=10000, directory=directory, max_disk_bytes=150)
+    assert smaller.stats()["files"] == 1
+
+
+def test_results_of_other_versions_are_invalidated(tmp_path):
+    directory = str(tmp_path / "cache")
+    cache = ResultCache(max_bytes=10000, directory=directory)
+    cache.check_versions(1, 1)
+    (old,) = keys(1, version=1)
+    cache.put(old, result(10))
+    cache.check_versions(2, 1)
+    assert cache.get(old) is None
+    assert os.listdir(directory) == []
+    assert cache.stats()["invalidations"] == 1
+    assert cache.stats()["disk_bytes"] == 0
+
+
+def test_unsupported_languages_are_not_used_in_keys():
+    with pytest.raises(ValueError):
+        ResultCache.make_key("../../etc/passwd", "x = 1", 1, 1)
@@ -0,0 +1,105 @@
+import sqlite3
+
+import pytest
+
+from db_driver import init_db
+from indexed_graph import IndexedGraph
+from rule_executioner import add_attributes_from_knowledge_base, adjust_attributes, append_identifier_to_call, \
+    establish_dependencies
+
+
+def add(G, node_id, node_type, text, start, end):
+    G.add_node(node_id, {"type": node_type, "text": text, "start": start, "end": end})
+
+
+def test_inputs_read_the_last_preceding_output():
+    # x = a        (0-5)
+    # f(x)         (6-10)
+    # x = b        (11-16)
+    # x = g(x)     (17-25), its input still reads the second assignment
+    # h(x)         (26-30)
+    G = IndexedGraph()
+    for assignment, output, start, end in [(1, 2, 0, 5), (3, 4, 11, 16), (5, 6, 17, 25)]:
+        add(G, assignment, "variable_assignment", b"x", start, end)
+        add(G, output, "output_variable", b"x", start, start + 1)
+        G.add_edge(assignment, output)
+    for call, node_input, start in [(10, 11, 8), (12, 13, 23), (14, 15, 28)]:
+        add(G, call, "call", b"f", start - 2, start + 2)
+        add(G, node_input, "input_variable", b"x", start, start + 1)
+        G.add_edge(node_input, call)
+    establish_dependencies(G)
+
+    assert set(G.successors(2)) == {10}
+    assert set(G.successors(4)) == {12}
+    assert set(G.successors(6)) == {14}
+    for node_input in (11, 13, 15):
+        assert node_input not in G.nodes()
+    for output in (2, 4, 6):
+        assert G.get_node(output)["type"] == {"passable_data"}
+
+
+def test_inputs_before_any_output_are_kept():
+    G = IndexedGraph()
+    add(G, 1, "call", b"f", 0, 4)
+    add(G, 2, "input_variable", b"x", 2, 3)
+    G.add_edge(2, 1)
+    add(G, 3, "variable_assignment", b"x", 5, 10)
+    add(G, 4, "output_variable", b"x", 5, 6)
+    G.add_edge(3, 4)
+    establish_dependencies(G)
+
+    assert 2 in G.nodes()
+    assert G.get_node(1)["input_variable"] == {b"x"}
+    assert not list(G.successors(4))
+    assert G.get_node(4)["type"] == {"output_variable"}
+
+
+@pytest.mark.parametrize("function_type, adjust", [("identifier", append_identifier_to_call),
+                                                   ("attribute", adjust_attributes)])
+def test_outputs_of_a_call_are_not_read_by_its_inputs(function_type, adjust):
+    # x = a        (0-5)
+    # x = f(x)     (6-14), the output of the call is written after its input reads x
+    G = IndexedGraph()
+    add(G, 1, "variable_assignment", b"x", 0, 5)
+    add(G, 2, "output_variable", b"x", 0, 1)
+    G.add_edge(1, 2)
+    add(G, 3, "call", b"f(x)", 10, 14)
+    add(G, 4, "output_variable", b"x", 6, 7)
+    G.add_edge(3, 4)
+    add(G, 5, function_type, b"f", 10, 11)
+    G.add_edge(5, 3)
+    add(G, 6, "input_variable", b"x", 12, 13)
+    G.add_edge(6, 3)
+    adjust(G)
+    assert G.get_node(3)["start"] == {10} and G.get_node(3)["end"] == {14}
+    establish_dependencies(G)
+
+    assert set(G.successors(2)) == {3}
+    assert 3 not in set(G.successors(4))
+
+
+def test_knowledge_base_enrichment():
+    connection = sqlite3.connect(":memory:")
+    cursor = connection.cursor()
+    init_db(cursor)
+    for module_name, title, description in [("numpy", "numpy.array", "creates an array"),
+                                            ("pandas", "pandas.read_csv", "reads a csv file")]:
+        cursor.execute("INSERT INTO functions(module_name, function_title, description, link) VALUES(?, ?, ?, ?)",
+                       [module_name, title, description, ""])
+    G = IndexedGraph()
+    G.add_node(1, {"type": "call", "text": b"np.array", "identifier": b"np"})
+    G.add_node(2, {"type": "call", "text": b"read_csv"})
+    G.add_node(3, {"type": "call", "text": b"sklearn.svm.SVC", "identifier": b"sklearn"})
+    G.add_node(4, {"type": "call", "text": b"print"})
+    add_attributes_from_knowledge_base(G, {b"np": b"numpy"}, {b"read_csv": "pandas.read_csv"}, [{b"sklearn"}],
+                                       cursor)
+
+    assert "identifier" not in G.get_node(1)
+    assert G.get_node(1)["module"] == {"numpy"}
+    assert G.get_node(1)["full_function_call"] == {"numpy.array"}
+    assert G.get_node(1)["description"] == {"creates an array"}
+    assert G.get_node(2)["module"] == {"pandas"}
+    assert G.get_node(2)["description"] == {"reads a csv file"}
+    assert G.get_node(3)["full_function_call"] == {"sklearn.svm.SVC"}
+    assert "description" not in G.get_node(3)
+    assert "module" not in G.get_node(4)
@@ -0,0 +1,157 @@
+from indexed_graph import IndexedGraph
+from rule_executioner import apply_rule, apply_rules, apply_rules_fixed_point, affected_rules, \
+    convert_graph_to_json
+from rule_set import CompiledRule, RuleSet, merge_rule_stats
+
+
+def finite_set(*values):
+    return {'type': 'FiniteSet', 'data': list(values)}
+
+
+# identifier under a subscript becomes an input_variable
+INPUT_RULE = {
+    'lhs': {'edges': [{'from': 1, 'to': 2, 'attrs': {}}],
+            'nodes': [{'id': 1, 'attrs': {'type': finite_set('identifier')}},
+                      {'id': 2, 'attrs': {'type': finite_set('subscript')}}]},
+    'p': {'edges': [{'from': 1, 'to': 2, 'attrs': {}}],
+          'nodes': [{'id': 1, 'attrs': {}}, {'id': 2, 'attrs': {'type': finite_set('subscript')}}]},
+    'rhs': {'edges': [{'from': 1, 'to': 2, 'attrs': {}}],
+            'nodes': [{'id': 1, 'attrs': {'type': finite_set('input_variable')}},
+                      {'id': 2, 'attrs': {'type': finite_set('subscript')}}]},
+    'p_lhs': {1: 1, 2: 2}, 'p_rhs': {1: 1, 2: 2},
+}
+
+# input_variable nodes are removed
+REMOVE_INPUT_RULE = {
+    'lhs': {'edges': [], 'nodes': [{'id': 1, 'attrs': {'type': finite_set('input_variable')}}]},
+    'p': {'edges': [], 'nodes': []}, 'rhs': {'edges': [], 'nodes': []}, 'p_lhs': {}, 'p_rhs': {},
+}
+
+
+def rule_stats_report(rules):
+    return {"version": rules.version, "rules": rules.stats.stats(), "limits": rules.stats.limit_stats()}
+
+
+def graph(*types):
+    G = IndexedGraph()
+    for node_id, node_type in enumerate(types):
+        G.add_node(node_id, {'type': node_type})
+    for node_id in range(len(types) - 1):
+        G.add_edge(node_id, node_id + 1)
+    return G
+
+
+def test_compiled_rule_types():
+    rule = CompiledRule(INPUT_RULE)
+    assert rule.required_types == {'identifier', 'subscript'}
+    assert rule.produced_types == {'input_variable'}
+    rule = CompiledRule(REMOVE_INPUT_RULE)
+    assert rule.required_types == {'input_variable'}
+    assert rule.produced_types == set()
+
+
+def test_apply_rules_skips_rules_without_anchors():
+    rules = RuleSet([CompiledRule(REMOVE_INPUT_RULE), CompiledRule(INPUT_RULE), CompiledRule(REMOVE_INPUT_RULE)], 1)
+    G = graph('identifier', 'subscript', 'call')
+    expected = graph('identifier', 'subscript', 'call')
+    for rule in rules:
+        apply_rule(expected, rule)
+    apply_rules(G, rules)
+    assert set(G.nodes()) == set(expected.nodes()) == {1, 2}
+    stats = rules.stats.stats()
+    # the first removal has nothing to match, the second runs after input_variable was produced
+    assert [(s['applied'], s['skipped']) for s in stats] == [(0, 1), (1, 0), (1, 0)]
+    assert [s['instances'] for s in stats] == [0, 1, 1]
+
+
+def test_fixed_point_applies_rules_enabled_by_later_rules():
+    rules = RuleSet([CompiledRule(REMOVE_INPUT_RULE), CompiledRule(INPUT_RULE)], 1)
+    single_pass = graph('identifier', 'subscript', 'identifier', 'subscript')
+    apply_rules(single_pass, rules)
+    # the removal comes before the rule producing input_variable nodes
+    assert len(single_pass.nodes_of_type({'input_variable'})) == 2
+
+    rules = RuleSet([CompiledRule(REMOVE_INPUT_RULE), CompiledRule(INPUT_RULE)], 1)
+    G = graph('identifier', 'subscript', 'identifier', 'subscript')
+    apply_rules_fixed_point(G, rules)
+    assert set(G.nodes()) == {1, 3}
+    stats = rules.stats.stats()
+    assert [s['rewrites'] for s in stats] == [2, 2]
+
+
+def test_fixed_point_stops_at_caps():
+    # the call -> call rule still matches after its rewrite, every instance is rewritten once
+    nested = {
+        'lhs': {'edges': [{'from': 1, 'to': 2, 'attrs': {}}],
+                'nodes': [{'id': 1, 'attrs': {'type': finite_set('call')}},
+                          {'id': 2, 'attrs': {'type': finite_set('call')}}]},
+        'p': {'edges': [{'from': 1, 'to': 2, 'attrs': {}}],
+              'nodes': [{'id': 1, 'attrs': {'type': finite_set('call')}},
+                        {'id': 2, 'attrs': {'type': finite_set('call')}}]},
+        'rhs': {'edges': [{'from': 1, 'to': 2, 'attrs': {}}],
+                'nodes': [{'id': 1, 'attrs': {'type': finite_set('call')}},
+                          {'id': 2, 'attrs': {'type': finite_set('call'), 'nested': finite_set('yes')}}]},
+        'p_lhs': {1: 1, 2: 2}, 'p_rhs': {1: 1, 2: 2},
+    }
+    rules = RuleSet([CompiledRule(nested)], 1)
+    G = graph('call', 'call', 'call', 'call')
+    apply_rules_fixed_point(G, rules)
+    assert rules.stats.stats()[0]['rewrites'] == 3
+
+    assert rules.stats.limit_stats() == {'max_rewrites': 0, 'max_iterations': 0}
+    assert 'rule_limit' not in convert_graph_to_json(G)
+
+    rules = RuleSet([CompiledRule(nested)], 1)
+    G = graph('call', 'call', 'call', 'call')
+    apply_rules_fixed_point(G, rules, max_rewrites=2)
+    assert rules.stats.stats()[0]['rewrites'] == 2
+    # the result and the stats tell the engine did not finish
+    assert rules.stats.limit_stats() == {'max_rewrites': 1, 'max_iterations': 0}
+    assert convert_graph_to_json(G)['rule_limit'] == 'max_rewrites'
+    assert merge_rule_stats([rule_stats_report(rules)])['limits']['max_rewrites'] == 1
+
+
+def test_fixed_point_requeues_rules_of_the_touched_types():
+    # only matches call nodes, the rewrites of INPUT_RULE touch identifier and subscript nodes
+    call_rule = {
+        'lhs': {'edges': [], 'nodes': [{'id': 1, 'attrs': {'type': finite_set('call')}}]},
+        'p': {'edges': [], 'nodes': [{'id': 1, 'attrs': {'type': finite_set('call')}}]},
+        'rhs': {'edges': [], 'nodes': [{'id': 1, 'attrs': {'type': finite_set('call')}}]},
+        'p_lhs': {1: 1}, 'p_rhs': {1: 1},
+    }
+    rules = RuleSet([CompiledRule(call_rule), CompiledRule(INPUT_RULE)], 1)
+    G = graph('identifier', 'subscript')
+    G.add_node(2, {'type': 'call'})
+    apply_rules_fixed_point(G, rules)
+    # the call rule is matched again around its own rewrite only, not around the input_variable
+    stats = rules.stats.stats()
+    assert [s['applied'] for s in stats] == [2, 1]
+    # the rewrite of INPUT_RULE requeues it, there is no identifier left to match
+    assert stats[1]['skipped'] == 1
+
+    # a pattern node of any type can match whatever was touched
+    any_pattern = {'edges': [{'from': 1, 'to': 2, 'attrs': {}}],
+                   'nodes': [{'id': 1, 'attrs': {}}, {'id': 2, 'attrs': {'type': finite_set('call')}}]}
+    any_rule = {'lhs': any_pattern, 'p': any_pattern, 'rhs': any_pattern, 'p_lhs': {1: 1, 2: 2}, 'p_rhs': {1: 1, 2: 2}}
+    assert CompiledRule(any_rule).any_type and not CompiledRule(call_rule).any_type
+    touched = graph('identifier')
+    assert affected_rules(touched, {0}, {'call': [0], 'identifier': [2]}, [1], 3) == [1, 2]
+
+
+def test_rule_stats_of_several_processes_are_merged():
+    first = RuleSet([CompiledRule(REMOVE_INPUT_RULE), CompiledRule(INPUT_RULE)], 2)
+    first.stats.record(0, instances=2, rewrites=2, seconds=0.5)
+    first.stats.record(1, skipped=True)
+    second = RuleSet([CompiledRule(REMOVE_INPUT_RULE), CompiledRule(INPUT_RULE)], 2)
+    second.stats.record(0, instances=1, rewrites=1, seconds=0.25)
+    second.stats.record(1, instances=1, seconds=1.0)
+    outdated = RuleSet([CompiledRule(INPUT_RULE)], 1)
+    outdated.stats.record(0, instances=5, seconds=9.0)
+    reports = [{"version": rules.version, "rules": rules.stats.stats()} for rules in (first, second, outdated)]
+
+    merged = merge_rule_stats(reports + [{}], count=1)
+    assert merged["version"] == 2 and merged["rules"] == 2
+    assert merged["totals"] == {"applied": 3, "skipped": 1, "instances": 4, "rewrites": 3, "seconds": 1.75}
+    assert merged["most_expensive"] == [{"rule": 1, "applied": 1, "skipped": 1, "instances": 1, "rewrites": 0,
+                                         "seconds": 1.0}]
+    assert merge_rule_stats([{}]) == {}
@@ -0,0 +1,70 @@
+import sqlite3
+
+import pytest
+
+from db_driver import init_db
+from graph_extractor import GraphExtractor
+from static_analysis import extract_files, extract_imports, insert_trackers
+from syntax_tree import CompactTree
+
+SCRIPT = b"""print("start")
+for epoch in range(10):
+    print(epoch)
+    while True:
+        print("inner")
+"""
+
+
+def test_trackers_in_loops_are_sampled():
+    with GraphExtractor().parsers.parser("python") as parser:
+        tree = CompactTree.from_tree(parser.parse(SCRIPT), SCRIPT)
+    kb_con = sqlite3.connect(":memory:")
+    init_db(kb_con.cursor())
+    isomorphism = {node: node for node in range(len(tree))}
+    modified = insert_trackers(tree, SCRIPT, extract_imports(tree), kb_con, isomorphism, 4, extract_files(tree),
+                               loop_sampling="every:5")
+
+    assert modified.splitlines() == [
+        b'print(trackers.stdout_tracker("start", 4))',
+        b'for epoch in range(10):',
+        b'    print(trackers.stdout_tracker(epoch, 4, sample="every:5", site=43))',
+        b'    while True:',
+        b'        print(trackers.stdout_tracker("inner", 4, sample="every:5", site=80))',
+    ]
+
+
+def test_unknown_loop_sampling_is_rejected():
+    with GraphExtractor().parsers.parser("python") as parser:
+        tree = CompactTree.from_tree(parser.parse(SCRIPT), SCRIPT)
+    kb_con = sqlite3.connect(":memory:")
+    init_db(kb_con.cursor())
+    isomorphism = {node: node for node in range(len(tree))}
+    for loop_sampling in ("sometimes", "first", "every:x", "every:0", "first:-1", "reservoir:0",
+                          'all"); import os; ("'):
+        with pytest.raises(ValueError):
+            insert_trackers(tree, SCRIPT, extract_imports(tree), kb_con, isomorphism, 4, extract_files(tree),
+                            loop_sampling=loop_sampling)
+
+
+def test_calls_matching_only_a_method_name_are_not_tracked():
+    script = b"""import pandas as pd
+df = pd.read_csv("a.csv", sep=";")
+n = len(df)
+parts = line.split(",")
+"""
+    with GraphExtractor().parsers.parser("python") as parser:
+        tree = CompactTree.from_tree(parser.parse(script), script)
+    kb_con = sqlite3.connect(":memory:")
+    init_db(kb_con.cursor())
+    for title, argument in (("pandas.read_csv", "filepath_or_buffer"), ("pandas.Series.str.len", None),
+                            ("pandas.Series.str.split", "pat")):
+        cursor = kb_con.execute("INSERT INTO functions(module_name, function_title, description, link) "
+                                "VALUES('pandas', ?, '', '')", [title])
+        if argument is not None:
+            kb_con.execute("INSERT INTO arguments VALUES(?, ?, '', 1, NULL)", [cursor.lastrowid, argument])
+    isomorphism = {node: node for node in range(len(tree))}
+    modified = insert_trackers(tree, script, extract_imports(tree), kb_con, isomorphism, 4, extract_files(tree))
+
+    lines = modified.splitlines()
+    assert b'trackers.hyperparam_tracker("pandas.read_csv", "filepath_or_buffer"' in lines[1]
+    assert lines[2:] == [b"n = len(df)", b'parts = line.split(",")']
@@ -0,0 +1,54 @@
+import copy
+import pickle
+
+from regraph.attribute_sets import FiniteSet
+
+from graph_extractor import GraphExtractor
+from syntax_tree import INLINE_TEXT_LIMIT, CompactTree, SourceText
+
+SOURCE = b"import pandas as pd\ndf = pd.read_csv('a.csv')\nprint(df)\n"
+
+
+def test_source_text_behaves_like_its_bytes():
+    buffer = memoryview(SOURCE)
+    text = SourceText(buffer, 20, 45)
+    expected = SOURCE[20:45]
+    assert text == expected and expected == text
+    assert text == SourceText(memoryview(bytes(SOURCE)), 20, 45)
+    assert text != SOURCE[20:44]
+    assert hash(text) == hash(expected)
+    assert len(text) == len(expected)
+    assert bytes(text) == expected
+    assert text.decode() == expected.decode()
+    assert str(text) == str(expected)
+    # usable as a key in place of the bytes and the other way round
+    assert {expected: 1}[text] == 1
+    assert {text: 1}[expected] == 1
+    assert text in {expected}
+    assert FiniteSet({text}).issubset(FiniteSet({expected}))
+    assert FiniteSet({expected}).issubset(FiniteSet({text}))
+
+
+def test_source_text_copies_and_pickles():
+    text = SourceText(memoryview(SOURCE), 20, 45)
+    assert copy.copy(text) is text
+    assert copy.deepcopy({"text": text})["text"] is text
+    restored = pickle.loads(pickle.dumps(text))
+    assert type(restored) is bytes
+    assert restored == text
+
+
+def test_short_texts_are_shared_and_long_texts_referenced():
+    source = b"x = 1\ny = x + x\nz = " + b"+".join(b"x" for _ in range(INLINE_TEXT_LIMIT)) + b"\n"
+    with GraphExtractor().parsers.parser("python") as parser:
+        tree = CompactTree.from_tree(parser.parse(source), source)
+    G = tree.to_nxgraph()
+    x_texts = [value for node in G.nodes() for value in G.get_node(node)["text"].fset if value == b"x"]
+    assert len(x_texts) > 3
+    assert all(value is x_texts[0] for value in x_texts)
+    long_texts = [(node, value) for node in G.nodes() for value in G.get_node(node)["text"].fset
+                  if isinstance(value, SourceText)]
+    assert long_texts
+    for node, value in long_texts:
+        assert len(value) > INLINE_TEXT_LIMIT
+        assert value == tree.text(node)
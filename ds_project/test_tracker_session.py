@@ -0,0 +1,330 @@
+import gc
+import multiprocessing
+import sqlite3
+import time
+import weakref
+
+import pytest
+
+import trackers
+from db_tracker import setup_db
+from trackers import AsyncTrackerSession, TrackerSession
+
+
+def rows(query):
+    with sqlite3.connect("trackers.db") as con:
+        return con.execute(query).fetchall()
+
+
+def test_rows_are_written_in_batches(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    setup_db()
+    session = TrackerSession("trackers.db", batch_size=3, flush_interval=60)
+    monkeypatch.setattr(trackers, "_session", session)
+
+    for epoch in range(4):
+        trackers.stdout_tracker("epoch {}".format(epoch), run_id=7)
+    # the first three rows were flushed together, the last one is pending
+    assert session.counters["flushes"] == 1
+    assert len(rows("SELECT * FROM Outputs WHERE run_id = 7")) == 3
+    trackers.flush()
+    assert len(rows("SELECT * FROM Outputs WHERE run_id = 7")) == 4
+    session.close()
+
+
+def test_hyperparameter_times_count_pending_rows(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    setup_db()
+    session = TrackerSession("trackers.db", batch_size=100, flush_interval=60)
+    monkeypatch.setattr(trackers, "_session", session)
+
+    for value in (0.1, 0.2):
+        trackers.hyperparam_tracker("SVC", "C", value, run_id=1, expr_id=5)
+    session.flush()
+    trackers.hyperparam_tracker("SVC", "C", 0.3, run_id=1, expr_id=5)
+    session.close()
+    assert rows("SELECT value, times FROM Hyperparameters ORDER BY times") == [("0.1", 0), ("0.2", 1), ("0.3", 2)]
+
+
+def test_failing_rows_do_not_drop_the_batch(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    setup_db()
+    session = TrackerSession("trackers.db", batch_size=100, flush_interval=60)
+    session.record("Outputs", (1, "stdout", 0, "a"))
+    session.record("Outputs", (1, "stdout", 0, "duplicate"))
+    session.record("Outputs", (1, "stdout", 1, "b"))
+    session.close()
+    assert rows("SELECT value FROM Outputs ORDER BY line_number") == [("a",), ("b",)]
+    assert session.counters["failed_rows"] == 1
+
+
+def write_outputs(run_id, count):
+    for line in range(count):
+        trackers.stdout_tracker("line {}".format(line), run_id=run_id)
+
+
+def test_rows_are_kept_while_the_database_is_locked(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    setup_db()
+    monkeypatch.setattr(trackers, "TRACKER_BUSY_TIMEOUT", 0.05)
+    session = TrackerSession("trackers.db", batch_size=2, flush_interval=60)
+    monkeypatch.setattr(trackers, "_session", session)
+    locker = sqlite3.connect("trackers.db")
+    locker.execute("BEGIN EXCLUSIVE")
+    # the tracker calls go on, the batch stays pending
+    for line in range(3):
+        trackers.stdout_tracker(line, run_id=1)
+    assert session.counters["write_errors"] == 1 and len(session._pending) == 3
+    locker.rollback()
+    locker.close()
+
+    session.close()
+    assert rows("SELECT value FROM Outputs WHERE run_id = 1 ORDER BY line_number") == [("0",), ("1",), ("2",)]
+    assert session.counters["failed_rows"] == 0
+
+
+@pytest.mark.parametrize("session_class", [TrackerSession, AsyncTrackerSession])
+def test_rows_of_forked_workers_are_written_when_they_exit(session_class, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    setup_db()
+    session = session_class("trackers.db", batch_size=100, flush_interval=60)
+    monkeypatch.setattr(trackers, "_session", session)
+    # the workers leave with os._exit, the rows are still pending then
+    context = multiprocessing.get_context("fork")
+    workers = [context.Process(target=write_outputs, args=(run_id, 5)) for run_id in (1, 2)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    assert [worker.exitcode for worker in workers] == [0, 0]
+    assert rows("SELECT run_id, COUNT(*) FROM Outputs GROUP BY run_id") == [(1, 5), (2, 5)]
+    session.close()
+
+
+def test_replaced_sessions_are_not_kept_alive(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    setup_db()
+    session = TrackerSession("trackers.db")
+    session.close()
+    session = weakref.ref(session)
+    gc.collect()
+    assert session() is None
+
+
+def test_async_session_writes_from_a_background_thread(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    setup_db()
+    session = AsyncTrackerSession("trackers.db", batch_size=64, flush_interval=60, queue_size=128)
+    monkeypatch.setattr(trackers, "_session", session)
+
+    for epoch in range(1000):
+        trackers.stdout_tracker("epoch {}".format(epoch), run_id=3)
+        trackers.hyperparam_tracker("SGD", "lr", 0.1, run_id=3, expr_id=1)
+    trackers.flush()
+    assert len(rows("SELECT * FROM Outputs WHERE run_id = 3")) == 1000
+    assert rows("SELECT COUNT(DISTINCT times) FROM Hyperparameters") == [(1000,)]
+    assert session.queue_depth() == 0
+    assert session.counters["max_queue_depth"] <= 128
+    session.close()
+    assert not session._writer.is_alive()
+
+
+def test_async_writer_survives_a_locked_database(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    setup_db()
+    monkeypatch.setattr(trackers, "TRACKER_BUSY_TIMEOUT", 0.05)
+    session = AsyncTrackerSession("trackers.db", batch_size=2, flush_interval=60, queue_size=100)
+    locker = sqlite3.connect("trackers.db")
+    locker.execute("BEGIN EXCLUSIVE")
+    session.record("Outputs", (1, "stdout", 0, "a"))
+    session.record("Outputs", (1, "stdout", 1, "b"))
+    deadline = time.time() + 10
+    while session.counters["write_errors"] == 0 and time.time() < deadline:
+        time.sleep(0.01)
+    # the batch went to the spill file and the writer is still running
+    assert session.counters["write_errors"] == 1 and session.counters["spilled"] == 2
+    assert session._writer.is_alive()
+    locker.rollback()
+    locker.close()
+
+    session.record("Outputs", (1, "stdout", 2, "c"))
+    session.close()
+    assert rows("SELECT value FROM Outputs ORDER BY line_number") == [("a",), ("b",), ("c",)]
+    assert session.counters["failed_rows"] == 0
+
+
+def test_async_overflow_policies(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    setup_db()
+    written = {}
+    for overflow in ("drop_oldest", "spill"):
+        session = AsyncTrackerSession("trackers.db", batch_size=64, flush_interval=60, queue_size=2,
+                                      overflow=overflow)
+        # without a writer thread the queue stays full
+        monkeypatch.setattr(session, "_start_writer", lambda: None)
+        run_id = len(written)
+        for line in range(5):
+            session.record("Outputs", (run_id, "stdout", line, str(line)))
+        session.close()
+        written[overflow] = rows("SELECT value FROM Outputs WHERE run_id = {} ORDER BY line_number".format(run_id))
+        assert session.counters["dropped" if overflow == "drop_oldest" else "spilled"] == 3
+    assert written["drop_oldest"] == [("3",), ("4",)]
+    assert written["spill"] == [("0",), ("1",), ("2",), ("3",), ("4",)]
+
+
+def test_hyperparameter_counters_are_seeded_from_the_database(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    setup_db()
+    with sqlite3.connect("trackers.db") as con:
+        con.execute("INSERT INTO Hyperparameters VALUES('C', '1.0', 5, 4, 1)")
+    session = TrackerSession("trackers.db", batch_size=100, flush_interval=60)
+    assert [session.next_times("C", 5, 1) for _ in range(3)] == [5, 6, 7]
+    assert session.next_times("C", 5, 2) == 0
+
+
+def test_shared_counters_do_not_overlap_between_processes(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    setup_db()
+    # two sessions stand for two worker processes writing the same run
+    workers = [TrackerSession("trackers.db", batch_size=100, flush_interval=60, times_mode="shared", times_block=4)
+               for _ in range(2)]
+    for step in range(10):
+        for worker in workers:
+            times = worker.next_times("lr", 1, 1)
+            worker.record("Hyperparameters", ("lr", str(step), 1, times, 1))
+    for worker in workers:
+        worker.close()
+    assert rows("SELECT COUNT(*), COUNT(DISTINCT times) FROM Hyperparameters") == [(20, 20)]
+    assert sum(worker.counters["failed_rows"] for worker in workers) == 0
+
+
+def track_learning_rates(count):
+    for step in range(count):
+        trackers.hyperparam_tracker("SGD", "lr", step, run_id=1, expr_id=3)
+
+
+def test_shared_counters_of_forked_workers(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    setup_db()
+    session = TrackerSession("trackers.db", batch_size=100, flush_interval=60, times_mode="shared", times_block=4)
+    monkeypatch.setattr(trackers, "_session", session)
+    # the parent holds a claimed block when it forks, the workers claim their own
+    track_learning_rates(1)
+    context = multiprocessing.get_context("fork")
+    workers = [context.Process(target=track_learning_rates, args=(10,)) for _ in range(3)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    assert [worker.exitcode for worker in workers] == [0, 0, 0]
+    track_learning_rates(1)
+    session.close()
+    assert rows("SELECT COUNT(*), COUNT(DISTINCT times) FROM Hyperparameters") == [(32, 32)]
+
+
+def test_sampled_trackers_keep_exact_totals(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    setup_db()
+    session = TrackerSession("trackers.db", batch_size=100, flush_interval=60)
+    monkeypatch.setattr(trackers, "_session", session)
+    monkeypatch.setattr(trackers, "line_counter", {})
+
+    for step in range(100):
+        trackers.stdout_tracker("loss {}".format(step), run_id=1, sample="every:10")
+        trackers.hyperparam_tracker("SGD", "lr", 0.1 if step < 50 else 0.01, run_id=1, expr_id=2, sample="changes")
+    for step in range(100):
+        trackers.stdout_tracker("acc {}".format(step), run_id=2, sample="first:3")
+        trackers.stdout_tracker("val {}".format(step), run_id=3, sample="reservoir:5")
+    session.flush()
+    # the reservoir is written at the end of the run
+    assert rows("SELECT COUNT(*) FROM Outputs WHERE run_id = 3") == [(0,)]
+    session.close()
+
+    assert rows("SELECT line_number FROM Outputs WHERE run_id = 1") == [(str(n),) for n in range(0, 100, 10)]
+    assert rows("SELECT value, times FROM Hyperparameters") == [("0.1", 0), ("0.01", 50)]
+    assert rows("SELECT value FROM Outputs WHERE run_id = 2") == [("acc 0",), ("acc 1",), ("acc 2",)]
+    assert rows("SELECT COUNT(*) FROM Outputs WHERE run_id = 3") == [(5,)]
+    assert rows("SELECT kind, run_id, total FROM Tracker_Counts ORDER BY run_id, kind") == \
+        [("Hyperparameters", 1, 100), ("Outputs", 1, 100), ("Outputs", 2, 100), ("Outputs", 3, 100)]
+    for spec in ("every:0", "first:-1", "reservoir:0", "changes:2"):
+        with pytest.raises(ValueError):
+            trackers.create_sampler(spec)
+
+
+def test_print_sites_are_sampled_separately(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    setup_db()
+    session = TrackerSession("trackers.db", batch_size=100, flush_interval=60)
+    monkeypatch.setattr(trackers, "_session", session)
+    monkeypatch.setattr(trackers, "line_counter", {})
+    for epoch in range(3):
+        trackers.stdout_tracker("loss {}".format(epoch), 2, sample="first:1", site=10)
+        trackers.stdout_tracker("accuracy {}".format(epoch), 2, sample="first:1", site=20)
+    session.close()
+    # the first value of each print, not only of the first print
+    assert rows("SELECT value FROM Outputs ORDER BY line_number") == [("loss 0",), ("accuracy 0",)]
+    assert rows("SELECT expr_id, total FROM Tracker_Counts ORDER BY expr_id") == [(10, 3), (20, 3)]
+
+
+def test_plots_are_stored_once_per_content(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    with sqlite3.connect("trackers.db") as con:
+        # plots stored inline by earlier versions are kept aside
+        con.execute("CREATE TABLE Plots (run_id INTEGER PRIMARY KEY, graph_file TEXT, value BLOB)")
+        con.execute("INSERT INTO Plots VALUES(1, 'old.png', x'00')")
+    setup_db()
+    session = TrackerSession("trackers.db", batch_size=100, flush_interval=60)
+    monkeypatch.setattr(trackers, "_session", session)
+
+    for name, content in [("loss.png", b"loss" * 50000), ("copy.png", b"loss" * 50000), ("acc.png", b"acc")]:
+        (tmp_path / name).write_bytes(content)
+        assert trackers.plot_tracker(name, run_id=1) == name
+    session.close()
+
+    plots = rows("SELECT number, graph_file, hash, size FROM Plots ORDER BY number")
+    assert [(number, name, size) for number, name, _, size in plots] == \
+        [(0, "loss.png", 200000), (1, "copy.png", 200000), (2, "acc.png", 3)]
+    assert plots[0][2] == plots[1][2] != plots[2][2]
+    stored = sorted(path.name for path in (tmp_path / trackers.TRACKER_PLOT_STORE).rglob("*") if path.is_file())
+    assert stored == sorted({plots[0][2], plots[2][2]})
+    with open(trackers.plot_path(plots[0][2]), "rb") as f:
+        assert f.read() == b"loss" * 50000
+    assert rows("SELECT graph_file FROM Inline_Plots") == [("old.png",)]
+
+
+def track_plots(path, count):
+    for _ in range(count):
+        trackers.plot_tracker(path, run_id=1)
+
+
+def test_plot_numbers_of_forked_workers_do_not_collide(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    setup_db()
+    session = TrackerSession("trackers.db", batch_size=100, flush_interval=60)
+    monkeypatch.setattr(trackers, "_session", session)
+    (tmp_path / "plot.png").write_bytes(b"plot")
+    track_plots("plot.png", 1)
+    session.flush()
+    context = multiprocessing.get_context("fork")
+    workers = [context.Process(target=track_plots, args=("plot.png", 3)) for _ in range(2)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    assert [worker.exitcode for worker in workers] == [0, 0]
+    track_plots("plot.png", 1)
+    session.close()
+    assert rows("SELECT number FROM Plots ORDER BY number") == [(number,) for number in range(8)]
+    assert session.counters["failed_rows"] == 0
+
+
+def test_failed_plot_copy_leaves_no_temporary_file(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "plot.png").write_bytes(b"plot")
+
+    def replace(source, target):
+        raise OSError("disk full")
+    monkeypatch.setattr(trackers.os, "replace", replace)
+    with pytest.raises(OSError):
+        trackers.store_plot("plot.png", "store")
+    assert [path for path in (tmp_path / "store").rglob("*") if path.is_file()] == []
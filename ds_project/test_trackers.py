@@ -1,7 +1,7 @@
 import parser
 
 import static_analysis
-from graph_extractor import GraphExtractor
+from syntax_tree import CompactTree
 import test_scripts
 from db_tracker import setup_db
 import time
@@ -26,8 +26,7 @@ def test_isomorphism():
     parser.set_language(language)
     byteEncodings = [bytes(it, "utf8") for it in codes]
     trees = [parser.parse(byte) for byte in byteEncodings]
-    extractor = GraphExtractor()
-    Gs = [extractor.bfs_tree_traverser(tree) for tree in trees]
+    Gs = [CompactTree.from_tree(tree, byte) for tree, byte in zip(trees, byteEncodings)]
     mappings = [extract_imports(G) for G in Gs]
     Gs = [(i, strip_graph(G, 0)) for i, G in enumerate(Gs)]
     found = find_isomorphism(Gs[0][1], Gs[3:0:-1])
@@ -51,9 +50,8 @@ def test_insertion():
     parser = Parser()
     parser.set_language(language)
     tree = parser.parse(byte_encoding)
-    extractor = GraphExtractor()
-    G = extractor.bfs_tree_traverser(tree)
-    isomorphism = dict(zip(G.nodes(), G.nodes()))
+    G = CompactTree.from_tree(tree, byte_encoding)
+    isomorphism = dict(zip(range(len(G)), range(len(G))))
     mappings = static_analysis.extract_imports(G)
     files = static_analysis.extract_files(G)
     modified = static_analysis.insert_trackers(G, byte_encoding, mappings, kb_con, isomorphism, 0, files)
@@ -1,14 +1,613 @@
+import hashlib
 import io
+import multiprocessing.util
+import os
+import pickle
+import random
 import sqlite3
-from typing import TextIO, Dict
+import tempfile
+import threading
+import time
+from collections import deque
+from typing import TextIO, Deque, Dict, List, Tuple
 from io import TextIOWrapper
 
 import matplotlib.pyplot as plt
 from matplotlib import pyplot
 
+TRACKER_DB = os.environ.get("TRACKER_DB", "trackers.db")
+TRACKER_BATCH_SIZE = int(os.environ.get("TRACKER_BATCH_SIZE", 512))
+TRACKER_FLUSH_INTERVAL = float(os.environ.get("TRACKER_FLUSH_INTERVAL", 5))
+# seconds a write waits for a lock held by another process
+TRACKER_BUSY_TIMEOUT = float(os.environ.get("TRACKER_BUSY_TIMEOUT", 5))
+# write from a background thread, with a queue of at most TRACKER_QUEUE_SIZE rows
+TRACKER_ASYNC = os.environ.get("TRACKER_ASYNC", "0") == "1"
+TRACKER_QUEUE_SIZE = int(os.environ.get("TRACKER_QUEUE_SIZE", 10000))
+TRACKER_OVERFLOW = os.environ.get("TRACKER_OVERFLOW", "block")
+# "process" numbers the hyperparameter occurrences in memory, "shared" claims
+# blocks of TRACKER_TIMES_BLOCK numbers in the database for forked workers
+TRACKER_TIMES = os.environ.get("TRACKER_TIMES", "process")
+TRACKER_TIMES_BLOCK = int(os.environ.get("TRACKER_TIMES_BLOCK", 64))
+# directory the plot files are stored in, once per content hash
+TRACKER_PLOT_STORE = os.environ.get("TRACKER_PLOT_STORE", "tracker_plots")
+PLOT_CHUNK_SIZE = 1 << 16
+
+INSERTS = {
+    "Outputs": "INSERT INTO Outputs VALUES(?, ?, ?, ?)",
+    "Hyperparameters": "INSERT INTO Hyperparameters VALUES(?, ?, ?, ?, ?)",
+    # the number of a plot is the next one of its run in the database, the
+    # writes of all processes are serialized by BEGIN IMMEDIATE
+    "Plots": "INSERT INTO Plots SELECT ?1, COALESCE(MAX(number), -1) + 1, ?2, ?3, ?4 FROM Plots WHERE run_id = ?1",
+}
+
 line_counter:Dict[TextIO, int] = {}
 
-def output_tracker(input, stream, run_id):
+
+class Sampler:
+    """
+    Decides which of the values a tracker sees are recorded, counting all of
+    them. The base class records every value.
+    """
+
+    def __init__(self):
+        self.total = 0
+        # total already written to Tracker_Counts
+        self.written_total = 0
+
+    def offer(self, value, row: Tuple[str, tuple]) -> bool:
+        """
+        :param value: value seen by the tracker
+        :param row: table and row that would record it
+        :return: True if the row is to be recorded now
+        """
+        self.total += 1
+        return True
+
+    def drain(self) -> List[Tuple[str, tuple]]:
+        """
+        :return: rows held back until the end of the run
+        """
+        return []
+
+
+class FirstSampler(Sampler):
+    def __init__(self, count: int):
+        super().__init__()
+        self.count = count
+
+    def offer(self, value, row):
+        self.total += 1
+        return self.total <= self.count
+
+
+class EverySampler(Sampler):
+    def __init__(self, step: int):
+        super().__init__()
+        self.step = step
+
+    def offer(self, value, row):
+        self.total += 1
+        return (self.total - 1) % self.step == 0
+
+
+class ChangeSampler(Sampler):
+    _unset = object()
+
+    def __init__(self):
+        super().__init__()
+        self.last = self._unset
+
+    def offer(self, value, row):
+        self.total += 1
+        value = str(value)
+        if value == self.last:
+            return False
+        self.last = value
+        return True
+
+
+class ReservoirSampler(Sampler):
+    """
+    Keeps a uniform sample of size rows, written when the session is closed.
+    """
+
+    def __init__(self, size: int):
+        super().__init__()
+        self.size = size
+        self.rows: List[Tuple[str, tuple]] = []
+
+    def offer(self, value, row):
+        self.total += 1
+        if len(self.rows) < self.size:
+            self.rows.append(row)
+        else:
+            index = random.randrange(self.total)
+            if index < self.size:
+                self.rows[index] = row
+        return False
+
+    def drain(self):
+        rows, self.rows = self.rows, []
+        return rows
+
+
+SAMPLERS = {
+    "all": lambda: Sampler(),
+    "first": FirstSampler,
+    "every": EverySampler,
+    "changes": ChangeSampler,
+    "reservoir": ReservoirSampler,
+}
+
+
+def create_sampler(spec: str) -> Sampler:
+    """
+    :param spec: sampling policy, one of "all", "first:N", "every:K",
+    "reservoir:N" and "changes", with N and K at least 1
+    :return: a new sampler following the policy
+    """
+    name, _, argument = spec.partition(":")
+    if name not in SAMPLERS:
+        raise ValueError("unknown sampling policy {}, expected one of {}".format(spec, list(SAMPLERS)))
+    try:
+        arguments = (int(argument),) if argument else ()
+        if any(value < 1 for value in arguments):
+            raise ValueError(argument)
+        return SAMPLERS[name](*arguments)
+    except (TypeError, ValueError):
+        raise ValueError("invalid argument in sampling policy {}".format(spec))
+
+
+class TrackerSession:
+    """
+    Buffers the rows written by the trackers and inserts them in one
+    transaction once batch_size rows are pending or flush_interval seconds
+    passed since the last flush. Every thread uses its own connection. The
+    session of the process is also flushed when the process exits, a forked
+    child starts it over with an empty buffer and writes its own rows when it
+    exits, also a multiprocessing worker leaving with os._exit.
+
+    The occurrences of a hyperparameter are numbered by a counter per (name,
+    expr_id, run_id). In "process" mode the counters are read from the
+    database once and then kept in memory, in "shared" mode every process
+    claims blocks of numbers in the Hyperparameter_Counters table so
+    processes writing the same run never use the same number.
+    """
+
+    TIMES_MODES = ("process", "shared")
+
+    def __init__(self, path=TRACKER_DB, batch_size=TRACKER_BATCH_SIZE, flush_interval=TRACKER_FLUSH_INTERVAL,
+                 times_mode=TRACKER_TIMES, times_block=TRACKER_TIMES_BLOCK):
+        if times_mode not in self.TIMES_MODES:
+            raise ValueError("unknown times mode {}, expected one of {}".format(times_mode, self.TIMES_MODES))
+        self.path = path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.times_mode = times_mode
+        self.times_block = times_block
+        self._reset()
+        self.counters = {"rows": 0, "flushes": 0, "failed_rows": 0, "write_errors": 0}
+
+    def _reset(self):
+        # the rows pending in the parent are flushed by the parent, the lock
+        # may have been held by another thread of the parent
+        self._lock = threading.RLock()
+        self._local = threading.local()
+        self._pending: List[Tuple[str, tuple]] = []
+        # next times per hyperparameter, read again by a forked child
+        self._times: Dict[Tuple[str, int, int], int] = {}
+        self._seeded = False
+        # end of the block of times claimed per hyperparameter in shared mode
+        self._claimed: Dict[Tuple[str, int, int], int] = {}
+        # samplers per (table, name, expr_id, run_id) of the sampled trackers
+        self._samplers: Dict[Tuple[str, str, int, int], Sampler] = {}
+        self._last_flush = time.monotonic()
+        # no flush is tried before, after the database was not writable
+        self._retry_at = 0.0
+
+    def connection(self) -> sqlite3.Connection:
+        """
+        :return: connection of the calling thread
+        """
+        con = getattr(self._local, "con", None)
+        if con is None:
+            con = self._local.con = sqlite3.connect(self.path, timeout=TRACKER_BUSY_TIMEOUT)
+        return con
+
+    def record(self, table: str, row: tuple):
+        """
+        Buffers a row and flushes the buffer if a threshold is reached.
+
+        :param table: one of the tables in INSERTS
+        :param row: values of the row
+        """
+        with self._lock:
+            self._pending.append((table, row))
+            self.counters["rows"] += 1
+            now = time.monotonic()
+            if now >= self._retry_at and (len(self._pending) >= self.batch_size or
+                                          now - self._last_flush >= self.flush_interval):
+                self.flush()
+
+    def record_sampled(self, site: Tuple[str, str, int, int], spec: str, value, row: tuple):
+        """
+        Records a row if the sampling policy of its tracker keeps it.
+
+        :param site: table, name, expr_id and run_id the tracker writes
+        :param spec: sampling policy of the tracker, see create_sampler
+        :param value: value seen by the tracker
+        :param row: values of the row
+        """
+        with self._lock:
+            sampler = self._samplers.get(site)
+            if sampler is None:
+                sampler = self._samplers[site] = create_sampler(spec)
+            if sampler.offer(value, (site[0], row)):
+                self.record(site[0], row)
+
+    def _write_totals(self):
+        """
+        Adds the values the sampled trackers saw since the last call to
+        Tracker_Counts.
+        """
+        deltas = [site + (sampler.total - sampler.written_total,)
+                  for site, sampler in self._samplers.items() if sampler.total != sampler.written_total]
+        if not deltas:
+            return
+        with self.connection() as con:
+            con.executemany("""INSERT INTO Tracker_Counts VALUES(?, ?, ?, ?, ?)
+                               ON CONFLICT(kind, name, expr_id, run_id) DO UPDATE SET total = total + excluded.total""",
+                            deltas)
+        for sampler in self._samplers.values():
+            sampler.written_total = sampler.total
+
+    def _release_samples(self):
+        """
+        Records the rows the samplers held back until the end of the run.
+        """
+        with self._lock:
+            for sampler in self._samplers.values():
+                for table, row in sampler.drain():
+                    self.record(table, row)
+
+    def next_times(self, name: str, expr_id: int, run_id: int) -> int:
+        """
+        :return: occurrence number of the next value of the hyperparameter
+        """
+        key = (name, expr_id, run_id)
+        with self._lock:
+            if self.times_mode == "shared":
+                times = self._times.get(key)
+                if times is None or times >= self._claimed[key]:
+                    times, self._claimed[key] = self._claim_times(key)
+            else:
+                if not self._seeded:
+                    self._seed_times()
+                times = self._times.get(key, 0)
+            self._times[key] = times + 1
+            return times
+
+    def _seed_times(self):
+        cur = self.connection().execute(
+            """SELECT name, expr_id, run_id, MAX(times)+1 FROM Hyperparameters GROUP BY name, expr_id, run_id""")
+        for name, expr_id, run_id, times in cur:
+            self._times[(name, expr_id, run_id)] = times
+        self._seeded = True
+
+    def _claim_times(self, key: Tuple[str, int, int]) -> Tuple[int, int]:
+        """
+        Reserves the next times_block occurrence numbers of a hyperparameter
+        for this process.
+
+        :return: first and end of the claimed numbers
+        """
+        con = self.connection()
+        con.execute("BEGIN IMMEDIATE")
+        try:
+            cur = con.execute("""SELECT next FROM Hyperparameter_Counters WHERE name = ? AND expr_id = ? AND run_id = ?""",
+                              key)
+            row = cur.fetchone()
+            if row is None:
+                cur = con.execute(
+                    """SELECT COALESCE(MAX(times), -1)+1 FROM Hyperparameters WHERE name = ? AND expr_id = ? AND run_id = ?""",
+                    key)
+                row = cur.fetchone()
+            first = row[0]
+            con.execute("""INSERT OR REPLACE INTO Hyperparameter_Counters VALUES(?, ?, ?, ?)""",
+                        key + (first + self.times_block,))
+            con.commit()
+        except BaseException:
+            con.rollback()
+            raise
+        return first, first + self.times_block
+
+    def flush(self):
+        """
+        Writes all pending rows in one transaction. If the database cannot be
+        written, e.g. because it stays locked by another process, the rows are
+        kept pending and the next flush is tried after flush_interval seconds.
+        """
+        with self._lock:
+            self._last_flush = time.monotonic()
+            try:
+                if self._pending:
+                    pending, self._pending = self._pending, []
+                    try:
+                        self.counters["failed_rows"] += self._write(pending)
+                    except sqlite3.Error:
+                        self._pending = pending + self._pending
+                        raise
+                    self.counters["flushes"] += 1
+                self._write_totals()
+            except sqlite3.Error as e:
+                print("tracker rows not written, kept until the next flush: {}".format(e))
+                self.counters["write_errors"] += 1
+                self._retry_at = self._last_flush + self.flush_interval
+
+    def _write(self, pending: List[Tuple[str, tuple]]) -> int:
+        """
+        Inserts rows with the connection of the calling thread in one
+        transaction. If a row violates a constraint the rows are written one
+        by one, the failing rows are reported and the others kept.
+
+        :return: number of rows not written
+        """
+        con = self.connection()
+        tables: Dict[str, List[tuple]] = {}
+        for table, row in pending:
+            tables.setdefault(table, []).append(row)
+        try:
+            with con:
+                con.execute("BEGIN IMMEDIATE")
+                for table, rows in tables.items():
+                    con.executemany(INSERTS[table], rows)
+            return 0
+        except sqlite3.IntegrityError:
+            failed = 0
+            for table, row in pending:
+                try:
+                    with con:
+                        con.execute("BEGIN IMMEDIATE")
+                        con.execute(INSERTS[table], row)
+                except sqlite3.IntegrityError as e:
+                    failed += 1
+                    print("tracker row not written to {}: {}".format(table, e))
+            return failed
+
+    def close(self):
+        """
+        Flushes the pending and the held back rows and closes the connection of
+        the calling thread.
+        """
+        self._release_samples()
+        self.flush()
+        with self._lock:
+            if self._pending:
+                print("{} tracker rows not written".format(len(self._pending)))
+                self.counters["failed_rows"] += len(self._pending)
+                self._pending = []
+        con = getattr(self._local, "con", None)
+        if con is not None:
+            con.close()
+            self._local.con = None
+
+
+class AsyncTrackerSession(TrackerSession):
+    """
+    Tracker session whose rows are written by a background thread, the
+    tracker calls only append them to a bounded queue. When the queue is full
+    the overflow policy either blocks the caller, drops the oldest row or
+    spills the row to a file that is written at the next flush. A batch the
+    writer cannot write, e.g. because the database stays locked, is spilled
+    as well.
+    """
+
+    OVERFLOW_POLICIES = ("block", "drop_oldest", "spill")
+
+    def __init__(self, path=TRACKER_DB, batch_size=TRACKER_BATCH_SIZE, flush_interval=TRACKER_FLUSH_INTERVAL,
+                 times_mode=TRACKER_TIMES, times_block=TRACKER_TIMES_BLOCK,
+                 queue_size=TRACKER_QUEUE_SIZE, overflow=TRACKER_OVERFLOW, spill_path=None):
+        if overflow not in self.OVERFLOW_POLICIES:
+            raise ValueError("unknown overflow policy {}, expected one of {}".format(overflow, self.OVERFLOW_POLICIES))
+        self.queue_size = queue_size
+        self.overflow = overflow
+        self.spill_path = spill_path if spill_path is not None else path + ".spill"
+        super().__init__(path, batch_size, flush_interval, times_mode, times_block)
+        self.counters.update({"dropped": 0, "spilled": 0, "max_queue_depth": 0})
+
+    def _reset(self):
+        super()._reset()
+        # the writer thread of the parent does not exist in a forked child
+        self._changed = threading.Condition(self._lock)
+        self._queue: Deque[Tuple[str, tuple]] = deque()
+        self._in_flight = 0
+        self._writer = None
+        self._stopping = False
+        self._flush_requested = False
+
+    def queue_depth(self) -> int:
+        return len(self._queue)
+
+    def record(self, table: str, row: tuple):
+        """
+        Queues a row for the writer thread, applying the overflow policy if the
+        queue is full.
+
+        :param table: one of the tables in INSERTS
+        :param row: values of the row
+        """
+        with self._changed:
+            self._start_writer()
+            self.counters["rows"] += 1
+            if len(self._queue) >= self.queue_size:
+                if self.overflow == "block":
+                    self._changed.notify_all()
+                    self._changed.wait_for(lambda: len(self._queue) < self.queue_size)
+                elif self.overflow == "drop_oldest":
+                    self._queue.popleft()
+                    self.counters["dropped"] += 1
+                else:
+                    self.counters["failed_rows"] += self._spill([(table, row)])
+                    return
+            self._queue.append((table, row))
+            self.counters["max_queue_depth"] = max(self.counters["max_queue_depth"], len(self._queue))
+            if len(self._queue) >= self.batch_size:
+                self._changed.notify_all()
+
+    def _start_writer(self):
+        if self._writer is None or not self._writer.is_alive():
+            self._stopping = False
+            self._writer = threading.Thread(target=self._drain, name="tracker-writer", daemon=True)
+            self._writer.start()
+
+    def _drain(self):
+        while True:
+            with self._changed:
+                self._changed.wait_for(self._batch_ready, timeout=self.flush_interval)
+                if not self._queue and self._stopping:
+                    break
+                pending = list(self._queue)
+                self._queue.clear()
+                self._in_flight = len(pending)
+                self._changed.notify_all()
+            failed = 0
+            try:
+                failed = self._write(pending) if pending else 0
+            except sqlite3.Error as e:
+                print("tracker rows not written, spilled until the next flush: {}".format(e))
+                with self._changed:
+                    self.counters["write_errors"] += 1
+                    failed = self._spill(pending)
+            except BaseException:
+                failed = len(pending)
+                raise
+            finally:
+                with self._changed:
+                    self._in_flight = 0
+                    self.counters["failed_rows"] += failed
+                    if pending:
+                        self.counters["flushes"] += 1
+                    self._changed.notify_all()
+        con = getattr(self._local, "con", None)
+        if con is not None:
+            con.close()
+
+    def _spill(self, rows: List[Tuple[str, tuple]]) -> int:
+        """
+        Appends rows to the spill file, called with the lock held.
+
+        :return: number of rows that could not be spilled
+        """
+        try:
+            with open(self.spill_path, "ab") as f:
+                for row in rows:
+                    pickle.dump(row, f)
+        except OSError as e:
+            print("tracker rows not spilled to {}: {}".format(self.spill_path, e))
+            return len(rows)
+        self.counters["spilled"] += len(rows)
+        return 0
+
+    def _batch_ready(self) -> bool:
+        return len(self._queue) >= min(self.batch_size, self.queue_size) or self._stopping or \
+            (self._flush_requested and bool(self._queue))
+
+    def flush(self):
+        """
+        Waits until the writer thread wrote the queued rows, then writes the
+        spilled rows.
+        """
+        with self._changed:
+            if self._writer is not None and self._writer.is_alive():
+                self._flush_requested = True
+                self._changed.notify_all()
+                self._changed.wait_for(lambda: not self._queue and not self._in_flight)
+                self._flush_requested = False
+            elif self._queue:
+                pending = list(self._queue)
+                self._queue.clear()
+                self.counters["failed_rows"] += self._write(pending)
+            if os.path.exists(self.spill_path):
+                spilled = []
+                with open(self.spill_path, "rb") as f:
+                    while True:
+                        try:
+                            spilled.append(pickle.load(f))
+                        except EOFError:
+                            break
+                # the file is kept if the database is still not writable
+                self.counters["failed_rows"] += self._write(spilled)
+                os.remove(self.spill_path)
+            self._write_totals()
+
+    def close(self):
+        """
+        Writes all rows and stops the writer thread.
+        """
+        self._release_samples()
+        with self._changed:
+            writer = self._writer
+            self._stopping = True
+            self._changed.notify_all()
+        if writer is not None:
+            writer.join()
+        super().close()
+
+
+_session = None
+_session_lock = threading.Lock()
+
+
+def get_session() -> TrackerSession:
+    """
+    :return: the tracker session of the process, created on first use
+    """
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                _session = AsyncTrackerSession() if TRACKER_ASYNC else TrackerSession()
+    return _session
+
+
+def flush():
+    """
+    Writes the rows buffered by the trackers.
+    """
+    if _session is not None:
+        _session.flush()
+
+
+def _close_session():
+    if _session is not None:
+        _session.close()
+
+
+def _register_close(*_):
+    # multiprocessing runs its finalizers at interpreter exit and when a worker
+    # process ends with os._exit, which skips atexit, the finalizer of the
+    # parent is ignored in another process
+    multiprocessing.util.Finalize(None, _close_session, exitpriority=10)
+
+
+def _after_fork():
+    # the session of the parent starts over in a forked child
+    if _session is not None:
+        _session._reset()
+    _register_close()
+
+
+_register_close()
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_after_fork)
+# a multiprocessing worker drops the finalizers registered before its fork
+multiprocessing.util.register_after_fork(_register_close, _register_close)
+
+def output_tracker(input, stream, run_id, sample=None, site=-1):
+    """
+    :param site: id of the call the tracker was inserted into, the values of
+    every call are sampled on their own
+    """
     if stream in line_counter:
         line_counter[stream] += 1
     else:
@@ -19,38 +618,77 @@ def output_tracker(input, stream, run_id):
         name = stream.name
     else:
         name = "stdout"
-    con = sqlite3.connect("trackers.db")
-    cur = con.cursor()
-    cur.execute("""INSERT INTO  Outputs VALUES(?, ?, ?, ?)""", (run_id, name, count, str(input)))
-    con.commit()
+    row = (run_id, name, count, str(input))
+    if sample is None:
+        get_session().record("Outputs", row)
+    else:
+        get_session().record_sampled(("Outputs", name, site, run_id), sample, input, row)
 
-def stdout_tracker(input, run_id: int) -> str:
-    output_tracker(input, "stdout", run_id)
+def stdout_tracker(input, run_id: int, sample: str = None, site: int = -1) -> str:
+    output_tracker(input, "stdout", run_id, sample, site)
     return str(input)
 
-def file_tracker(input: str, file: TextIO, run_id: int) -> str:
-    output_tracker(input, file, run_id)
+def file_tracker(input: str, file: TextIO, run_id: int, sample: str = None, site: int = -1) -> str:
+    output_tracker(input, file, run_id, sample, site)
     return input
 
 
+def plot_path(digest: str, store: str = TRACKER_PLOT_STORE) -> str:
+    """
+    :param digest: sha256 hex digest of a plot file
+    :param store: directory of the plot store
+    :return: path of the stored plot with the digest
+    """
+    return os.path.join(store, digest[:2], digest)
+
+
+def store_plot(graph_file: str, store: str = TRACKER_PLOT_STORE) -> Tuple[str, int]:
+    """
+    Copies a plot file into the store in chunks while hashing it. A plot
+    whose content is already stored is not stored again.
+
+    :param graph_file: path of the plot file
+    :param store: directory of the plot store
+    :return: sha256 hex digest and size of the plot
+    """
+    digest = hashlib.sha256()
+    size = 0
+    os.makedirs(store, exist_ok=True)
+    with open(graph_file, "rb") as f:
+        tmp = tempfile.NamedTemporaryFile(dir=store, delete=False)
+        try:
+            with tmp:
+                for chunk in iter(lambda: f.read(PLOT_CHUNK_SIZE), b""):
+                    digest.update(chunk)
+                    tmp.write(chunk)
+                    size += len(chunk)
+            path = plot_path(digest.hexdigest(), store)
+            if not os.path.exists(path):
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                # atomic, processes storing the same plot write the same bytes
+                os.replace(tmp.name, path)
+        finally:
+            # left over if the plot was already stored or the copy failed
+            if os.path.exists(tmp.name):
+                os.remove(tmp.name)
+    return digest.hexdigest(), size
+
+
 def plot_tracker(graph_file: str, run_id: int) -> str:
     #plt.savefig("tmp/graph.png")
-    f = open(graph_file, "rb")
-    bytes = bytearray(f.read())
-    con = sqlite3.connect("trackers.db")
-    cur = con.cursor()
-    cur.execute("""INSERT INTO Plots VALUES(?, ?, ?)""", (run_id, graph_file, bytes))
-    con.commit()
+    digest, size = store_plot(graph_file)
+    get_session().record("Plots", (run_id, graph_file, digest, size))
     return graph_file
 
-def hyperparam_tracker(function_name: str, hyperparameter:str, value, run_id: int, expr_id : int):
+def hyperparam_tracker(function_name: str, hyperparameter:str, value, run_id: int, expr_id : int, sample: str = None):
     string_value = str(value)
-    con = sqlite3.connect("trackers.db")
-    cur = con.cursor()
-    cur.execute("""SELECT COALESCE(MAX(times), -1)+1 FROM Hyperparameters WHERE name = ? AND expr_id = ? AND run_id = ?""", (hyperparameter, expr_id, run_id))
-    times = cur.fetchone()[0]
-    cur.execute("""INSERT INTO Hyperparameters VALUES(?, ?, ?, ?, ?)""", (hyperparameter, string_value, expr_id, times, run_id))
-    con.commit()
+    session = get_session()
+    times = session.next_times(hyperparameter, expr_id, run_id)
+    row = (hyperparameter, string_value, expr_id, times, run_id)
+    if sample is None:
+        session.record("Hyperparameters", row)
+    else:
+        session.record_sampled(("Hyperparameters", hyperparameter, expr_id, run_id), sample, string_value, row)
     return value
 
 
@@ -1,6 +1,7 @@
 import textwrap
-from typing import List
+from typing import List, Optional
 
+from regraph import FiniteSet
 from regraph.backends.networkx.graphs import NXGraph
 import networkx as nx
 from networkx.drawing.nx_pydot import graphviz_layout
@@ -41,11 +42,49 @@ def pattern_connected(pattern: NXGraph):
 
 
 def remove_nodes(G, ids):
+    # graphs with a batched removal drop all the nodes in one call
+    if hasattr(G, "remove_nodes_from"):
+        G.remove_nodes_from(ids)
+        return
     for id in ids:
         G.remove_node(id)
     return
 
 
+def nodes_of_type(G: NXGraph, types) -> List:
+    """
+    Finds the nodes having one of the types in a single pass over the graph,
+    or by index lookup if the graph keeps one.
+
+    :param G: an NXGraph object
+    :param types: node types to look for
+    :return: ids of the nodes having one of the types
+    """
+    types = set(types)
+    if hasattr(G, "nodes_of_type"):
+        return list(G.nodes_of_type(types))
+    return [node for node, attrs in G.nodes(data=True)
+            if "type" in attrs and not attrs["type"].fset.isdisjoint(types)]
+
+
+def present_types(G: NXGraph) -> Optional[set]:
+    """
+    :param G: an NXGraph object
+    :return: all node types in the graph, None if a node has a type that is
+    not a FiniteSet and could match any type
+    """
+    if hasattr(G, "present_types"):
+        return G.present_types()
+    types = set()
+    for _, attrs in G.nodes(data=True):
+        if "type" not in attrs:
+            continue
+        if not isinstance(attrs["type"], FiniteSet):
+            return None
+        types.update(attrs["type"].fset)
+    return types
+
+
 # creates a pattern to filter a graph based on "node type"
 # attr_name -> name given to the variable used to identify this node type
 # node_type -> the type of node that wants to be filtered